@@ -1,65 +1,102 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-import osmnx as ox
-import networkx as nx
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError, GeopyError
-import joblib
 import os
-import pandas as pd
-from datetime import datetime
-from collections import defaultdict
+import requests
+from alternatives import ALTERNATIVES, MAX_ALTERNATIVES
+from backend_client import BackendClient
+from graph_store import load_graph
+from graph_tiles import TileStore, tile_dir
+from metrics import REGISTRY, span
+from model_data import load_model_data
+from risk_table import WEATHER_CONDITIONS, load_active
+from route_engine import RouteEngine, TiledRouteEngine
+from route_render import ROUTE_ZOOM, add_route_layer, alternative_style
+from routing import ROUTE_MODES
 
 # Set page configuration for mobile-like layout
 st.set_page_config(layout="centered")
 
-# Initialize geocoder
-geolocator = Nominatim(user_agent="geoapiExercises")
+# Set NOMINATIM_FALLBACK=0 to geocode from the local gazetteer only
+use_nominatim = os.environ.get("NOMINATIM_FALLBACK", "1") != "0"
 
-# Determine the absolute path to model.joblib
-model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_model.joblib")
+# Set ROUTE_API_URL (e.g. http://127.0.0.1:3630) to route through the backend
+route_api_url = os.environ.get("ROUTE_API_URL")
 
-# Load your pre-trained model
-@st.cache_resource
-def load_model():
-    if os.path.exists(model_path):
-        return joblib.load(model_path)
-    else:
-        st.error(f"Error: log_model.joblib not found at {model_path}. Please check the file path.")
-        return None
+# Set RISK_TILES_URL to the backend serving the risk heatmap tiles; by default
+# the routing backend or the local one the login page uses
+risk_tiles_url = os.environ.get("RISK_TILES_URL", route_api_url or "http://127.0.0.1:3630")
+
+# Set ROUTE_DEBUG=1 to show the per-stage timings below the map
+show_timings = os.environ.get("ROUTE_DEBUG", "0") == "1"
+
+# Where the map opens before it is centered on a route (Breda)
+MAP_START = (51.5890, 4.7760)
 
-model = load_model()
+# Routes kept per process for repeated inputs
+ROUTE_CACHE_ENTRIES = 256
 
-# Load your data
+# Seconds backend routes are reused; the backend's risk version is not known here
+BACKEND_ROUTE_TTL = 300
+
+# Seconds the risk tile layer is reused before asking the backend for its version again
+RISK_TILES_TTL = 60
+
+# Zoom level the map opens at when it shows no route
+OVERVIEW_ZOOM = 12
+
+# Load your data, typed, from the columnar copy of model_data.csv
 @st.cache_data
 def load_csv():
-    return pd.read_csv('model_data.csv')
-
-df = load_csv()
-
-if st.button('Update Predictions'):
-    # Get current date
-    current_date = datetime.now()
-    # Extract month and day
-    month = current_date.month
-    day = current_date.day
-    # Filter dataframe for current month and day
-    X = df[(df['month'] == month) & (df['day'] == day)]
-    # Select the same columns used for training
-    X = X[['month', 'day', 'most_common_condition', 'avg_yearly_accidents', 'average_monthly_occurrences']]
-    # Make prediction
-    prediction = model.predict(X)
-    # Apply prediction to the column that is being predicted in the original DataFrame
-    df.loc[X.index, 'Risk Level'] = prediction
-    # Display confirmation
-    st.write('Predictions Updated')
+    return load_model_data()
+
+# Load the active full-year risk table published by risk_refresh.py
+def load_risk_table():
+    risk_table = load_active()
+    if risk_table is None:
+        st.warning("Risk table not found. Showing historical risk levels instead.")
+    return risk_table
+
+# Build the routing engine once per process and share it across sessions and routes
+@st.cache_resource
+def get_route_engine():
+    # Nominatim is only asked when an address is not in the local gazetteer
+    geolocator = Nominatim(user_agent="geoapiExercises") if use_nominatim else None
+    # Serve the tiled region if it was built, loading only the tiles around each route
+    with span("ui.engine_load"):
+        if TileStore.exists(tile_dir()):
+            engine = TiledRouteEngine(TileStore(tile_dir()), load_risk_table(), load_csv(), fallback_geocoder=geolocator)
+        else:
+            engine = RouteEngine(load_graph(), load_risk_table(), load_csv(), fallback_geocoder=geolocator)
+    # Swap in newly published risk tables in the background
+    engine.watch()
+    return engine
+
+# One keep-alive connection pool per backend and process
+@st.cache_resource
+def get_backend_client(base_url):
+    return BackendClient(base_url)
+
+# The backend follows published snapshots on its own, so the button only
+# exists when this page routes in-process
+if not route_api_url and st.button('Update Predictions'):
+    # Pick up a snapshot published since the last background check
+    if get_route_engine().watcher.check():
+        st.write('Predictions Updated')
+    else:
+        st.write('Predictions are already up to date')
 
 # Function to geocode an address
-@st.cache_data
 def geocode_address(address):
+    # Normalize case and spacing so equivalent inputs share a cache entry
+    return geocode_normalized(" ".join(address.split()).casefold())
+
+@st.cache_data
+def geocode_normalized(address):
     try:
-        location = geolocator.geocode(address)
+        location = get_route_engine().geocode(address)
         return location
     except GeocoderTimedOut:
         st.error("Error: Geocoding timed out. Please retry.")
@@ -68,116 +105,235 @@ def geocode_address(address):
         st.error(f"Error: {e}. Please try again later or check your internet connection.")
         return None
 
-# Function to create route map
-@st.cache_data
-def create_route_map(start_address, end_address):
+# Note shown when only the street of an address with a house number was found
+def approximate_note(address):
+    return f"No house number data for '{address}': the route uses the middle of the street."
+
+# Function to get routes from the backend /route endpoint, the best one first
+def request_route(start_address, end_address, route_mode, condition=None, alternatives=ALTERNATIVES):
+    payload = {"start": start_address, "end": end_address, "mode": route_mode, "condition": condition,
+               "alternatives": alternatives}
+    try:
+        with span("ui.request"):
+            response = get_backend_client(route_api_url).post("/route", payload)
+            result = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        st.error(f"Request failed: {e}")
+        return None
+    if result.get("status") != "success":
+        st.error(f"Error: {result.get('message', 'Routing failed')}")
+        return None
+    for endpoint in result.get("approximate", []):
+        st.info(approximate_note(start_address if endpoint == "start" else end_address))
+    return [result["route"]] + result.get("alternatives", [])
+
+# Function to compute routes in this process, the best one first
+def compute_route(start_address, end_address, route_mode, condition=None, alternatives=ALTERNATIVES):
     try:
         # Geocode addresses to coordinates
         start_location = geocode_address(start_address)
         end_location = geocode_address(end_address)
 
         if start_location and end_location:
-            # Extract coordinates
-            start_coords = (start_location.latitude, start_location.longitude)
-            end_coords = (end_location.latitude, end_location.longitude)
-
-            # Create a graph from OpenStreetMap data
-            G = ox.graph_from_place('Breda, Netherlands', network_type='drive')
-
-            # Find the nearest nodes to the start and end points
-            start_node = ox.distance.nearest_nodes(G, X=start_coords[1], Y=start_coords[0])
-            end_node = ox.distance.nearest_nodes(G, X=end_coords[1], Y=end_coords[0])
-
-            # Find the shortest path between the nodes
-            route = nx.shortest_path(G, start_node, end_node, weight='length')
-            route_coords = [(G.nodes[node]['y'], G.nodes[node]['x']) for node in route]
-
-            # Create a map centered at the midpoint between the start and end points
-            midpoint = [(start_coords[0] + end_coords[0]) / 2, (start_coords[1] + end_coords[1]) / 2]
-            route_map = folium.Map(location=midpoint, zoom_start=13)
-
-            road_segments = defaultdict(lambda: {'coords': [], 'length': 0})
-
-            # Collect road segments
-            for i in range(len(route) - 1):
-                node1 = route[i]
-                node2 = route[i + 1]
-                edge_data = G[node1][node2][0]
-                road_name = edge_data.get('name', 'Unnamed Road')
-                length = edge_data.get('length', 0)
-
-                if isinstance(road_name, str):
-                    road_segments[road_name]['coords'].append(((G.nodes[node1]['y'], G.nodes[node1]['x']),
-                                                               (G.nodes[node2]['y'], G.nodes[node2]['x'])))
-                    road_segments[road_name]['length'] += length
-
-            total_length = 0
-
-            # Add road segments to the map and display information
-            for road_name, segment_data in road_segments.items():
-                coords = segment_data['coords']
-                length = segment_data['length']
-                total_length += length
-
-                if not df[df['road_name'] == road_name].empty:
-                    risk_level = df[df['road_name'] == road_name]['Risk Level'].values[0]
-                else:
-                    risk_level = '0'  # Default risk level
-
-                # Define color based on risk level
-                if risk_level == '3':
-                    color = "red"
-                elif risk_level == '2':
-                    color = "orange"
-                elif risk_level == '1':
-                    color = 'yellow'
-                else:
-                    color = "green"
-
-                # Display road name, risk level, and length
-                st.write(f"Road Name: {road_name}, Risk Level: {risk_level}, Length: {length:.2f} meters")
-
-                # Add road segment to the map with color representation
-                for segment in coords:
-                    folium.PolyLine([segment[0], segment[1]], color=color, weight=3).add_to(route_map)
-
-            # Add markers for start and end points
-            folium.Marker(route_coords[0], popup="Start", icon=folium.Icon(color="green")).add_to(route_map)
-            folium.Marker(route_coords[-1], popup="End", icon=folium.Icon(color="red")).add_to(route_map)
-
-            # Display total road length
-            st.write(f"Total Route Length: {total_length / 1000:.2f} km")
-
-            return route_map, route_coords
+            for address, location in ((start_address, start_location), (end_address, end_location)):
+                if getattr(location, "approximate", False):
+                    st.info(approximate_note(address))
+
+            # Snap to the graph and find the cheapest path, weighing risk in safest mode
+            start = (start_location.latitude, start_location.longitude)
+            end = (end_location.latitude, end_location.longitude)
+            engine = get_route_engine().engine_for(start, end)
+            risk = engine.today_risk(condition)
+            routes = engine.alternatives_between(start, end, route_mode, risk, alternatives)
+            return [engine.payload(route, route_mode, risk) for route in routes]
 
         else:
             st.error("Error geocoding addresses. Please check the addresses and try again.")
 
     except (GeocoderTimedOut, GeocoderServiceError, GeopyError) as e:
         st.error(f"Error: {e}. Please try again later or check your internet connection.")
+    except ValueError as e:
+        st.error(f"Error: {e}.")
+
+    return None
+
+# Raised by the cached route functions on failure, so failures are not cached
+class RouteUnavailable(Exception):
+    pass
+
+# Routes are cached per input, risk table version and date, so a rerun in
+# which none changed does no geocoding, routing or network work, and routes
+# are computed again with the new day's risk after midnight
+@st.cache_data(max_entries=ROUTE_CACHE_ENTRIES, show_spinner=False)
+def cached_route(start_address, end_address, route_mode, condition, alternatives, risk_version):
+    routes = compute_route(start_address, end_address, route_mode, condition, alternatives)
+    if routes is None:
+        raise RouteUnavailable()
+    return routes
+
+@st.cache_data(max_entries=ROUTE_CACHE_ENTRIES, ttl=BACKEND_ROUTE_TTL, show_spinner=False)
+def cached_backend_route(start_address, end_address, route_mode, condition, alternatives):
+    routes = request_route(start_address, end_address, route_mode, condition, alternatives)
+    if routes is None:
+        raise RouteUnavailable()
+    return routes
+
+# Function to get routes, the best one first, from the cache when possible
+def get_routes(start_address, end_address, route_mode, condition=None, alternatives=ALTERNATIVES):
+    try:
+        if route_api_url:
+            return cached_backend_route(start_address, end_address, route_mode, condition, alternatives)
+        risk_version = get_route_engine().today_risk_version()
+        return cached_route(start_address, end_address, route_mode, condition, alternatives, risk_version)
+    except RouteUnavailable:
+        # The error was shown while computing the route
+        return None
 
-    return None, None
+# Describe the length driven at each risk level
+def risk_breakdown(route):
+    return ", ".join(
+        f"level {risk_level}: {length / 1000:.2f} km"
+        for risk_level, length in route["risk_lengths"].items() if length > 0
+    )
+
+# Function to create the route layers and describe the routes
+def create_route_map(start_address, end_address, route_mode, condition=None, alternatives=ALTERNATIVES):
+    routes = get_routes(start_address, end_address, route_mode, condition, alternatives)
+
+    if not routes:
+        return None, None
+    route = routes[0]
+
+    # Display road name, risk level, and length
+    for road in route["roads"]:
+        st.write(f"Road Name: {road['name']}, Risk Level: {road['risk_level']}, Length: {road['length']:.2f} meters")
+
+    # Display total road length
+    st.write(f"Total Route Length: {route['length'] / 1000:.2f} km")
+    st.write(f"By risk level: {risk_breakdown(route)}")
+    for i, alternative in enumerate(routes[1:], 1):
+        st.write(f"Alternative {i}: {alternative['length'] / 1000:.2f} km ({risk_breakdown(alternative)})")
+
+    with span("ui.folium"):
+        route_layers = build_route_layers(routes)
+    return route_layers, route["length"]
+
+# Function to draw routes as layers for the mounted map, the best one first.
+# The base map stays the same from rerun to rerun, so the browser keeps it
+# and only swaps these layers when the routes or their risk change.
+def build_route_layers(routes):
+    route = routes[0]
+    route_coords = [tuple(coords) for coords in route["coords"]]
+    layers = []
+
+    # Draw each alternative as a dashed layer that can be toggled, under the best route
+    for i, alternative in reversed(list(enumerate(routes[1:], 1))):
+        layer = folium.FeatureGroup(name=f"Alternative {i} ({alternative['length'] / 1000:.2f} km)")
+        add_route_layer(layer, alternative["geojson"], style_function=alternative_style)
+        layers.append(layer)
+
+    # Draw the route as one GeoJSON layer, one merged line per risk level
+    layer = folium.FeatureGroup(name=f"Best route ({route['length'] / 1000:.2f} km)")
+    add_route_layer(layer, route["geojson"])
+
+    # Add markers for start and end points
+    folium.Marker(route_coords[0], popup="Start", icon=folium.Icon(color="green")).add_to(layer)
+    folium.Marker(route_coords[-1], popup="End", icon=folium.Icon(color="red")).add_to(layer)
+    layers.append(layer)
+
+    # Center the map at the midpoint between the start and end points
+    midpoint = [(route_coords[0][0] + route_coords[-1][0]) / 2, (route_coords[0][1] + route_coords[-1][1]) / 2]
+    layer_control = folium.LayerControl(collapsed=False) if len(routes) > 1 else None
+    return {"layers": layers, "center": midpoint, "layer_control": layer_control}
+
+# Describe the risk heatmap tile layer; its URLs change with the risk version
+@st.cache_data(ttl=RISK_TILES_TTL, show_spinner=False)
+def risk_tiles_info():
+    response = get_backend_client(risk_tiles_url).get("/risk-tiles")
+    response.raise_for_status()
+    return response.json()
+
+# Function to draw today's risk of every road as a layer of pre-rendered tiles
+def risk_tile_layer():
+    try:
+        info = risk_tiles_info()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        st.warning(f"Risk map unavailable: {e}")
+        return None
+    layer = folium.FeatureGroup(name="Today's risk on every road")
+    folium.TileLayer(
+        tiles=f"{risk_tiles_url}{info['url']}", attr="Risk predictions", min_zoom=info["min_zoom"],
+        max_native_zoom=info["max_zoom"], overlay=True, bounds=info["bounds"],
+    ).add_to(layer)
+    return layer
 
 # Main Streamlit application
 def main():
     st.title("Route Navigation and Model Prediction")
+    route_section()
 
+# Route inputs, map and statistics; changing an input reruns only this fragment
+@st.fragment
+def route_section():
+    with span("ui.fragment"):
+        show_route_section()
+
+def show_route_section():
     # Sidebar for user input
     start_address = st.text_input("Enter Starting Address:", "Breda")
     end_address = st.text_input("Enter Ending Address:", "Breda University of Applied Sciences")
+    route_mode = st.radio("Route Preference:", list(ROUTE_MODES), format_func=str.capitalize, horizontal=True)
 
-    # Display the route map
-    route_map, route_coords = create_route_map(start_address, end_address)
+    # Weather to plan for; None keeps the historically most common weather of the day
+    conditions = list(WEATHER_CONDITIONS) if route_api_url else get_route_engine().conditions()
+    condition = st.selectbox(
+        "Weather:",
+        [None] + conditions,
+        format_func=lambda code: "Usual for today" if code is None else WEATHER_CONDITIONS.get(code, f"Condition {code}"),
+    )
 
-    if route_map:
-        st.subheader("Route Map:")
-        st_folium(route_map, width=600, height=500)
+    # Number of routes to compare, the best one included
+    alternatives = st.slider("Routes to compare:", 1, MAX_ALTERNATIVES, ALTERNATIVES)
 
-        # Display route information
-        if 'G' in globals():  # Check if G is defined in the global scope
-            route_distance = sum(ox.utils_graph.get_route_edge_attributes(G, route_coords, 'length')) / 1000  # in km
-            route_info = f"Approx. Distance: {route_distance:.2f} km"
+    # Risk of every road under the routes, from tiles the backend renders once per risk version
+    show_risk = st.toggle("Show today's risk on every road")
+
+    # Display the route map
+    with span("ui.route_map"):
+        route_layers, route_length = create_route_map(start_address, end_address, route_mode, condition, alternatives)
+    risk_layer = risk_tile_layer() if show_risk else None
+
+    if route_layers or risk_layer:
+        st.subheader("Route Map:" if route_layers else "Risk Map:")
+        layers = ([risk_layer] if risk_layer else []) + (route_layers["layers"] if route_layers else [])
+        zoom = ROUTE_ZOOM if route_layers else OVERVIEW_ZOOM
+        # Return nothing to the app, so panning and zooming the map do not rerun it
+        with span("ui.st_folium"):
+            st_folium(
+                folium.Map(location=MAP_START, zoom_start=ROUTE_ZOOM), key="route_map", width=600, height=500,
+                returned_objects=[], feature_group_to_add=layers,
+                center=route_layers["center"] if route_layers else MAP_START, zoom=zoom,
+                layer_control=route_layers["layer_control"] if route_layers else None,
+            )
+
+        # Display route information, from the length the route summary carries
+        if route_layers:
+            route_info = f"Approx. Distance: {route_length / 1000:.2f} km"
             st.markdown(f"<h3 style='text-align: center;'>{route_info}</h3>", unsafe_allow_html=True)
 
+    if not route_api_url:
+        with st.expander("Route cache statistics"):
+            st.json(get_route_engine().stats())
+
+    # Timings of this Streamlit process; backend stages are served at /metrics
+    if show_timings:
+        with st.expander("Timings", expanded=True):
+            st.dataframe(
+                [{"stage": name, **summary} for name, summary in REGISTRY.snapshot()["stages"].items()],
+                hide_index=True,
+            )
+
 if __name__ == "__main__":
-    main()
+    # Time every full rerun of the page; fragment reruns are timed as ui.fragment
+    with span("ui.rerun"):
+        main()
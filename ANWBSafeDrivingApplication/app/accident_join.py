@@ -0,0 +1,468 @@
+"""
+Offline spatial join of historical incidents to road graph edges.
+
+Joining risk by road name leaves unnamed roads and roads with several names
+without a risk, and gives every road sharing a name the same risk however
+far apart its parts are. This stage instead assigns each incident to the
+nearest drive edge with an STRtree over the edge geometries. It then
+aggregates the incidents into per-edge features and a risk level, keyed by
+CSR edge position and (u, v, key) edge id.
+
+Both directions of a two-way road, and parallel edges between the same
+nodes, form one physical segment and share its incidents.
+
+Incident files are read in chunks, and the chunks are matched in a process
+pool with a few chunks in flight per worker, so memory stays bounded
+however large the file is. The result is
+saved as flat arrays that the app loads and aligns to its graph in
+O(edges).
+
+Usage:
+    python accident_join.py incidents.csv --lat latitude --lon longitude
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from routing import CSRGraph, project_coords
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+EDGE_ACCIDENTS_PATH = os.path.join(APP_DIR, "edge_accidents.npz")
+
+# Incidents further than this from any drive edge are dropped, in metres
+MAX_DISTANCE = 50.0
+
+# Incidents read and matched at a time
+CHUNK_SIZE = 200000
+
+# Chunks read ahead per pool worker; further chunks are read as results come back
+CHUNKS_IN_FLIGHT = 2
+
+# Weight of severity against frequency in the risk score, as in the model notebook
+WEIGHT_INCIDENTS = 1
+WEIGHT_SEVERITY = 2
+
+# Segment tree of the current process, set by `_init_worker`
+_worker = None
+
+
+class SegmentIndex:
+    """
+    STRtree over the physical road segments of a graph.
+
+    Attributes:
+        lat0 (float): Reference latitude of the metric projection.
+        edge_segment (np.ndarray): Segment number per CSR edge position.
+        num_segments (int): The number of segments.
+    """
+
+    def __init__(self, G, csr_graph):
+        self.lat0 = float(csr_graph.lat.mean()) if len(csr_graph.lat) else 0.0
+
+        segment_of = {}
+        lines = []
+        self.edge_segment = np.empty(csr_graph.num_edges, dtype=np.int32)
+        for edge in range(csr_graph.num_edges):
+            u, v, key = csr_graph.edge_id(edge)
+            pair = (min(u, v), max(u, v))
+            segment = segment_of.get(pair)
+            if segment is None:
+                segment = segment_of[pair] = len(lines)
+                lines.append(self._line(G, u, v, key))
+            self.edge_segment[edge] = segment
+        self.num_segments = len(lines)
+        self._tree = STRtree(lines)
+
+    def _line(self, G, u, v, key):
+        geometry = G[u][v][key].get("geometry")
+        if geometry is not None:
+            lon, lat = np.asarray(geometry.coords).T
+        else:
+            lat = np.array([G.nodes[u]["y"], G.nodes[v]["y"]])
+            lon = np.array([G.nodes[u]["x"], G.nodes[v]["x"]])
+        x, y = project_coords(lat, lon, self.lat0)
+        return shapely.linestrings(np.column_stack((x, y)))
+
+    def nearest(self, lat, lon, max_distance=MAX_DISTANCE):
+        """
+        Finds the nearest segment of many points.
+
+        Args:
+            lat (np.ndarray): Latitudes in degrees.
+            lon (np.ndarray): Longitudes in degrees.
+            max_distance (float): Points further away get no segment.
+
+        Returns:
+            np.ndarray: The segment per point, -1 where none is in range.
+        """
+        x, y = project_coords(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), self.lat0)
+        points = shapely.points(x, y)
+        segment = np.full(len(points), -1, dtype=np.int32)
+        (point_idx, tree_idx) = self._tree.query_nearest(points, max_distance=max_distance, all_matches=False)
+        segment[point_idx] = tree_idx
+        return segment
+
+
+def _init_worker(index, snapshot_path):
+    # With fork the parent's index is inherited; with spawn it is rebuilt
+    global _worker
+    if index is None:
+        from graph_store import load_snapshot
+
+        G = load_snapshot(snapshot_path)
+        index = SegmentIndex(G, CSRGraph(G))
+    _worker = index
+
+
+def match_chunk(task):
+    """
+    Matches a chunk of incidents to segments and aggregates them.
+
+    Runs in a pool worker initialized by `_init_worker`.
+
+    Args:
+        task (tuple): Latitude, longitude, year, month and severity arrays,
+            and the distance limit.
+
+    Returns:
+        pd.DataFrame: Incident count and severity sum per (segment, year, month).
+    """
+    lat, lon, year, month, severity, max_distance = task
+    segment = _worker.nearest(lat, lon, max_distance)
+    matched = segment >= 0
+    frame = pd.DataFrame({
+        "segment": segment[matched],
+        "year": year[matched],
+        "month": month[matched],
+        "severity": severity[matched],
+    })
+    return frame.groupby(["segment", "year", "month"]).agg(
+        incidents=("severity", "size"), severity_sum=("severity", "sum")
+    )
+
+
+def bounded_imap(pool, func, items, window):
+    """
+    Maps a function over items in a pool, in order, with at most `window`
+    items submitted and not yet returned.
+
+    Pool.imap reads its whole input ahead of the workers, which for a chunk
+    generator means parsing and queueing the entire file at once.
+
+    Args:
+        pool (multiprocessing.pool.Pool): The pool.
+        func: The function, which must be picklable.
+        items: Iterable of arguments, read only as results come back.
+        window (int): Items in flight at most.
+
+    Yields:
+        The results, in the order of the items.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def read_chunks(path, lat_column, lon_column, time_column, severity_column, chunk_size, max_distance):
+    """
+    Streams incident chunks as plain arrays for the workers.
+
+    Args:
+        path (str): The incident CSV.
+        lat_column (str): The latitude column.
+        lon_column (str): The longitude column.
+        time_column (str): The incident timestamp column.
+        severity_column (str): The severity column; digits are extracted
+            from values like 'Severity 2'. Missing severities count as 0.
+        chunk_size (int): Rows per chunk.
+        max_distance (float): The matching distance limit.
+
+    Yields:
+        tuple: One `match_chunk` task per chunk.
+    """
+    columns = [lat_column, lon_column, time_column] + ([severity_column] if severity_column else [])
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size):
+        chunk = chunk.dropna(subset=[lat_column, lon_column, time_column])
+        when = pd.to_datetime(chunk[time_column], errors="coerce")
+        valid = when.notna().to_numpy()
+        if severity_column:
+            severity = pd.to_numeric(
+                chunk[severity_column].astype(str).str.extract(r"(\d+)")[0], errors="coerce"
+            ).fillna(0).to_numpy(np.float32)
+        else:
+            severity = np.zeros(len(chunk), dtype=np.float32)
+        yield (
+            chunk[lat_column].to_numpy(np.float64)[valid],
+            chunk[lon_column].to_numpy(np.float64)[valid],
+            when.dt.year.to_numpy()[valid].astype(np.int16),
+            when.dt.month.to_numpy()[valid].astype(np.int8),
+            severity[valid],
+            max_distance,
+        )
+
+
+class EdgeAccidentTable:
+    """
+    Incident features and risk level per graph edge.
+
+    Arrays are in CSR edge position order of the graph they were joined
+    on, with the (u, v, key) edge ids to realign them to another build.
+
+    Attributes:
+        u (np.ndarray): Edge start node ids.
+        v (np.ndarray): Edge end node ids.
+        key (np.ndarray): Edge keys.
+        incidents (np.ndarray): Incidents matched to the edge's segment.
+        avg_yearly_accidents (np.ndarray): Mean incidents per year with any.
+        average_monthly_occurrences (np.ndarray): Mean incidents per month with any.
+        average_incident_severity (np.ndarray): Mean severity of the incidents.
+        risk_level (np.ndarray): int8 risk level 0-3, by quartile of risk score.
+        version (str): Identifies the join run.
+    """
+
+    FEATURES = ("incidents", "avg_yearly_accidents", "average_monthly_occurrences", "average_incident_severity")
+
+    def __init__(self, u, v, key, features, risk_level, version):
+        self.u = u
+        self.v = v
+        self.key = key
+        for name in self.FEATURES:
+            setattr(self, name, features[name])
+        self.risk_level = risk_level
+        self.version = version
+
+    @classmethod
+    def from_aggregates(cls, csr_graph, edge_segment, num_segments, aggregates, version):
+        """
+        Turns (segment, year, month) aggregates into per-edge features.
+
+        Args:
+            csr_graph (CSRGraph): The routing graph.
+            edge_segment (np.ndarray): Segment number per edge position.
+            num_segments (int): The number of segments.
+            aggregates (pd.DataFrame): Output of `match_chunk`, summed.
+            version (str): Identifies the join run.
+
+        Returns:
+            EdgeAccidentTable: The table.
+        """
+        per_segment = aggregates.groupby(level="segment")[["incidents", "severity_sum"]].sum()
+        yearly = aggregates.groupby(level=["segment", "year"])["incidents"].sum().groupby(level="segment").mean()
+        monthly = aggregates.groupby(level=["segment", "month"])["incidents"].sum().groupby(level="segment").mean()
+
+        def dense(series):
+            values = np.zeros(num_segments, dtype=np.float32)
+            values[series.index.to_numpy()] = series.to_numpy()
+            return values
+
+        incidents = dense(per_segment["incidents"])
+        severity = np.divide(
+            dense(per_segment["severity_sum"]), incidents, out=np.zeros(num_segments, dtype=np.float32), where=incidents > 0
+        )
+        segment_features = {
+            "incidents": incidents,
+            "avg_yearly_accidents": dense(yearly),
+            "average_monthly_occurrences": dense(monthly),
+            "average_incident_severity": severity,
+        }
+
+        # Risk score as in the model notebook, min-max scaled and cut at quartiles
+        def scaled(values):
+            span = values.max() - values.min() if len(values) else 0
+            return (values - values.min()) / span if span else np.zeros_like(values)
+
+        score = WEIGHT_INCIDENTS * scaled(segment_features["average_monthly_occurrences"]) \
+            + WEIGHT_SEVERITY * scaled(severity)
+        hit = incidents > 0
+        risk_level = np.zeros(num_segments, dtype=np.int8)
+        if hit.any():
+            quartiles = np.quantile(score[hit], [0.25, 0.5, 0.75])
+            risk_level[hit] = np.searchsorted(quartiles, score[hit], side="right").astype(np.int8)
+
+        node_ids = csr_graph.node_ids
+        features = {name: values[edge_segment] for name, values in segment_features.items()}
+        return cls(
+            node_ids[csr_graph.tails], node_ids[csr_graph.heads], csr_graph.keys.copy(),
+            features, risk_level[edge_segment], version,
+        )
+
+    @classmethod
+    def load(cls, path=EDGE_ACCIDENTS_PATH):
+        """
+        Reads a table written by `save`.
+
+        Args:
+            path (str): The table file.
+
+        Returns:
+            EdgeAccidentTable: The table.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            features = {name: data[name] for name in cls.FEATURES}
+            return cls(data["u"], data["v"], data["key"], features, data["risk_level"], str(data["version"]))
+
+    def save(self, path=EDGE_ACCIDENTS_PATH):
+        """
+        Writes the table to disk, replacing any previous file atomically.
+
+        Args:
+            path (str): The table file.
+        """
+        tmp_path = f"{path}.tmp.npz"
+        features = {name: getattr(self, name) for name in self.FEATURES}
+        np.savez(tmp_path, u=self.u, v=self.v, key=self.key, risk_level=self.risk_level,
+                 version=np.array(self.version), **features)
+        os.replace(tmp_path, path)
+
+    def align(self, csr_graph, values):
+        """
+        Reorders a per-edge array to the edge positions of a graph.
+
+        A table joined on the same graph build lines up already; otherwise
+        edges are matched by (u, v, key) and missing ones get zero.
+
+        Args:
+            csr_graph (CSRGraph): The routing graph.
+            values (np.ndarray): A per-edge array of this table.
+
+        Returns:
+            np.ndarray: The values in `csr_graph` edge position order.
+        """
+        node_ids = csr_graph.node_ids
+        if len(self.u) == csr_graph.num_edges and (
+            np.array_equal(self.u, node_ids[csr_graph.tails])
+            and np.array_equal(self.v, node_ids[csr_graph.heads])
+            and np.array_equal(self.key, csr_graph.keys)
+        ):
+            return values
+
+        position = {edge: i for i, edge in enumerate(zip(self.u.tolist(), self.v.tolist(), self.key.tolist()))}
+        aligned = np.zeros(csr_graph.num_edges, dtype=values.dtype)
+        for edge in range(csr_graph.num_edges):
+            i = position.get(csr_graph.edge_id(edge))
+            if i is not None:
+                aligned[edge] = values[i]
+        return aligned
+
+
+def load_edge_history(csr_graph, path=EDGE_ACCIDENTS_PATH):
+    """
+    Loads the historical risk level per edge of a graph, if a join was run.
+
+    Args:
+        csr_graph (CSRGraph): The routing graph.
+        path (str): The table file.
+
+    Returns:
+        np.ndarray: int8 risk level per edge position, or None.
+    """
+    if not os.path.exists(path):
+        return None
+    table = EdgeAccidentTable.load(path)
+    return table.align(csr_graph, table.risk_level)
+
+
+def join_incidents(G, incidents_path, lat_column="latitude", lon_column="longitude", time_column="event_start",
+                   severity_column="incident_severity", workers=None, chunk_size=CHUNK_SIZE,
+                   max_distance=MAX_DISTANCE, snapshot_path=None):
+    """
+    Matches every incident of a file to its nearest edge and aggregates them.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        incidents_path (str): The incident CSV.
+        lat_column (str): The latitude column.
+        lon_column (str): The longitude column.
+        time_column (str): The incident timestamp column.
+        severity_column (str): The severity column, or None.
+        workers (int): Pool size, the CPU count by default; 1 matches in-process.
+        chunk_size (int): Incidents per chunk.
+        max_distance (float): Incidents further from any edge are dropped, in metres.
+        snapshot_path (str): Graph snapshot that spawned workers rebuild the index from.
+
+    Returns:
+        EdgeAccidentTable: The per-edge table.
+    """
+    start = time.perf_counter()
+    csr_graph = CSRGraph(G)
+    index = SegmentIndex(G, csr_graph)
+    logger.info(f"Indexed {index.num_segments} segments in {time.perf_counter() - start:.1f}s")
+
+    workers = workers or os.cpu_count() or 1
+    chunks = read_chunks(incidents_path, lat_column, lon_column, time_column, severity_column, chunk_size, max_distance)
+    pool = None
+    if workers > 1:
+        forked = multiprocessing.get_start_method() == "fork"
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(index if forked else None, snapshot_path))
+        results = bounded_imap(pool, match_chunk, chunks, CHUNKS_IN_FLIGHT * workers)
+    else:
+        _init_worker(index, snapshot_path)
+        results = map(match_chunk, chunks)
+
+    # Fold chunk aggregates as they arrive so only one summary is held
+    aggregates = None
+    matched = 0
+    try:
+        for i, partial in enumerate(results, 1):
+            matched += int(partial["incidents"].sum())
+            aggregates = partial if aggregates is None else aggregates.add(partial, fill_value=0)
+            logger.info(f"Matched chunk {i}, {matched} incidents so far")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if aggregates is None:
+        aggregates = pd.DataFrame(
+            {"incidents": [], "severity_sum": []},
+            index=pd.MultiIndex.from_arrays([[], [], []], names=["segment", "year", "month"]),
+        )
+    version = time.strftime("%Y%m%dT%H%M%S")
+    table = EdgeAccidentTable.from_aggregates(csr_graph, index.edge_segment, index.num_segments, aggregates, version)
+    logger.info(f"Joined {matched} incidents to {int((table.incidents > 0).sum())} edges "
+                f"in {time.perf_counter() - start:.1f}s")
+    return table
+
+
+def main():
+    from graph_store import load_graph, snapshot_path
+
+    parser = argparse.ArgumentParser(description="Join incident records to road graph edges.")
+    parser.add_argument("incidents")
+    parser.add_argument("--lat", default="latitude")
+    parser.add_argument("--lon", default="longitude")
+    parser.add_argument("--time", default="event_start")
+    parser.add_argument("--severity", default="incident_severity", help="Severity column, empty for none")
+    parser.add_argument("--max-distance", type=float, default=MAX_DISTANCE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--out", default=EDGE_ACCIDENTS_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    table = join_incidents(
+        load_graph(download=False), args.incidents, args.lat, args.lon, args.time, args.severity or None,
+        args.workers, args.chunk_size, args.max_distance, snapshot_path(),
+    )
+    table.save(args.out)
+    logger.info(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
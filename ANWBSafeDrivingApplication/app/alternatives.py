@@ -0,0 +1,232 @@
+"""
+Alternative routes from two shortest-path trees.
+
+Alternatives are found with the via-node method: the route through a node v
+is the cheapest route from the start to v followed by the cheapest route
+from v to the end. A tree grown forward from the start and a tree grown
+backward from the end give these routes for every node at once, so any
+number of alternatives costs two searches. Both run in the calling thread:
+they are bounded by the cost limit of the alternatives, and forking worker
+processes from the threaded servers the engine runs in is not safe.
+
+Candidates are taken in order of cost. One is kept if it costs at most
+MAX_STRETCH times the best route, does not visit a node twice and shares at
+most MAX_SHARING of its length with every route already kept.
+
+Usage:
+    python alternatives.py --pairs 20 -k 3    # time k alternatives against one route
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+import networkx as nx
+import numpy as np
+
+from routing import ROUTE_MODES
+
+logger = logging.getLogger(__name__)
+
+# Routes offered by default, the best one included
+ALTERNATIVES = 3
+
+# Most routes a request may ask for
+MAX_ALTERNATIVES = 5
+
+# Highest cost of an alternative relative to the best route
+MAX_STRETCH = 1.4
+
+# Largest share of an alternative's length it may have in common with another route
+MAX_SHARING = 0.7
+
+# Via nodes examined before giving up on finding more alternatives
+MAX_CANDIDATES = 500
+
+def via_routes(csr_graph, forward, backward, costs, primary_edges, k=ALTERNATIVES, max_stretch=MAX_STRETCH,
+               max_sharing=MAX_SHARING, max_candidates=MAX_CANDIDATES):
+    """
+    Picks alternative routes from a forward and a backward search tree.
+
+    Args:
+        csr_graph (CSRGraph): The routing graph.
+        forward (tuple): Tree from the start, from `CSRGraph.search_tree`.
+        backward (tuple): Reverse tree from the end.
+        costs (np.ndarray): Cost per edge position the trees were grown with.
+        primary_edges (list): Edge positions of the best route.
+        k (int): The number of routes wanted, the best one included.
+        max_stretch (float): Highest cost relative to the best route.
+        max_sharing (float): Largest share of length in common with a kept route.
+        max_candidates (int): Via nodes examined at most.
+
+    Returns:
+        list: Edge positions per route, the best route first.
+    """
+    forward_dist, forward_via = forward
+    backward_dist, backward_via = backward
+    heads, tails, length = csr_graph.heads, csr_graph.tails, csr_graph.length
+
+    routes = [list(primary_edges)]
+    edge_sets = [set(primary_edges)]
+    limit = max_stretch * float(costs[primary_edges].sum())
+    total = forward_dist + backward_dist
+    candidates = np.flatnonzero(total <= limit)
+    candidates = candidates[np.argsort(total[candidates], kind="stable")]
+
+    # Nodes on a route already examined lead to (nearly) the same route again
+    seen = set(tails[primary_edges].tolist()) | set(heads[primary_edges].tolist())
+    examined = 0
+    for via in candidates.tolist():
+        if len(routes) >= k or examined >= max_candidates:
+            break
+        if via in seen:
+            continue
+        examined += 1
+
+        edges = []
+        node = via
+        while forward_via[node] >= 0:
+            edges.append(int(forward_via[node]))
+            node = tails[forward_via[node]]
+        edges.reverse()
+        node = via
+        while backward_via[node] >= 0:
+            edges.append(int(backward_via[node]))
+            node = heads[backward_via[node]]
+
+        nodes = tails[edges].tolist() + [int(heads[edges[-1]])] if edges else []
+        seen.update(nodes)
+        if len(set(nodes)) < len(nodes):
+            continue
+
+        route_length = float(length[edges].sum())
+        if any(
+            float(length[list(edge_set.intersection(edges))].sum()) > max_sharing * route_length
+            for edge_set in edge_sets
+        ):
+            continue
+        routes.append(edges)
+        edge_sets.append(set(edges))
+    return routes
+
+
+class RouteSet:
+    """
+    Routes between the same two nodes, stored as one route cache entry.
+
+    Attributes:
+        routes (list): RouteResults, the best one first.
+    """
+
+    __slots__ = ("routes",)
+
+    def __init__(self, routes):
+        self.routes = routes
+
+    @property
+    def nbytes(self):
+        return sum(route.nbytes for route in self.routes)
+
+
+class AlternativeSearch:
+    """
+    Grows the search trees of alternative routes.
+
+    Attributes:
+        csr_graph (CSRGraph): The routing graph.
+    """
+
+    def __init__(self, csr_graph):
+        self.csr_graph = csr_graph
+        # The backward tree needs the reverse adjacency; built once up front
+        csr_graph.reverse_adjacency()
+
+    def routes(self, source, target, primary_edges, edge_risk, alpha, k=ALTERNATIVES):
+        """
+        Finds up to k routes, the given best route first.
+
+        Args:
+            source (int): The OSM id of the start node.
+            target (int): The OSM id of the end node.
+            primary_edges (list): Edge positions of the best route.
+            edge_risk (np.ndarray): Risk level per edge position.
+            alpha (float): The risk weight of the route mode.
+            k (int): The number of routes wanted.
+
+        Returns:
+            list: Edge positions per route.
+        """
+        costs = self.csr_graph.edge_costs(edge_risk, alpha)
+        limit = MAX_STRETCH * float(costs[primary_edges].sum())
+        forward = self.csr_graph.search_tree(source, costs, limit, False, target)
+        backward = self.csr_graph.search_tree(target, costs, limit, True, source)
+        return via_routes(self.csr_graph, forward, backward, costs, primary_edges, k)
+
+
+def benchmark(engine, pairs=20, k=ALTERNATIVES, mode="safest", seed=0):
+    """
+    Times k alternatives against a single route on random node pairs.
+
+    Args:
+        engine (RouteEngine): The routing engine.
+        pairs (int): The number of origin-destination pairs.
+        k (int): The number of routes asked for.
+        mode (str): A key of ROUTE_MODES.
+        seed (int): The random seed for picking pairs.
+
+    Returns:
+        dict: Median milliseconds for one route and for k routes, and the
+        mean number of routes found.
+    """
+    rng = random.Random(seed)
+    nodes = engine.csr_graph.node_ids.tolist()
+    risk = engine.today_risk()
+    # Build the reverse adjacency outside the timings
+    try:
+        engine.alternatives(nodes[0], nodes[-1], mode, risk, k)
+    except nx.NetworkXNoPath:
+        pass
+    single, multiple, found = [], [], []
+    for _ in range(pairs):
+        source, target = rng.choice(nodes), rng.choice(nodes)
+        engine.route_cache.clear()
+        start = time.perf_counter()
+        try:
+            engine.route(source, target, mode, risk)
+        except nx.NetworkXNoPath:
+            continue
+        single.append(time.perf_counter() - start)
+
+        engine.route_cache.clear()
+        start = time.perf_counter()
+        routes = engine.alternatives(source, target, mode, risk, k)
+        multiple.append(time.perf_counter() - start)
+        found.append(len(routes))
+
+    return {
+        "single": 1000 * statistics.median(single),
+        "alternatives": 1000 * statistics.median(multiple),
+        "found": statistics.mean(found),
+    }
+
+
+def main():
+    from route_engine import RouteEngine
+
+    parser = argparse.ArgumentParser(description="Benchmark alternative route search.")
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("-k", type=int, default=ALTERNATIVES)
+    parser.add_argument("--mode", choices=list(ROUTE_MODES), default="safest")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    engine = RouteEngine.load(download=False)
+    result = benchmark(engine, args.pairs, args.k, args.mode)
+    print(f"1 route: {result['single']:.1f} ms median")
+    print(f"{args.k} routes: {result['alternatives']:.1f} ms median, {result['found']:.1f} found on average")
+
+
+if __name__ == "__main__":
+    main()
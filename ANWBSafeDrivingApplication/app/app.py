@@ -1,41 +1,99 @@
 # Backend logic
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, redirect, request, jsonify, url_for
 from flask_cors import CORS
+from geopy.geocoders import Nominatim
+from geopy.exc import GeopyError
+import gc
 import hashlib
 import logging
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    handlers=[logging.FileHandler("app.log", mode="w"),
-              logging.StreamHandler()],
-)
+import math
+import os
+import time
+import networkx as nx
+from alternatives import MAX_ALTERNATIVES
+from metrics import REGISTRY, queue_logging
+from risk_tiles import VERSION_PATTERN, RiskTileCache
+from route_engine import load_engine
+from routing import ROUTE_MODES
+from user_store import PasswordHasher, UserStore, dummy_hash, needs_rehash
+
+# Configure logging; records are written by a background thread so request
+# threads never wait on the log file
+queue_logging(logging.FileHandler("app.log", mode="w"), logging.StreamHandler())
 
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
-# Hardcoded users (initial)
-hardcoded_users = {
+# Build the routing engine before gunicorn forks its workers (preload_app),
+# so every worker shares the graph and risk arrays instead of copying them.
+# A tiled engine loads the tiles around each route in the worker instead.
+try:
+    route_engine = load_engine(
+        download=False,
+        fallback_geocoder=(
+            Nominatim(user_agent="geoapiExercises")
+            if os.environ.get("NOMINATIM_FALLBACK", "1") != "0"
+            else None
+        ),
+    )
+except FileNotFoundError as e:
+    logger.warning(f"Routing disabled: {e}")
+    route_engine = None
+
+# Heatmap tiles of today's risk on every road, rendered on first request and
+# read from disk after that
+risk_tiles = RiskTileCache(route_engine) if route_engine is not None else None
+
+# Accounts live in a SQLite file shared by all workers. The initial users
+# keep their old SHA-256 hashes until they next log in.
+user_store = UserStore()
+user_store.seed({
     "user": hashlib.sha256("1".encode()).hexdigest(),
     "user2@example.com": hashlib.sha256("password2".encode()).hexdigest(),
     "user3@example.com": hashlib.sha256("password3".encode()).hexdigest(),
-}
+})
+
+# Passwords are hashed in a small bounded pool so login bursts cannot take
+# every request thread; requests beyond its queue get a 503
+password_hasher = PasswordHasher()
+# Hashed up front, so the first login to an unknown account is not the slow one
+dummy_hash()
+
+# Keep the preloaded objects out of the garbage collector, which would
+# otherwise touch them and copy their pages in each forked worker
+gc.freeze()
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
 
 
-def hash_password(password):
+@app.after_request
+def record_timing(response):
+    # Time every handler into the histograms served by /metrics
+    if request.endpoint is not None and "request_start" in g:
+        REGISTRY.observe(f"http.{request.endpoint}", time.perf_counter() - g.request_start)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
     """
-    Hashes a password using SHA-256.
+    Serves the request and stage timings of this worker.
 
-    Args:
-        password (str): The password to hash.
+    Takes an optional 'format' query parameter: 'json' (the default) for
+    count, mean, max, p50, p95 and p99 per stage in milliseconds, or
+    'prometheus' for the histogram buckets in the Prometheus text format.
 
     Returns:
-        str: The hashed password.
+        The timings.
     """
-    return hashlib.sha256(password.encode()).hexdigest()
+    if request.args.get("format") == "prometheus":
+        return Response(REGISTRY.prometheus(), mimetype="text/plain; version=0.0.4")
+    return jsonify(REGISTRY.snapshot())
 
 
 def validate_login_data(data):
@@ -68,12 +126,17 @@ def authenticate_user(username, password):
 
     Returns:
         tuple: A tuple containing the status and response message.
+
+    Raises:
+        TimeoutError: If password hashing is busy.
     """
-    hashed_password = hash_password(password)
-    if (
-        username in hardcoded_users
-        and hardcoded_users[username] == hashed_password
-    ):
+    stored_hash = user_store.password_hash(username)
+    # Unknown accounts are checked against a dummy hash, so the response
+    # time does not tell whether an account exists
+    verified = password_hasher.verify(password, stored_hash if stored_hash is not None else dummy_hash())
+    if stored_hash is not None and verified:
+        if needs_rehash(stored_hash):
+            user_store.set_password_hash(username, password_hasher.hash(password))
         logger.info(f"User {username} logged in successfully")
         return "success", username
     else:
@@ -96,7 +159,11 @@ def log_in():
     if error:
         return jsonify(status="error", message=error), 400
 
-    status, response = authenticate_user(username, data["password"])
+    try:
+        status, response = authenticate_user(username, data["password"])
+    except TimeoutError as e:
+        logger.warning(f"Login refused: {e}")
+        return jsonify(status="error", message="Server busy, please try again"), 503
     if status == "success":
         return jsonify(status="success", user_name=response)
     else:
@@ -124,16 +191,288 @@ def sign_up():
         logger.warning("Missing fields in sign-up data")
         return jsonify(status="error", message="All fields are required"), 400
 
-    if email in hardcoded_users:
+    if user_store.password_hash(email) is not None:
         logger.info("User already exists")
         return jsonify(status="error", message="User already exists"), 409
 
-    hashed_password = hash_password(password)
-    hardcoded_users[email] = hashed_password
+    try:
+        hashed_password = password_hasher.hash(password)
+    except TimeoutError as e:
+        logger.warning(f"Sign-up refused: {e}")
+        return jsonify(status="error", message="Server busy, please try again"), 503
+    # The unique email index settles two sign-ups racing for the same address
+    if not user_store.add_user(email, hashed_password, first_name, last_name):
+        logger.info("User already exists")
+        return jsonify(status="error", message="User already exists"), 409
     logger.info(f"User {email} registered successfully")
-    return jsonify(status="success", message="User registered successfully")
+    return jsonify(status="success", message="User registered successfully", user_name=email)
+
+
+def resolve_location(location):
+    """
+    Resolves a route endpoint to coordinates.
+
+    Args:
+        location: An address string or a [lat, lon] pair.
+
+    Returns:
+        tuple: The (lat, lon), or None if the address is not found, and
+        whether only the street of an address with a house number was found.
+
+    Raises:
+        ValueError: If the location is neither an address nor a pair of
+            finite coordinates in range.
+        geopy.exc.GeopyError: If the fallback geocoder fails.
+    """
+    if isinstance(location, str):
+        place = route_engine.geocode(" ".join(location.split()).casefold())
+        if place is None:
+            return None, False
+        return (place.latitude, place.longitude), getattr(place, "approximate", False)
+    if isinstance(location, (list, tuple)) and len(location) == 2 and not any(
+        isinstance(value, bool) for value in location
+    ):
+        try:
+            lat, lon = float(location[0]), float(location[1])
+        except (TypeError, ValueError):
+            lat = lon = math.nan
+        # NaN fails both range checks
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return (lat, lon), False
+    raise ValueError("Locations must be an address or a [lat, lon] pair")
+
+
+def validate_route_data(data):
+    """
+    Validates the route request data.
+
+    Args:
+        data (dict): The route request data.
+
+    Returns:
+        tuple: A tuple containing the route mode and an error message (if any).
+    """
+    mode = data.get("mode", "shortest")
+    if data.get("start") is None or data.get("end") is None:
+        return None, "Start and end are required"
+    if mode not in ROUTE_MODES:
+        return None, f"Mode must be one of {', '.join(ROUTE_MODES)}"
+    return mode, None
+
+
+def request_condition(data):
+    """
+    Validates the weather condition of a route request.
+
+    Args:
+        data (dict): The route request data, with an optional 'condition'
+            weather code; without one the usual weather of the date is used.
+
+    Returns:
+        tuple: A tuple containing the condition and an error message (if any).
+    """
+    condition = data.get("condition")
+    if condition is None:
+        return None, None
+    try:
+        condition = int(condition)
+    except (TypeError, ValueError):
+        return None, "Unknown weather condition"
+    if condition not in route_engine.conditions():
+        return None, "Unknown weather condition"
+    return condition, None
+
+
+def request_alternatives(data):
+    """
+    Validates the number of routes asked for in a route request.
+
+    Args:
+        data (dict): The route request data, with an optional 'alternatives'
+            count of routes, the best one included; 1 by default.
+
+    Returns:
+        tuple: A tuple containing the count and an error message (if any).
+    """
+    try:
+        k = int(data.get("alternatives", 1))
+    except (TypeError, ValueError):
+        k = 0
+    if not 1 <= k <= MAX_ALTERNATIVES:
+        return None, f"Alternatives must be between 1 and {MAX_ALTERNATIVES}"
+    return k, None
+
+
+@app.route("/route", methods=["POST"])
+def route():
+    """
+    Handles a route request.
+
+    Expects a JSON payload with 'start' and 'end', each an address or a
+    [lat, lon] pair, an optional 'mode' ('shortest' or 'safest'), an
+    optional weather 'condition' code and an optional number of
+    'alternatives' to return, the best route included.
+
+    Returns:
+        JSON response with the route coordinates, roads, length, length per
+        risk level and GeoJSON layer, any alternative routes and the
+        endpoints placed at the middle of their street, or an error.
+    """
+    if route_engine is None:
+        return jsonify(status="error", message="Routing is not available"), 503
+
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify(status="error", message="The request body must be an object"), 400
+    mode, error = validate_route_data(data)
+    if error:
+        return jsonify(status="error", message=error), 400
+    condition, error = request_condition(data)
+    if error:
+        return jsonify(status="error", message=error), 400
+    k, error = request_alternatives(data)
+    if error:
+        return jsonify(status="error", message=error), 400
+
+    try:
+        start, start_approximate = resolve_location(data["start"])
+        end, end_approximate = resolve_location(data["end"])
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+    except GeopyError as e:
+        logger.error(f"Geocoding failed: {e}")
+        return jsonify(status="error", message="Geocoding service unavailable"), 503
+
+    if start is None or end is None:
+        return jsonify(status="error", message="Address not found"), 404
+
+    try:
+        engine = route_engine.engine_for(start, end)
+        risk = engine.today_risk(condition)
+        results = engine.alternatives_between(start, end, mode, risk, k)
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 404
+    except nx.NetworkXNoPath:
+        return jsonify(status="error", message="No route between these locations"), 404
+
+    payloads = [engine.payload(result, mode, risk) for result in results]
+    approximate = [name for name, flag in (("start", start_approximate), ("end", end_approximate)) if flag]
+    return jsonify(status="success", route=payloads[0], alternatives=payloads[1:], approximate=approximate)
+
+
+@app.route("/routes", methods=["POST"])
+def routes():
+    """
+    Handles a batch of route requests between coordinates.
+
+    Expects a JSON payload with 'trips', a list of objects with 'start' and
+    'end' as [lat, lon] pairs and an optional 'mode' and 'condition'. The
+    endpoints of all trips served by the same graph are snapped in one
+    query and the map layer is left out.
+
+    Returns:
+        JSON response with one route or error per trip.
+    """
+    if route_engine is None:
+        return jsonify(status="error", message="Routing is not available"), 503
+
+    data = request.json or {}
+    trips = data.get("trips") if isinstance(data, dict) else None
+    if not isinstance(trips, list):
+        return jsonify(status="error", message="Trips must be a list"), 400
+
+    modes, conditions = [], []
+    for trip in trips:
+        if not isinstance(trip, dict):
+            return jsonify(status="error", message="Each trip must be an object"), 400
+        mode, error = validate_route_data(trip)
+        if error:
+            return jsonify(status="error", message=error), 400
+        condition, error = request_condition(trip)
+        if error:
+            return jsonify(status="error", message=error), 400
+        modes.append(mode)
+        conditions.append(condition)
+
+    if any(isinstance(trip["start"], str) or isinstance(trip["end"], str) for trip in trips):
+        return jsonify(status="error", message="Batch trips take [lat, lon] pairs only"), 400
+    try:
+        points = [resolve_location(trip[end])[0] for trip in trips for end in ("start", "end")]
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+
+    # Group the trips by the graph that serves them, then snap each group at once
+    results = [None] * len(trips)
+    groups = {}
+    for i in range(len(trips)):
+        try:
+            engine = route_engine.engine_for(points[2 * i], points[2 * i + 1])
+        except ValueError as e:
+            results[i] = {"error": str(e)}
+            continue
+        groups.setdefault(id(engine), (engine, []))[1].append(i)
+
+    for engine, indices in groups.values():
+        group_points = [points[2 * i + end] for i in indices for end in (0, 1)]
+        nodes = engine.node_index.nearest_many(
+            [lat for lat, _ in group_points], [lon for _, lon in group_points]
+        ).tolist()
+        for j, i in enumerate(indices):
+            risk = engine.today_risk(conditions[i])
+            try:
+                result = engine.route(nodes[2 * j], nodes[2 * j + 1], modes[i], risk)
+                results[i] = engine.payload(result, modes[i], risk, include_geojson=False)
+            except nx.NetworkXNoPath:
+                results[i] = {"error": "No route between these locations"}
+
+    return jsonify(status="success", routes=results)
+
+
+@app.route("/risk-tiles", methods=["GET"])
+def risk_tiles_layer():
+    """
+    Describes the heatmap tile layer of today's risk on every road.
+
+    Returns:
+        JSON response with the tile version, the URL template of the tiles,
+        the zoom range and the bounds of the network.
+    """
+    if risk_tiles is None:
+        return jsonify(status="error", message="Routing is not available"), 503
+    return jsonify(status="success", **risk_tiles.metadata())
+
+
+@app.route("/risk-tiles/<version>/<int:z>/<int:x>/<int:y>.png", methods=["GET"])
+def risk_tile(version, z, x, y):
+    """
+    Serves one heatmap tile.
+
+    The version is part of the URL, so browsers may keep a tile for as long
+    as they like; a new risk table or date gives new URLs. A map still using
+    the URLs of an older version is redirected to the same tile of today's.
+
+    Returns:
+        The PNG tile, a redirect to today's version, or an error if the
+        version is malformed.
+    """
+    if risk_tiles is None:
+        return jsonify(status="error", message="Routing is not available"), 503
+    png = risk_tiles.tile(version, z, x, y)
+    if png is None:
+        current = risk_tiles.version()
+        if not VERSION_PATTERN.fullmatch(version) or current == version:
+            return jsonify(status="error", message="Unknown risk tile version"), 404
+        # Not cached, so the browser asks again once the map has today's URLs
+        response = redirect(url_for("risk_tile", version=current, z=z, x=x, y=y))
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    response = Response(png, mimetype="image/png")
+    response.headers["Cache-Control"] = "public, max-age=86400, immutable"
+    return response
 
 
 if __name__ == "__main__":
+    if route_engine is not None:
+        route_engine.watch()
     logger.info("Starting the Flask app")
     app.run(debug=True, port=3630)
@@ -0,0 +1,81 @@
+"""
+Pooled HTTP client for the Flask backend, shared by the Streamlit pages.
+
+A single `requests.Session` keeps connections to the backend alive, so a
+login or route request does not set up a new TCP connection on every
+Streamlit rerun. Every request has a connect and a read timeout, and
+requests that could not connect are retried a couple of times, since the
+backend may be restarting its workers.
+"""
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection and for a response
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+
+# Connections kept alive to the backend
+POOL_SIZE = 8
+
+# Retries of requests that failed to connect; sent requests are never retried
+CONNECT_RETRIES = 2
+
+
+class BackendClient:
+    """
+    Keep-alive JSON client for the backend.
+
+    Attributes:
+        base_url (str): The backend address, e.g. http://127.0.0.1:3630.
+        timeout (tuple): The connect and read timeouts in seconds.
+        session (requests.Session): The pooled session.
+    """
+
+    def __init__(self, base_url, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, status=0, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, path, payload):
+        """
+        Posts a JSON payload to a backend endpoint.
+
+        Args:
+            path (str): The endpoint, e.g. '/route'.
+            payload (dict): The JSON body.
+
+        Returns:
+            requests.Response: The response.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails or times out.
+        """
+        return self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+
+    def get(self, path, params=None):
+        """
+        Gets a backend endpoint.
+
+        Args:
+            path (str): The endpoint, e.g. '/risk-tiles'.
+            params (dict): Optional query parameters.
+
+        Returns:
+            requests.Response: The response.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails or times out.
+        """
+        return self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,315 @@
+"""
+Bulk risk scoring of origin-destination trips.
+
+Reads a CSV of trips (e.g. depot to customer), routes every trip over the
+same CSR graph, snapping and risk lookup as the app, and writes one row per
+trip with the total length, the length driven at each risk level and the
+riskiest roads on the route.
+
+Trips are read in chunks. Within a chunk they are grouped by snapped origin
+node and each group is routed with one single-source Dijkstra tree, spread
+over a process pool. Results are written after every chunk, so memory stays
+bounded by the chunk size however long the input is.
+
+The input has either 'origin' and 'destination' address columns, or
+'origin_lat', 'origin_lon', 'destination_lat' and 'destination_lon'. An
+optional 'trip_id' column is copied to the output. Addresses are looked up
+in the local gazetteer only.
+
+Usage:
+    python batch_routing.py trips.csv scored.parquet --mode safest --workers 4
+"""
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from risk_index import RISK_COLORS
+from route_engine import RouteEngine
+from routing import ROUTE_MODES
+
+logger = logging.getLogger(__name__)
+
+# Trips read, routed and written at a time
+CHUNK_SIZE = 10000
+
+# Riskiest roads listed per trip
+TOP_ROADS = 3
+
+# Distinct addresses remembered across chunks
+GEOCODE_CACHE_SIZE = 65536
+
+RISK_LEVELS = sorted(RISK_COLORS)
+
+OUTPUT_COLUMNS = (
+    ["trip_id", "status", "origin_node", "destination_node", "length"]
+    + [f"length_risk_{risk_level}" for risk_level in RISK_LEVELS]
+    + ["riskiest_roads"]
+)
+
+# Routing state of the current process, set by `_init_worker`
+_worker = None
+
+
+def _init_worker(state, risk_table_path, month, day, mode):
+    # With fork the parent's state is inherited; with spawn load it again
+    global _worker
+    if state is None:
+        engine = RouteEngine.load(download=False, risk_table_path=risk_table_path)
+        _, edge_risk = engine.risk_for(month, day)
+        state = (engine.csr_graph, edge_risk, engine.csr_graph.edge_costs(edge_risk, ROUTE_MODES[mode]))
+    _worker = state
+
+
+def score_route(csr_graph, edges, edge_risk):
+    """
+    Summarizes the risk along a route.
+
+    Args:
+        csr_graph (CSRGraph): The routing graph.
+        edges (list): Edge positions along the route.
+        edge_risk (np.ndarray): Risk level per edge position.
+
+    Returns:
+        dict: Total length, length per risk level and the riskiest roads.
+    """
+    lengths = csr_graph.length[edges]
+    risks = edge_risk[edges].astype(np.int64)
+    per_level = np.bincount(risks, weights=lengths, minlength=len(RISK_LEVELS))
+
+    roads = {}
+    for edge, risk_level, length in zip(edges, risks.tolist(), lengths.tolist()):
+        road_name = csr_graph.road_names[edge]
+        if isinstance(road_name, str):
+            worst, total = roads.get(road_name, (0, 0.0))
+            roads[road_name] = (max(worst, risk_level), total + length)
+    riskiest = sorted(roads.items(), key=lambda item: (-item[1][0], -item[1][1]))[:TOP_ROADS]
+
+    score = {"length": float(lengths.sum())}
+    for risk_level in RISK_LEVELS:
+        score[f"length_risk_{risk_level}"] = float(per_level[risk_level])
+    score["riskiest_roads"] = "; ".join(f"{road_name} ({risk_level})" for road_name, (risk_level, _) in riskiest)
+    return score
+
+
+def route_group(group):
+    """
+    Routes all trips that share an origin node.
+
+    Runs in a pool worker initialized by `_init_worker`.
+
+    Args:
+        group (tuple): The origin node and a list of (trip id, destination node).
+
+    Returns:
+        list: One output row per trip.
+    """
+    csr_graph, edge_risk, costs = _worker
+    origin, trips = group
+    routes = csr_graph.routes_from(origin, [destination for _, destination in trips], costs)
+
+    rows = []
+    for trip_id, destination in trips:
+        row = {"trip_id": trip_id, "origin_node": origin, "destination_node": destination}
+        edges = routes.get(destination)
+        if edges is None:
+            row["status"] = "no_path"
+        else:
+            row["status"] = "ok"
+            row.update(score_route(csr_graph, edges, edge_risk))
+        rows.append(row)
+    return rows
+
+
+def snap_trips(engine, chunk, geocode):
+    """
+    Resolves the trips of a chunk to origin and destination nodes.
+
+    Args:
+        engine (RouteEngine): The routing engine.
+        chunk (pd.DataFrame): Trips with address or coordinate columns.
+        geocode (callable): Address lookup returning a Place or None.
+
+    Returns:
+        tuple: Origin and destination node arrays, and a boolean mask of
+        the trips whose locations were found.
+    """
+    if "origin_lat" in chunk.columns:
+        lat = np.concatenate((chunk["origin_lat"].to_numpy(float), chunk["destination_lat"].to_numpy(float)))
+        lon = np.concatenate((chunk["origin_lon"].to_numpy(float), chunk["destination_lon"].to_numpy(float)))
+    else:
+        places = [geocode(str(address)) for address in pd.concat((chunk["origin"], chunk["destination"]))]
+        lat = np.array([place.latitude if place is not None else np.nan for place in places])
+        lon = np.array([place.longitude if place is not None else np.nan for place in places])
+
+    found = ~(np.isnan(lat) | np.isnan(lon))
+    nodes = np.zeros(len(lat), dtype=np.int64)
+    if found.any():
+        nodes[found] = engine.node_index.nearest_many(lat[found], lon[found])
+
+    n = len(chunk)
+    return nodes[:n], nodes[n:], found[:n] & found[n:]
+
+
+class ResultWriter:
+    """
+    Appends result chunks to a CSV or Parquet file.
+
+    The format follows the file extension; Parquet needs pyarrow.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self._writer = None
+        self._schema = None
+        self._header = True
+
+    def write(self, rows):
+        """
+        Writes one chunk of output rows.
+
+        Args:
+            rows (list): Output rows as dicts.
+        """
+        frame = pd.DataFrame(rows, columns=OUTPUT_COLUMNS)
+        frame["trip_id"] = frame["trip_id"].astype(str)
+        frame = frame.astype({"origin_node": "Int64", "destination_node": "Int64"})
+        if not self.parquet:
+            frame.to_csv(self.path, mode="w" if self._header else "a", header=self._header, index=False)
+            self._header = False
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._schema = pa.schema(
+                [("trip_id", pa.string()), ("status", pa.string()),
+                 ("origin_node", pa.int64()), ("destination_node", pa.int64()), ("length", pa.float64())]
+                + [(f"length_risk_{risk_level}", pa.float64()) for risk_level in RISK_LEVELS]
+                + [("riskiest_roads", pa.string())]
+            )
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        self._writer.write_table(pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def score_trips(trips_path, out_path, mode="safest", month=None, day=None, workers=None,
+                chunk_size=CHUNK_SIZE, risk_table_path=None, engine=None):
+    """
+    Routes and scores every trip of a CSV file.
+
+    Args:
+        trips_path (str): The input CSV of trips.
+        out_path (str): The output .csv or .parquet file.
+        mode (str): A key of ROUTE_MODES.
+        month (int): The month to take risk levels for, today by default.
+        day (int): The day of the month, today by default.
+        workers (int): Pool size, the CPU count by default; 1 routes in-process.
+        chunk_size (int): Trips read and written at a time.
+        risk_table_path (str): The risk table file, the active snapshot by default.
+        engine (RouteEngine): A loaded engine, loaded from the snapshot if None.
+
+    Returns:
+        dict: Counts of trips per status and the elapsed seconds.
+    """
+    today = datetime.now()
+    month = month or today.month
+    day = day or today.day
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    if engine is None:
+        engine = RouteEngine.load(download=False, risk_table_path=risk_table_path)
+    _, edge_risk = engine.risk_for(month, day)
+    state = (engine.csr_graph, edge_risk, engine.csr_graph.edge_costs(edge_risk, ROUTE_MODES[mode]))
+    geocode = functools.lru_cache(maxsize=GEOCODE_CACHE_SIZE)(engine.gazetteer.lookup)
+    logger.info(f"Loaded routing engine in {time.perf_counter() - start:.1f}s")
+
+    # Forked workers inherit the parent's arrays; spawned ones reload them
+    forked = multiprocessing.get_start_method() == "fork"
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(state if forked else None, risk_table_path, month, day, mode),
+        )
+    else:
+        _init_worker(state, risk_table_path, month, day, mode)
+
+    counts = defaultdict(int)
+    writer = ResultWriter(out_path)
+    try:
+        offset = 0
+        for chunk in pd.read_csv(trips_path, chunksize=chunk_size):
+            trip_ids = chunk["trip_id"].tolist() if "trip_id" in chunk.columns else list(range(offset, offset + len(chunk)))
+            offset += len(chunk)
+            origins, destinations, found = snap_trips(engine, chunk, geocode)
+
+            rows = [
+                {"trip_id": trip_id, "status": "not_found"}
+                for trip_id, ok in zip(trip_ids, found.tolist()) if not ok
+            ]
+            groups = defaultdict(list)
+            for trip_id, origin, destination, ok in zip(trip_ids, origins.tolist(), destinations.tolist(), found.tolist()):
+                if ok:
+                    groups[origin].append((trip_id, destination))
+
+            mapped = pool.imap_unordered(route_group, groups.items(), chunksize=8) if pool else map(route_group, groups.items())
+            for group_rows in mapped:
+                rows.extend(group_rows)
+
+            writer.write(rows)
+            for row in rows:
+                counts[row["status"]] += 1
+            elapsed = time.perf_counter() - start
+            logger.info(f"Scored {offset} trips ({len(groups)} origins in last chunk), {offset / elapsed:.0f} trips/s")
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    result = dict(counts)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Route and risk-score a CSV of origin-destination trips.")
+    parser.add_argument("trips")
+    parser.add_argument("out", help="Output .csv or .parquet file")
+    parser.add_argument("--mode", choices=list(ROUTE_MODES), default="safest")
+    parser.add_argument("--date", help="MM-DD to take risk levels for, today by default")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--risk-table", help="Risk table file, the active snapshot by default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    month = day = None
+    if args.date:
+        month, day = (int(part) for part in args.date.split("-"))
+
+    result = score_trips(
+        args.trips, args.out, args.mode, month, day, args.workers, args.chunk_size, args.risk_table
+    )
+    seconds = result.pop("seconds")
+    logger.info(f"Wrote {args.out} in {seconds:.1f}s: " + ", ".join(f"{n} {status}" for status, n in sorted(result.items())))
+
+
+if __name__ == "__main__":
+    main()
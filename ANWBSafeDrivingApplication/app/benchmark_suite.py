@@ -0,0 +1,442 @@
+"""
+Offline benchmarks of the routing, rendering, prediction and login paths.
+
+Nothing is downloaded: road graphs are synthetic street grids around Breda,
+from city size up to province size, plus the saved graph snapshot if there
+is one. Each graph gets a generated `model_data.csv` over its street names
+and a stand-in logistic regression trained on it, so the risk table, edge
+risk and route colouring work as with the real data.
+
+Per graph the suite times, separately: snapshot load, geocode (local
+gazetteer), snap, route (cold route cache), risk join (today's risk per
+edge, one date at a time), payload (route summary and GeoJSON), render
+(folium map to HTML) and predict (full risk table, and one row). The login
+and sign-up handlers are load tested through Flask's test client against a
+throwaway user database.
+
+Results are written as JSON named after the commit, so two runs can be
+compared stage by stage with the `compare` command.
+
+Usage:
+    python benchmark_suite.py run --sizes breda region --routes 50
+    python benchmark_suite.py compare benchmark_results/old.json benchmark_results/new.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from graph_store import load_snapshot, save_snapshot, snapshot_path
+from metrics import Metrics
+from model_data import COLUMN_TYPES, load_model_data
+from risk_table import FEATURES, RiskTable
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(APP_DIR, "benchmark_results")
+
+# Synthetic graphs by the side of their street grid: about 6k nodes like
+# Breda, 40k like the Breda region and 200k like Noord-Brabant
+GRAPH_SIZES = {"breda": 80, "region": 200, "province": 450}
+
+# South-west corner and spacing of the grid, in degrees (about 100 m blocks)
+GRID_ORIGIN = (51.50, 4.60)
+GRID_STEP = (0.0009, 0.0014)
+
+# Blocks per named street, so names repeat along a street as in a city
+BLOCKS_PER_STREET = 8
+
+# Share of grid edges without a road name
+UNNAMED_SHARE = 0.05
+
+# Streets with accident data, and rows of data per street
+DATA_ROADS = 5000
+ROWS_PER_ROAD = 20
+
+# Risk levels of the stand-in model
+RISK_LEVELS = 4
+
+
+def git_commit():
+    """
+    Returns the checked out commit of the app, if it is in a git repository.
+
+    Returns:
+        str: The short commit hash, or 'unknown'.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def synthetic_graph(side, seed=0):
+    """
+    Builds a street grid shaped like an OSMnx drive graph.
+
+    Streets run east-west and avenues north-south, both ways, with a name
+    per BLOCKS_PER_STREET blocks and lengths slightly longer than the
+    straight line, as roads are.
+
+    Args:
+        side (int): Nodes per side of the grid.
+        seed (int): The random seed.
+
+    Returns:
+        networkx.MultiDiGraph: The graph.
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.divmod(np.arange(side * side), side)
+    lat = GRID_ORIGIN[0] + rows * GRID_STEP[0] + rng.uniform(-1e-4, 1e-4, side * side)
+    lon = GRID_ORIGIN[1] + cols * GRID_STEP[1] + rng.uniform(-1e-4, 1e-4, side * side)
+    node_ids = 1_000_000 + np.arange(side * side)
+
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_nodes_from(
+        (int(node), {"y": float(y), "x": float(x), "street_count": 4}) for node, y, x in zip(node_ids, lat, lon)
+    )
+
+    # Equirectangular distance is exact enough at block scale
+    metres_per_lat = 111_195.0
+    metres_per_lon = metres_per_lat * math.cos(math.radians(GRID_ORIGIN[0]))
+    edges = []
+    osmid = 1
+    for axis, prefix in ((1, "Street"), (side, "Avenue")):
+        for position in range(side * side):
+            row, col = divmod(position, side)
+            if (axis == 1 and col == side - 1) or (axis == side and row == side - 1):
+                continue
+            u, v = position, position + axis
+            along, across = (col, row) if axis == 1 else (row, col)
+            name = None if rng.random() < UNNAMED_SHARE else f"{prefix} {across}-{along // BLOCKS_PER_STREET}"
+            length = math.hypot((lat[v] - lat[u]) * metres_per_lat, (lon[v] - lon[u]) * metres_per_lon)
+            length *= rng.uniform(1.0, 1.2)
+            for a, b in ((u, v), (v, u)):
+                data = {"osmid": osmid, "length": length, "oneway": False, "highway": "residential"}
+                if name is not None:
+                    data["name"] = name
+                edges.append((int(node_ids[a]), int(node_ids[b]), data))
+            osmid += 1
+    G.add_edges_from(edges)
+    return G
+
+
+def synthetic_model_data(G, path, max_roads=DATA_ROADS, rows_per_road=ROWS_PER_ROAD, seed=0):
+    """
+    Writes a model data CSV for streets of a graph.
+
+    Roads get a yearly accident average, dates a most common weather
+    condition, and rows a risk level that rises with the accident average.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        path (str): The CSV file to write.
+        max_roads (int): Streets with data, chosen at random.
+        rows_per_road (int): Rows, i.e. dates with accidents, per street.
+        seed (int): The random seed.
+
+    Returns:
+        int: The number of streets with data.
+    """
+    rng = np.random.default_rng(seed)
+    names = sorted({name for _, _, name in G.edges(data="name") if isinstance(name, str)})
+    names = rng.choice(names, size=min(max_roads, len(names)), replace=False)
+
+    n_rows = len(names) * rows_per_road
+    dates = pd.Timestamp(2024, 1, 1) + pd.to_timedelta(rng.integers(0, 366, n_rows), unit="D")
+    date_conditions = rng.integers(0, 4, 367)
+    yearly = np.repeat(rng.gamma(2.0, 2.0, len(names)), rows_per_road)
+    monthly = np.repeat(rng.gamma(2.0, 1.0, len(names)), rows_per_road)
+    noisy = yearly + rng.normal(0.0, 1.0, n_rows)
+    risk_levels = np.digitize(noisy, np.quantile(noisy, np.linspace(0, 1, RISK_LEVELS + 1)[1:-1]))
+
+    pd.DataFrame({
+        "road_name": np.repeat(names, rows_per_road),
+        "month": dates.month,
+        "day": dates.day,
+        "most_common_condition": date_conditions[dates.dayofyear],
+        "avg_yearly_accidents": yearly,
+        "average_monthly_occurrences": monthly,
+        "Risk Level": risk_levels,
+    })[list(COLUMN_TYPES)].to_csv(path, index=False)
+    return len(names)
+
+
+def stand_in_model(df):
+    """
+    Trains a logistic regression like `log_model.joblib` on model data.
+
+    Args:
+        df (pd.DataFrame): The model data.
+
+    Returns:
+        sklearn.linear_model.LogisticRegression: The fitted model.
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    return LogisticRegression(max_iter=500).fit(df[FEATURES], df["Risk Level"])
+
+
+def bench_graph(G, df, model, routes=50, seed=0, work_dir=None):
+    """
+    Times every stage of a route request on one graph.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        df (pd.DataFrame): The model data.
+        model: The risk model.
+        routes (int): Random routes to time.
+        seed (int): The random seed for picking routes.
+        work_dir (str): Directory for the graph snapshot, a temporary one
+            by default.
+
+    Returns:
+        dict: Graph size and the `Metrics.snapshot` stages.
+    """
+    import folium
+
+    from risk_model import LinearScorer
+    from route_engine import RouteEngine
+    from route_render import ROUTE_ZOOM, add_route_layer
+
+    timings = Metrics()
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        path = os.path.join(tmp_dir, "graph.pickle")
+        save_snapshot(G, path)
+        for _ in range(3):
+            with timings.span("graph_load"):
+                load_snapshot(path)
+
+    with timings.span("predict"):
+        risk_table = RiskTable.compute(df, model)
+    scorer = LinearScorer.from_model(model)
+    rows = df[FEATURES].to_numpy(dtype=np.float64)
+    for row in rows[:1000]:
+        with timings.span("predict_one"):
+            scorer.predict_one(row)
+
+    with timings.span("engine_build"):
+        engine = RouteEngine(G, risk_table, df)
+    # Risk of each date is derived once and then cached, so every date is new
+    months, days = zip(*[(month, day) for month in range(1, 13) for day in range(1, 29)])
+    for month, day in list(zip(months, days))[:routes]:
+        with timings.span("risk_join"):
+            engine.risk_for(month, day)
+    risk = engine.today_risk()
+
+    rng = random.Random(seed)
+    streets = sorted({name for _, _, name in G.edges(data="name") if isinstance(name, str)})
+    nodes = engine.csr_graph.node_ids
+    lat, lon = engine.csr_graph.lat, engine.csr_graph.lon
+    for _ in range(routes):
+        with timings.span("geocode"):
+            engine.geocode(rng.choice(streets))
+
+        a, b = rng.randrange(len(nodes)), rng.randrange(len(nodes))
+        with timings.span("snap"):
+            source, target = engine.node_index.nearest_many([lat[a], lat[b]], [lon[a], lon[b]]).tolist()
+
+        engine.route_cache.clear()
+        try:
+            with timings.span("route"):
+                route = engine.route(source, target, "safest", risk)
+        except nx.NetworkXNoPath:
+            continue
+
+        with timings.span("payload"):
+            payload = engine.payload(route, "safest", risk)
+        with timings.span("render"):
+            route_map = folium.Map(location=payload["coords"][0], zoom_start=ROUTE_ZOOM)
+            add_route_layer(route_map, payload["geojson"])
+            route_map.get_root().render()
+
+    return {"nodes": len(G), "edges": G.number_of_edges(), "roads": len(risk_table.road_names),
+            **timings.snapshot()}
+
+
+def bench_auth(clients=4, seconds=5.0, work_dir=None):
+    """
+    Load tests the login and sign-up handlers through Flask's test client.
+
+    The backend is imported with a throwaway user database and without
+    the online geocoder.
+
+    Args:
+        clients (int): Concurrent client threads.
+        seconds (float): Duration of each test.
+        work_dir (str): Directory for the user database, a temporary one
+            by default.
+
+    Returns:
+        dict: The `user_store.load_test` results for login and sign-up.
+    """
+    tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    os.environ["USER_DB_PATH"] = os.path.join(tmp_dir, "users.db")
+    os.environ["NOMINATIM_FALLBACK"] = "0"
+    import app as backend
+    from user_store import load_test
+
+    logging.getLogger(backend.__name__).setLevel(logging.WARNING)
+    local = threading.local()
+
+    def post(path, payload):
+        if not hasattr(local, "client"):
+            local.client = backend.app.test_client()
+        return local.client.post(path, json=payload).status_code == 200
+
+    accounts = [(f"bench{i}@example.com", f"password{i}") for i in range(20)]
+    for email, password in accounts:
+        post("/sign-up", {"first_name": "Bench", "last_name": "Mark", "email": email, "password": password})
+
+    results = {"login": load_test(
+        lambda email, password: post("/log-in", {"username": email, "password": password}),
+        accounts, clients, seconds,
+    )}
+
+    counter = iter(range(10 ** 9))
+    results["sign_up"] = load_test(
+        lambda email, password: post("/sign-up", {
+            "first_name": "Bench", "last_name": "Mark", "email": f"new{next(counter)}-{email}", "password": password,
+        }),
+        accounts, clients, seconds,
+    )
+    return results
+
+
+def run(sizes, routes=50, include_snapshot=True, auth=True, clients=4, seconds=5.0, seed=0):
+    """
+    Runs the suite.
+
+    Args:
+        sizes (list): Keys of GRAPH_SIZES to benchmark.
+        routes (int): Random routes to time per graph.
+        include_snapshot (bool): Whether to also benchmark the saved graph
+            snapshot, if there is one.
+        auth (bool): Whether to load test login and sign-up.
+        clients (int): Concurrent clients of the load tests.
+        seconds (float): Duration of each load test.
+        seed (int): The random seed.
+
+    Returns:
+        dict: Run details and results per graph and load test.
+    """
+    result = {
+        "commit": git_commit(),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "routes": routes,
+        "graphs": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        graphs = [(size, lambda side=GRAPH_SIZES[size]: synthetic_graph(side, seed)) for size in sizes]
+        if include_snapshot and os.path.exists(snapshot_path()):
+            graphs.append(("snapshot", lambda: load_snapshot(snapshot_path())))
+
+        for name, build in graphs:
+            start = time.perf_counter()
+            G = build()
+            csv_path = os.path.join(tmp_dir, f"{name}_model_data.csv")
+            synthetic_model_data(G, csv_path, seed=seed)
+            df = load_model_data(csv_path)
+            model = stand_in_model(df)
+            logger.info(f"Prepared {name}: {len(G)} nodes, {G.number_of_edges()} edges, "
+                        f"{df['road_name'].nunique()} roads with data in {time.perf_counter() - start:.1f}s")
+
+            result["graphs"][name] = bench_graph(G, df, model, routes, seed, tmp_dir)
+            del G
+
+        if auth:
+            result["auth"] = bench_auth(clients, seconds, tmp_dir)
+    return result
+
+
+def print_result(result):
+    for name, graph in result["graphs"].items():
+        print(f"{name}: {graph['nodes']} nodes, {graph['edges']} edges, {graph['roads']} roads with data")
+        for stage, summary in graph["stages"].items():
+            print(f"  {stage:<14}{summary['count']:>6}  p50 {summary['p50_ms']:10.3f} ms  p95 {summary['p95_ms']:10.3f} ms")
+    for name, summary in result.get("auth", {}).items():
+        print(f"{name}: {summary['logins_per_second']:.1f}/s, median {summary['median_ms']:.0f} ms, "
+              f"p95 {summary['p95_ms']:.0f} ms, {summary['failures']} failed")
+
+
+def compare(old, new):
+    """
+    Prints the p50 and p95 of two runs side by side, stage by stage.
+
+    Args:
+        old (dict): The earlier run.
+        new (dict): The later run.
+    """
+    print(f"{old['commit']} -> {new['commit']}")
+    for name in sorted(set(old["graphs"]) & set(new["graphs"])):
+        print(name)
+        old_stages, new_stages = old["graphs"][name]["stages"], new["graphs"][name]["stages"]
+        for stage in sorted(set(old_stages) & set(new_stages)):
+            cells = []
+            for quantile in ("p50_ms", "p95_ms"):
+                before, after = old_stages[stage][quantile], new_stages[stage][quantile]
+                change = f"{after / before:5.2f}x" if before else "    -"
+                cells.append(f"{quantile[:3]} {before:9.2f} -> {after:9.2f} ms {change}")
+            print(f"  {stage:<14}" + "   ".join(cells))
+    for name in sorted(set(old.get("auth", {})) & set(new.get("auth", {}))):
+        before, after = old["auth"][name]["logins_per_second"], new["auth"][name]["logins_per_second"]
+        print(f"{name}: {before:.1f}/s -> {after:.1f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks or compare two runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--sizes", nargs="+", choices=list(GRAPH_SIZES), default=["breda", "region"])
+    run_parser.add_argument("--routes", type=int, default=50)
+    run_parser.add_argument("--no-snapshot", action="store_true", help="Skip the saved graph snapshot")
+    run_parser.add_argument("--no-auth", action="store_true", help="Skip the login and sign-up load tests")
+    run_parser.add_argument("--clients", type=int, default=4)
+    run_parser.add_argument("--seconds", type=float, default=5.0)
+    run_parser.add_argument("--out", help="Results file, named after the commit in benchmark_results by default")
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "compare":
+        with open(args.old) as old, open(args.new) as new:
+            compare(json.load(old), json.load(new))
+        return
+
+    result = run(args.sizes, args.routes, not args.no_snapshot, not args.no_auth, args.clients, args.seconds)
+    print_result(result)
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{result['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    tmp_path = f"{out}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_path, out)
+    logger.info(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
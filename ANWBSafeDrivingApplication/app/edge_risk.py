@@ -0,0 +1,117 @@
+"""
+Weather-conditioned risk per graph edge in one compact array.
+
+The risk table holds a risk level per (day, weather condition, road). For
+routing it is expanded once into an int8 tensor indexed by
+[day of year, condition, CSR edge position], so the risk of every edge for
+"today, rain" is a single slice and the risk along a route is one fancy
+index over its edge positions. No per-edge dicts are built, whatever the
+number of conditions.
+"""
+import numpy as np
+
+from risk_index import DEFAULT_RISK
+from risk_table import day_of_year
+
+
+class EdgeRiskTensor:
+    """
+    Risk level per day of year, weather condition and edge position.
+
+    Attributes:
+        risk (np.ndarray): int8 array of shape (366, conditions, edges).
+        conditions (np.ndarray): The weather condition code per condition slot.
+        version (str): The version of the risk table it was built from.
+    """
+
+    def __init__(self, risk, conditions, version):
+        self.risk = risk
+        self.conditions = np.asarray(conditions)
+        self.version = version
+        self._slot = {int(condition): i for i, condition in enumerate(self.conditions.tolist())}
+
+    @classmethod
+    def from_table(cls, csr_graph, risk_table):
+        """
+        Expands the per-road condition risk of a table to the graph edges.
+
+        Edges without a known road name get the default risk; edges with
+        several names get the highest risk among them, as in `RiskIndex`.
+
+        Args:
+            csr_graph (CSRGraph): The routing graph.
+            risk_table (RiskTable): A table with condition risk.
+
+        Returns:
+            EdgeRiskTensor: The tensor.
+        """
+        column = {road_name: i for i, road_name in enumerate(risk_table.road_names.tolist())}
+        unknown = len(column)
+
+        edge_column = np.full(csr_graph.num_edges, unknown, dtype=np.int64)
+        multi_name = []
+        for edge, road_name in enumerate(csr_graph.road_names):
+            if isinstance(road_name, str):
+                edge_column[edge] = column.get(road_name, unknown)
+            elif isinstance(road_name, list):
+                multi_name.append((edge, [column.get(name, unknown) for name in road_name]))
+
+        # An extra road column holds the default risk for unmatched edges
+        condition_risk = risk_table.condition_risk
+        padded = np.concatenate(
+            (condition_risk, np.full(condition_risk.shape[:2] + (1,), DEFAULT_RISK, dtype=np.int8)), axis=2
+        )
+        risk = np.ascontiguousarray(padded[:, :, edge_column])
+        for edge, columns in multi_name:
+            risk[:, :, edge] = padded[:, :, columns].max(axis=2)
+        return cls(risk, risk_table.conditions, risk_table.version)
+
+    @property
+    def nbytes(self):
+        return self.risk.nbytes
+
+    def slot(self, condition):
+        """
+        Returns the tensor slot of a weather condition.
+
+        Args:
+            condition (int): The weather condition code.
+
+        Returns:
+            int: The index along the condition axis.
+
+        Raises:
+            KeyError: If the condition was not scored.
+        """
+        return self._slot[int(condition)]
+
+    def for_day(self, month, day, condition):
+        """
+        Returns the risk of every edge on a date under a weather condition.
+
+        Args:
+            month (int): The month.
+            day (int): The day of the month.
+            condition (int): The weather condition code.
+
+        Returns:
+            np.ndarray: A read-only int8 view with the risk per edge position.
+        """
+        edge_risk = self.risk[day_of_year(month, day), self.slot(condition)]
+        edge_risk.flags.writeable = False
+        return edge_risk
+
+    def route_risk(self, month, day, condition, edges):
+        """
+        Returns the risk along a route.
+
+        Args:
+            month (int): The month.
+            day (int): The day of the month.
+            condition (int): The weather condition code.
+            edges (array-like): Edge positions along the route.
+
+        Returns:
+            np.ndarray: The int8 risk per route edge.
+        """
+        return self.risk[day_of_year(month, day), self.slot(condition), edges]
@@ -0,0 +1,276 @@
+"""
+Offline geocoding from a local gazetteer.
+
+The gazetteer holds the street names of the cached road graph, placed at
+the centre of their nodes, plus an optional list of addresses and points of
+interest. Lookups try an exact match, then a prefix match, then a trigram
+fuzzy match, so common queries resolve in memory without a network call.
+
+Streets are only matched by name, so an address naming a locality the
+gazetteer does not cover finds nothing here and goes to the online
+geocoder, and a house number is only placed at the middle of its street.
+"""
+import bisect
+import csv
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict, namedtuple
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Optional CSV of extra places with 'name', 'latitude' and 'longitude' columns
+PLACES_PATH = os.path.join(APP_DIR, "places.csv")
+
+# Lowest trigram similarity accepted as a match
+MIN_SIMILARITY = 0.5
+
+# Shortest query matched as the prefix of a name
+MIN_PREFIX_LENGTH = 3
+
+# Country names dropped from the end of an address
+COUNTRY_NAMES = {"netherlands", "the netherlands", "nederland", "nl"}
+
+# Dutch postcode, e.g. '4811 AB'
+POSTCODE_PATTERN = re.compile(r"\b\d{4}\s?[a-zA-Z]{2}\b")
+
+# Street, house number and the rest of the first part of an address
+HOUSE_NUMBER_PATTERN = re.compile(r"^(.*?\D)\s*(\d+\s*[a-zA-Z]?)\b(.*)$")
+
+
+class Place(namedtuple("Place", ["address", "latitude", "longitude", "locality", "approximate"],
+                       defaults=(None, False))):
+    """
+    A geocoded place, with the same coordinate attributes as a geopy Location.
+
+    `locality` is the city, town or village the place lies in, if known, and
+    `approximate` tells that only the street of an address was found.
+    """
+    __slots__ = ()
+
+
+def normalize_address(text):
+    """
+    Normalizes an address for matching.
+
+    Args:
+        text (str): The address.
+
+    Returns:
+        str: Lowercase ASCII words separated by single spaces.
+    """
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def split_address(text):
+    """
+    Splits an address into its street, house number and locality.
+
+    Args:
+        text (str): The address, e.g. 'Monseigneur Hopmansstraat 2, 4817 JT Breda'
+            or 'Kerkstraat 12 Utrecht'.
+
+    Returns:
+        tuple: The normalized street, e.g. 'monseigneur hopmansstraat', the
+        house number and the normalized locality, e.g. 'breda'; the number
+        and locality are None if the address has none.
+    """
+    first, *rest = text.split(",")
+    number = None
+    match = HOUSE_NUMBER_PATTERN.match(first)
+    if match:
+        first, number, trailing = match.groups()
+        rest.insert(0, trailing)
+        number = normalize_address(number)
+    localities = [normalize_address(POSTCODE_PATTERN.sub(" ", part)) for part in rest]
+    localities = [locality for locality in localities if locality and locality not in COUNTRY_NAMES]
+    return normalize_address(first), number, localities[-1] if localities else None
+
+
+def trigrams(text):
+    """
+    Returns the character trigrams of a normalized string.
+
+    Args:
+        text (str): The normalized string.
+
+    Returns:
+        set: The trigrams, padded so short words still have some.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """
+    In-memory geocoding index.
+
+    Attributes:
+        places (list): The indexed places.
+        localities (set): The normalized localities of the places.
+    """
+
+    def __init__(self, places):
+        self.places = []
+        self._localities = []
+        # Place positions per normalized name; a street name can be in several localities
+        self._exact = defaultdict(list)
+        seen = set()
+        for place in places:
+            key = normalize_address(place.address)
+            locality = normalize_address(place.locality) if place.locality else None
+            if key and (key, locality) not in seen:
+                seen.add((key, locality))
+                self._exact[key].append(len(self.places))
+                self.places.append(place)
+                self._localities.append(locality)
+        self.localities = {locality for locality in self._localities if locality}
+
+        self._sorted_keys = sorted(self._exact)
+        self._trigrams = defaultdict(list)
+        self._trigram_counts = {}
+        for key in self._exact:
+            grams = trigrams(key)
+            self._trigram_counts[key] = len(grams)
+            for gram in grams:
+                self._trigrams[gram].append(key)
+
+    @classmethod
+    def from_graph(cls, G, city=None, places_path=PLACES_PATH):
+        """
+        Builds the gazetteer from a road graph and an optional places file.
+
+        Args:
+            G (networkx.MultiDiGraph): The road graph.
+            city (str): Name of the area covered by the graph, added as a
+                place at the centre of all nodes and used as the locality of
+                its streets.
+            places_path (str): CSV of extra places, skipped if missing.
+
+        Returns:
+            Gazetteer: The gazetteer.
+        """
+        places = []
+        if places_path and os.path.exists(places_path):
+            places.extend(load_places(places_path))
+
+        street_nodes = defaultdict(set)
+        for u, v, name in G.edges(data="name"):
+            for street in name if isinstance(name, list) else [name]:
+                if isinstance(street, str):
+                    street_nodes[street].update((u, v))
+
+        for street, nodes in street_nodes.items():
+            lat = sum(G.nodes[node]["y"] for node in nodes) / len(nodes)
+            lon = sum(G.nodes[node]["x"] for node in nodes) / len(nodes)
+            places.append(Place(street, lat, lon, city))
+
+        if city and len(G):
+            lat = sum(y for _, y in G.nodes(data="y")) / len(G)
+            lon = sum(x for _, x in G.nodes(data="x")) / len(G)
+            places.append(Place(city, lat, lon, city))
+
+        return cls(places)
+
+    def lookup(self, address, min_similarity=MIN_SIMILARITY):
+        """
+        Finds the place that best matches an address.
+
+        Args:
+            address (str): The address to geocode.
+            min_similarity (float): The lowest accepted trigram similarity.
+
+        Returns:
+            Place: The matching place, approximate if only the street of an
+            address with a house number matched, or None if nothing is close
+            enough, the address names a locality the gazetteer does not cover
+            or the street is in several localities and the address names none.
+        """
+        street, number, locality = split_address(address)
+        if locality is not None and locality not in self.localities:
+            return None
+
+        # A listed place or a street with a number in its name, e.g.
+        # 'Plein 1944, Breda', matches with its number included; only exactly,
+        # so that 'Plein 19' is a house on Plein and not Plein 1944
+        for query in dict.fromkeys((normalize_address(address), normalize_address(address.split(",")[0]))):
+            key = self._exact_or_prefix(query, prefix=number is None)
+            if key is not None:
+                return self._pick(key, locality)
+        if not street:
+            return None
+        key = self._exact_or_prefix(street)
+        if key is None:
+            key = self._fuzzy(street, min_similarity)
+        if key is None:
+            return None
+        place = self._pick(key, locality)
+        if place is not None and number is not None:
+            place = place._replace(approximate=True)
+        return place
+
+    def _pick(self, key, locality):
+        # The place of a name in the locality; places without one match any
+        candidates = [
+            i for i in self._exact[key]
+            if locality is None or self._localities[i] in (None, locality)
+        ]
+        if len({self._localities[i] for i in candidates if self._localities[i]}) > 1:
+            return None
+        return self.places[candidates[0]] if candidates else None
+
+    def _exact_or_prefix(self, query, prefix=True):
+        if not query:
+            return None
+        if query in self._exact:
+            return query
+        if not prefix or len(query) < MIN_PREFIX_LENGTH:
+            return None
+
+        # Shortest indexed key that starts with the query
+        start = bisect.bisect_left(self._sorted_keys, query)
+        matches = []
+        for key in self._sorted_keys[start:]:
+            if not key.startswith(query):
+                break
+            matches.append(key)
+        if matches:
+            return min(matches, key=len)
+        return None
+
+    def _fuzzy(self, query, min_similarity):
+        query_grams = trigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._trigrams.get(gram, ()))
+        if not shared:
+            return None
+
+        # Dice coefficient between the trigram sets
+        best, best_score = None, 0.0
+        for key, count in shared.items():
+            score = 2 * count / (len(query_grams) + self._trigram_counts[key])
+            if score > best_score:
+                best, best_score = key, score
+        if best_score < min_similarity:
+            return None
+        return best
+
+
+def load_places(path):
+    """
+    Reads extra places from a CSV file.
+
+    Args:
+        path (str): CSV with 'name', 'latitude' and 'longitude' columns and
+            an optional 'locality' column.
+
+    Returns:
+        list: The places.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            Place(row["name"], float(row["latitude"]), float(row["longitude"]), row.get("locality") or None)
+            for row in csv.DictReader(f)
+        ]
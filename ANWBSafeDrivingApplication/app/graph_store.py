@@ -0,0 +1,247 @@
+"""
+Persistent store for the road graph used by the route planner.
+
+The drive network is downloaded from OpenStreetMap once, written to a
+versioned snapshot on disk and loaded from that snapshot on every later
+start, so routing works offline and no request pays for the download.
+
+Usage:
+    python graph_store.py rebuild      # download and write a new snapshot
+    python graph_store.py timing       # report cold and warm load times
+"""
+import argparse
+import logging
+import os
+import pickle
+import re
+import statistics
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Area and network type served by the app
+GRAPH_PLACE = "Breda, Netherlands"
+NETWORK_TYPE = "drive"
+
+# Bump when the snapshot layout changes so stale files are rebuilt
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "graph_snapshots")
+
+
+def snapshot_path(place=GRAPH_PLACE, network_type=NETWORK_TYPE):
+    """
+    Returns the snapshot file path for a place and network type.
+
+    Args:
+        place (str): The place name passed to OSMnx.
+        network_type (str): The OSMnx network type.
+
+    Returns:
+        str: The path of the versioned snapshot file.
+    """
+    slug = "_".join(re.findall(r"[a-z0-9]+", place.lower()))
+    filename = f"{slug}_{network_type}_v{SNAPSHOT_VERSION}.pickle"
+    return os.path.join(SNAPSHOT_DIR, filename)
+
+
+def build_graph(place=GRAPH_PLACE, network_type=NETWORK_TYPE):
+    """
+    Downloads the road graph from OpenStreetMap.
+
+    Args:
+        place (str): The place name passed to OSMnx.
+        network_type (str): The OSMnx network type.
+
+    Returns:
+        networkx.MultiDiGraph: The road graph.
+    """
+    # Imported here so loading a snapshot does not need OSMnx or the network
+    import osmnx as ox
+
+    logger.info(f"Downloading {network_type} graph for {place}")
+    return ox.graph_from_place(place, network_type=network_type)
+
+
+def save_snapshot(G, path, place=GRAPH_PLACE, network_type=NETWORK_TYPE):
+    """
+    Writes a graph snapshot to disk.
+
+    The file is written next to the target and renamed into place, so a
+    reader never sees a partially written snapshot.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        path (str): The snapshot file path.
+        place (str): The place name the graph was built for.
+        network_type (str): The OSMnx network type.
+    """
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "place": place,
+        "network_type": network_type,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "graph": G,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved graph snapshot to {path}")
+
+
+def load_snapshot(path):
+    """
+    Reads a graph snapshot from disk.
+
+    Args:
+        path (str): The snapshot file path.
+
+    Returns:
+        networkx.MultiDiGraph: The road graph.
+
+    Raises:
+        ValueError: If the snapshot was written by another layout version.
+    """
+    with open(path, "rb") as f:
+        payload = pickle.load(f)
+    if payload.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Graph snapshot {path} has version {payload.get('version')}, "
+            f"expected {SNAPSHOT_VERSION}. Run 'python graph_store.py rebuild'."
+        )
+    return payload["graph"]
+
+
+def load_graph(place=GRAPH_PLACE, network_type=NETWORK_TYPE, download=True):
+    """
+    Loads the road graph, building the snapshot first if it is missing.
+
+    Args:
+        place (str): The place name passed to OSMnx.
+        network_type (str): The OSMnx network type.
+        download (bool): Whether to download the graph when no snapshot exists.
+
+    Returns:
+        networkx.MultiDiGraph: The road graph.
+
+    Raises:
+        FileNotFoundError: If there is no snapshot and download is False.
+    """
+    path = snapshot_path(place, network_type)
+    if os.path.exists(path):
+        return load_snapshot(path)
+
+    if not download:
+        raise FileNotFoundError(
+            f"No graph snapshot at {path}. Run 'python graph_store.py rebuild'."
+        )
+
+    G = build_graph(place, network_type)
+    save_snapshot(G, path, place, network_type)
+    return G
+
+
+def rebuild(place=GRAPH_PLACE, network_type=NETWORK_TYPE):
+    """
+    Downloads the graph again and replaces the snapshot.
+
+    Args:
+        place (str): The place name passed to OSMnx.
+        network_type (str): The OSMnx network type.
+
+    Returns:
+        str: The path of the written snapshot.
+    """
+    path = snapshot_path(place, network_type)
+    start = time.perf_counter()
+    G = build_graph(place, network_type)
+    build_seconds = time.perf_counter() - start
+    save_snapshot(G, path, place, network_type)
+    logger.info(
+        f"Built {len(G.nodes)} nodes / {len(G.edges)} edges in {build_seconds:.2f}s "
+        f"({os.path.getsize(path) / 1e6:.1f} MB on disk)"
+    )
+    return path
+
+
+def drop_page_cache(path):
+    """
+    Evicts a file from the OS page cache, so the next read comes from disk.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        bool: Whether the cache could be dropped; only supported where
+        posix_fadvise is, e.g. Linux.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # Dirty pages of a file that was just written are not evicted
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def time_loads(path, repeat=5):
+    """
+    Measures how long it takes to load a snapshot.
+
+    The file is dropped from the OS page cache first where the platform
+    allows it, so the first load is cold. Elsewhere the first load may still
+    be served from the cache, as the file was usually just written or read.
+    The following loads are warm.
+
+    Args:
+        path (str): The snapshot file path.
+        repeat (int): The number of warm loads to time.
+
+    Returns:
+        dict: The first load time, whether it was cold, and the median warm
+        load time in seconds.
+    """
+    cold = drop_page_cache(path)
+    start = time.perf_counter()
+    load_snapshot(path)
+    first = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load_snapshot(path)
+        warm.append(time.perf_counter() - start)
+
+    return {"first": first, "cold": cold, "warm": statistics.median(warm)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the road graph snapshot.")
+    parser.add_argument("command", choices=["rebuild", "timing"])
+    parser.add_argument("--place", default=GRAPH_PLACE)
+    parser.add_argument("--network-type", default=NETWORK_TYPE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "rebuild":
+        rebuild(args.place, args.network_type)
+
+    path = snapshot_path(args.place, args.network_type)
+    timings = time_loads(path, args.repeat)
+    if timings["cold"]:
+        print(f"Cold load: {timings['first']:.3f}s")
+    else:
+        print(f"First load: {timings['first']:.3f}s (the file may have been in the page cache)")
+    print(f"Warm load: {timings['warm']:.3f}s (median of {args.repeat})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+"""
+Tiled road graph for areas too large to load as one graph.
+
+The drive network of a region (e.g. a province) is cut into square tiles of
+TILE_SIZE degrees, each stored as its own graph snapshot. A tile owns the
+edges that start inside it and keeps the end node of edges that leave it, so
+neighbouring tiles share those boundary nodes by OSM id. Stitching tiles is
+then a union of their nodes and edges, without any matching.
+
+Routers load only the tiles covering a route's bounding box plus a margin.
+Loaded tiles are kept in a byte-bounded LRU cache, so memory and load time
+follow the extent of the routes served, not the size of the region.
+
+Tiles are built one at a time, each from a download of its area plus a
+buffer, so the whole region never has to fit in memory. An existing graph
+snapshot can be split into tiles as well.
+
+A region holds many streets of the same name, so the street gazetteer of
+the tiles places each stretch of a street name separately and names it by
+the nearest city, town or village, which addresses then pick it by.
+
+Usage:
+    python graph_tiles.py build --region "Noord-Brabant, Netherlands"
+    python graph_tiles.py split                 # serve the Breda snapshot as tiles
+    python graph_tiles.py timing --bbox 51.55,4.70,51.62,4.82
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import networkx as nx
+import numpy as np
+
+from geocoder import Place, load_places
+from graph_store import (
+    GRAPH_PLACE, NETWORK_TYPE, SNAPSHOT_DIR, SNAPSHOT_VERSION, load_graph, load_snapshot, save_snapshot,
+)
+from route_cache import RouteCache
+from spatial_index import NodeIndex
+
+logger = logging.getLogger(__name__)
+
+# Region served from tiles when a tile index for it exists
+TILE_REGION = "Noord-Brabant, Netherlands"
+
+# Tile edge length in degrees, about 11 km north-south and 7 km east-west here
+TILE_SIZE = 0.1
+
+# Extra area downloaded around a tile while building, in degrees, so roads
+# crossing its border are simplified the same way as in the neighbour tile
+BUILD_BUFFER = 0.02
+
+# Margin added around a route's bounding box before picking tiles, in degrees
+TILE_MARGIN = 0.03
+
+# Memory budget of the loaded tiles
+TILE_CACHE_BYTES = 512 * 1024 * 1024
+
+# OpenStreetMap place types whose names are the localities of streets
+LOCALITY_TYPES = ["city", "town", "village"]
+
+# In-memory size of a loaded NetworkX tile relative to its pickle file,
+# measured with tracemalloc
+TILE_MEMORY_FACTOR = 8
+
+TILE_DIR = os.path.join(SNAPSHOT_DIR, "tiles")
+
+
+def tile_dir(region=TILE_REGION, network_type=NETWORK_TYPE):
+    """
+    Returns the directory holding the tiles of a region.
+
+    Args:
+        region (str): The region name passed to OSMnx.
+        network_type (str): The OSMnx network type.
+
+    Returns:
+        str: The versioned tile directory.
+    """
+    slug = "_".join(re.findall(r"[a-z0-9]+", region.lower()))
+    return os.path.join(TILE_DIR, f"{slug}_{network_type}_v{SNAPSHOT_VERSION}")
+
+
+def tile_key(lat, lon, tile_size=TILE_SIZE):
+    """
+    Returns the tile containing a coordinate.
+
+    Args:
+        lat (float): The latitude in degrees.
+        lon (float): The longitude in degrees.
+        tile_size (float): The tile edge length in degrees.
+
+    Returns:
+        tuple: The (row, column) of the tile.
+    """
+    return math.floor(lat / tile_size), math.floor(lon / tile_size)
+
+
+def tile_bounds(key, tile_size=TILE_SIZE):
+    """
+    Returns the area of a tile.
+
+    Args:
+        key (tuple): The (row, column) of the tile.
+        tile_size (float): The tile edge length in degrees.
+
+    Returns:
+        tuple: The (south, west, north, east) bounds in degrees.
+    """
+    row, column = key
+    return row * tile_size, column * tile_size, (row + 1) * tile_size, (column + 1) * tile_size
+
+
+def tiles_for_bbox(south, west, north, east, tile_size=TILE_SIZE):
+    """
+    Returns the tiles overlapping a bounding box.
+
+    Args:
+        south (float): The southern bound in degrees.
+        west (float): The western bound in degrees.
+        north (float): The northern bound in degrees.
+        east (float): The eastern bound in degrees.
+        tile_size (float): The tile edge length in degrees.
+
+    Returns:
+        list: The (row, column) keys of the tiles.
+    """
+    first_row, first_column = tile_key(south, west, tile_size)
+    last_row, last_column = tile_key(north, east, tile_size)
+    return [
+        (row, column)
+        for row in range(first_row, last_row + 1)
+        for column in range(first_column, last_column + 1)
+    ]
+
+
+def _tile_filename(key):
+    return f"tile_{key[0]}_{key[1]}.pickle"
+
+
+def owned_subgraph(G, key, tile_size=TILE_SIZE):
+    """
+    Cuts out the part of a graph that a tile owns.
+
+    Args:
+        G (networkx.MultiDiGraph): A graph covering at least the tile.
+        key (tuple): The (row, column) of the tile.
+        tile_size (float): The tile edge length in degrees.
+
+    Returns:
+        networkx.MultiDiGraph: The edges starting in the tile, with both
+        their end nodes.
+    """
+    tile = nx.MultiDiGraph(**G.graph)
+    owned = {node for node, data in G.nodes(data=True) if tile_key(data["y"], data["x"], tile_size) == key}
+    for u, v, k, data in G.edges(keys=True, data=True):
+        if u in owned:
+            for node in (u, v):
+                if node not in tile:
+                    tile.add_node(node, **G.nodes[node])
+            tile.add_edge(u, v, key=k, **data)
+    # Nodes without outgoing edges still belong somewhere for snapping
+    tile.add_nodes_from((node, G.nodes[node]) for node in owned if node not in tile)
+    return tile
+
+
+def split_graph(G, tile_size=TILE_SIZE):
+    """
+    Splits a graph into tiles.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        tile_size (float): The tile edge length in degrees.
+
+    Returns:
+        dict: The tile graph per (row, column) key.
+    """
+    owner = {node: tile_key(data["y"], data["x"], tile_size) for node, data in G.nodes(data=True)}
+    tiles = {key: nx.MultiDiGraph(**G.graph) for key in sorted(set(owner.values()))}
+    for node, key in owner.items():
+        tiles[key].add_node(node, **G.nodes[node])
+    for u, v, k, data in G.edges(keys=True, data=True):
+        tile = tiles[owner[u]]
+        if v not in tile:
+            tile.add_node(v, **G.nodes[v])
+        tile.add_edge(u, v, key=k, **data)
+    return tiles
+
+
+def download_tile(key, tile_size=TILE_SIZE, buffer=BUILD_BUFFER, network_type=NETWORK_TYPE):
+    """
+    Downloads the road graph of one tile.
+
+    Args:
+        key (tuple): The (row, column) of the tile.
+        tile_size (float): The tile edge length in degrees.
+        buffer (float): Extra area downloaded around the tile, in degrees.
+        network_type (str): The OSMnx network type.
+
+    Returns:
+        networkx.MultiDiGraph: The tile graph, or None if it has no roads.
+    """
+    import osmnx as ox
+    from osmnx._errors import InsufficientResponseError
+
+    south, west, north, east = tile_bounds(key, tile_size)
+    try:
+        G = ox.graph_from_bbox(
+            (west - buffer, south - buffer, east + buffer, north + buffer),
+            network_type=network_type,
+            truncate_by_edge=True,
+            retain_all=True,
+        )
+    except (InsufficientResponseError, ValueError):
+        return None
+    tile = owned_subgraph(G, key, tile_size)
+    return tile if len(tile) else None
+
+
+def write_index(out_dir, region, network_type, tile_size, tiles):
+    """
+    Writes the index of a tile directory.
+
+    Args:
+        out_dir (str): The tile directory.
+        region (str): The region name.
+        network_type (str): The OSMnx network type.
+        tile_size (float): The tile edge length in degrees.
+        tiles (dict): Node and edge counts per (row, column) key.
+    """
+    index = {
+        "version": SNAPSHOT_VERSION,
+        "region": region,
+        "network_type": network_type,
+        "tile_size": tile_size,
+        "tiles": {
+            f"{row}_{column}": dict(counts, bytes=os.path.getsize(os.path.join(out_dir, _tile_filename((row, column)))))
+            for (row, column), counts in sorted(tiles.items())
+        },
+    }
+    tmp_path = os.path.join(out_dir, "index.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, os.path.join(out_dir, "index.json"))
+
+
+def download_localities(area):
+    """
+    Downloads the cities, towns and villages of an area.
+
+    Args:
+        area (shapely.geometry.base.BaseGeometry): The area.
+
+    Returns:
+        list: A Place per locality, its own name as address and locality.
+    """
+    import osmnx as ox
+    from osmnx._errors import InsufficientResponseError
+
+    try:
+        features = ox.features_from_polygon(area, tags={"place": LOCALITY_TYPES})
+    except InsufficientResponseError:
+        return []
+    if "name" not in features:
+        return []
+    features = features[features["name"].notna()]
+    points = features.geometry.representative_point()
+    return [Place(name, point.y, point.x, name) for name, point in zip(features["name"], points)]
+
+
+def nearest_locality(localities):
+    """
+    Returns a function naming the locality nearest to a coordinate.
+
+    Args:
+        localities (list): Places with a locality.
+
+    Returns:
+        callable: Takes a latitude and longitude and returns the locality, or
+        None if there are no localities.
+    """
+    if not localities:
+        return lambda lat, lon: None
+    index = NodeIndex(np.arange(len(localities)), [place.latitude for place in localities],
+                      [place.longitude for place in localities])
+    return lambda lat, lon: localities[index.nearest(lat, lon)].locality
+
+
+def street_stretches(G):
+    """
+    Splits the streets of a graph into connected stretches per name.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+
+    Returns:
+        list: (name, nodes) per stretch, so streets of the same name in
+        different places stay apart.
+    """
+    street_edges = defaultdict(list)
+    for u, v, name in G.edges(data="name"):
+        for street in name if isinstance(name, list) else [name]:
+            if isinstance(street, str):
+                street_edges[street].append((u, v))
+    return [
+        (street, nodes)
+        for street, edges in street_edges.items()
+        for nodes in nx.connected_components(nx.Graph(edges))
+    ]
+
+
+def _save_tile(tile, key, out_dir, region, network_type, tiles, streets, centre, locality_of):
+    save_snapshot(tile, os.path.join(out_dir, _tile_filename(key)), f"{region} tile {key[0]}_{key[1]}", network_type)
+    tiles[key] = {"nodes": len(tile), "edges": tile.number_of_edges()}
+    # Coordinate sums per (street, locality), so a street crossing tiles is placed at its overall centre
+    for street, nodes in street_stretches(tile):
+        lat = sum(tile.nodes[node]["y"] for node in nodes)
+        lon = sum(tile.nodes[node]["x"] for node in nodes)
+        entry = streets.setdefault((street, locality_of(lat / len(nodes), lon / len(nodes))), [0.0, 0.0, 0])
+        entry[0] += lat
+        entry[1] += lon
+        entry[2] += len(nodes)
+    centre[0] += sum(y for _, y in tile.nodes(data="y"))
+    centre[1] += sum(x for _, x in tile.nodes(data="x"))
+    centre[2] += len(tile)
+
+
+def _write_streets(out_dir, region, streets, centre, localities):
+    places = [Place(street, lat / count, lon / count, locality)
+              for (street, locality), (lat, lon, count) in streets.items()]
+    places.extend(localities)
+    # The region itself is placed at the centre of all nodes, as in `Gazetteer.from_graph`
+    if centre[2]:
+        places.append(Place(region.split(",")[0], centre[0] / centre[2], centre[1] / centre[2]))
+    tmp_path = os.path.join(out_dir, "streets.csv.tmp")
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "latitude", "longitude", "locality"])
+        for place in places:
+            writer.writerow([place.address, place.latitude, place.longitude, place.locality or ""])
+    os.replace(tmp_path, os.path.join(out_dir, "streets.csv"))
+
+
+def build_tiles(region=TILE_REGION, network_type=NETWORK_TYPE, tile_size=TILE_SIZE, buffer=BUILD_BUFFER):
+    """
+    Downloads a region tile by tile and writes the tile directory.
+
+    Tiles already on disk are kept, so an interrupted build resumes.
+
+    Args:
+        region (str): The region name passed to OSMnx.
+        network_type (str): The OSMnx network type.
+        tile_size (float): The tile edge length in degrees.
+        buffer (float): Extra area downloaded around each tile, in degrees.
+
+    Returns:
+        str: The tile directory.
+    """
+    import osmnx as ox
+    from shapely.geometry import box
+
+    out_dir = tile_dir(region, network_type)
+    os.makedirs(out_dir, exist_ok=True)
+    area = ox.geocode_to_gdf(region).union_all()
+    west, south, east, north = area.bounds
+    localities = download_localities(area)
+    locality_of = nearest_locality(localities)
+
+    tiles, streets, centre = {}, {}, [0.0, 0.0, 0]
+    for key in tiles_for_bbox(south, west, north, east, tile_size):
+        bounds = tile_bounds(key, tile_size)
+        if not area.intersects(box(bounds[1], bounds[0], bounds[3], bounds[2])):
+            continue
+        path = os.path.join(out_dir, _tile_filename(key))
+        start = time.perf_counter()
+        tile = load_snapshot(path) if os.path.exists(path) else download_tile(key, tile_size, buffer, network_type)
+        if tile is None:
+            continue
+        _save_tile(tile, key, out_dir, region, network_type, tiles, streets, centre, locality_of)
+        logger.info(f"Tile {key}: {len(tile)} nodes in {time.perf_counter() - start:.1f}s")
+
+    _write_streets(out_dir, region, streets, centre, localities)
+    write_index(out_dir, region, network_type, tile_size, tiles)
+    return out_dir
+
+
+def split_snapshot(G, region=TILE_REGION, network_type=NETWORK_TYPE, tile_size=TILE_SIZE, locality=None):
+    """
+    Splits a loaded graph into a tile directory.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        region (str): The region name the tiles are stored under; the app
+            serves the tiles of TILE_REGION.
+        network_type (str): The OSMnx network type.
+        tile_size (float): The tile edge length in degrees.
+        locality (str): The city the graph covers, the locality of all its
+            streets, or None.
+
+    Returns:
+        str: The tile directory.
+    """
+    out_dir = tile_dir(region, network_type)
+    os.makedirs(out_dir, exist_ok=True)
+    tiles, streets, centre = {}, {}, [0.0, 0.0, 0]
+    for key, tile in split_graph(G, tile_size).items():
+        _save_tile(tile, key, out_dir, region, network_type, tiles, streets, centre, lambda lat, lon: locality)
+    localities = []
+    if locality and centre[2]:
+        localities.append(Place(locality, centre[0] / centre[2], centre[1] / centre[2], locality))
+    _write_streets(out_dir, region, streets, centre, localities)
+    write_index(out_dir, region, network_type, tile_size, tiles)
+    return out_dir
+
+
+def stitch(graphs):
+    """
+    Joins tiles into one graph at their shared boundary nodes.
+
+    Args:
+        graphs (list): Tile graphs.
+
+    Returns:
+        networkx.MultiDiGraph: The stitched graph. Attribute dicts are
+        copied, geometries are shared with the tiles.
+    """
+    G = nx.MultiDiGraph(**graphs[0].graph) if graphs else nx.MultiDiGraph()
+    for tile in graphs:
+        G.add_nodes_from(tile.nodes(data=True))
+        G.add_edges_from(tile.edges(keys=True, data=True))
+    return G
+
+
+class GraphTile:
+    """
+    A loaded tile with its approximate memory size.
+
+    Attributes:
+        key (tuple): The (row, column) of the tile.
+        G (networkx.MultiDiGraph): The tile graph.
+        nbytes (int): Estimated in-memory size.
+    """
+
+    def __init__(self, key, G, nbytes):
+        self.key = key
+        self.G = G
+        self.nbytes = nbytes
+
+
+class TileStore:
+    """
+    Loads tiles on demand and keeps recently used ones in memory.
+
+    Attributes:
+        directory (str): The tile directory.
+        tile_size (float): The tile edge length in degrees.
+        region (str): The region the tiles cover.
+        tiles (dict): Index entry per available (row, column) key.
+        cache (RouteCache): Byte-bounded LRU cache of loaded GraphTiles.
+    """
+
+    def __init__(self, directory, max_bytes=TILE_CACHE_BYTES):
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        if index.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Tile index {directory} has version {index.get('version')}, expected {SNAPSHOT_VERSION}."
+            )
+        self.directory = directory
+        self.tile_size = index["tile_size"]
+        self.region = index["region"]
+        self.tiles = {tuple(int(part) for part in name.split("_")): entry for name, entry in index["tiles"].items()}
+        self.cache = RouteCache(max_bytes)
+        self.load_seconds = 0.0
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "index.json"))
+
+    def gazetteer_places(self):
+        """
+        Returns the street places of all tiles, written at build time.
+
+        Returns:
+            list: The places.
+        """
+        path = os.path.join(self.directory, "streets.csv")
+        return load_places(path) if os.path.exists(path) else []
+
+    def tile(self, key):
+        """
+        Returns a tile, loading it on a cache miss.
+
+        Args:
+            key (tuple): The (row, column) of the tile.
+
+        Returns:
+            GraphTile: The tile.
+        """
+        def load():
+            start = time.perf_counter()
+            G = load_snapshot(os.path.join(self.directory, _tile_filename(key)))
+            self.load_seconds += time.perf_counter() - start
+            return GraphTile(key, G, self.tiles[key]["bytes"] * TILE_MEMORY_FACTOR)
+
+        return self.cache.get_or_compute(key, load)
+
+    def keys_for(self, points, margin=TILE_MARGIN):
+        """
+        Returns the available tiles covering points plus a margin.
+
+        Args:
+            points (list): (lat, lon) pairs, e.g. a route's start and end.
+            margin (float): Margin around their bounding box, in degrees.
+
+        Returns:
+            frozenset: The (row, column) keys of the tiles on disk.
+        """
+        lats = [lat for lat, _ in points]
+        lons = [lon for _, lon in points]
+        keys = tiles_for_bbox(min(lats) - margin, min(lons) - margin, max(lats) + margin, max(lons) + margin,
+                              self.tile_size)
+        return frozenset(key for key in keys if key in self.tiles)
+
+    def graph_for(self, keys):
+        """
+        Stitches a set of tiles into one graph.
+
+        Args:
+            keys (iterable): The (row, column) keys of the tiles.
+
+        Returns:
+            networkx.MultiDiGraph: The stitched graph.
+        """
+        return stitch([self.tile(key).G for key in sorted(keys)])
+
+    def stats(self):
+        """
+        Returns the tile cache counters.
+
+        Returns:
+            dict: Cache counters, tiles available and seconds spent loading.
+        """
+        return dict(self.cache.stats(), tiles=len(self.tiles), load_seconds=self.load_seconds)
+
+
+class RegionCache:
+    """
+    A few stitched regions, reused for routes inside them.
+
+    Values must expose an `nbytes` attribute with their approximate size,
+    which may grow while they are cached.
+
+    Attributes:
+        max_bytes (int): Total size above which the least recently used
+            regions go; the newest region is always kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._regions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._regions)
+
+    def find(self, keys):
+        """
+        Returns a region whose tiles include all of the given ones.
+
+        Args:
+            keys (frozenset): The tiles a route needs.
+
+        Returns:
+            The cached value, or None.
+        """
+        with self._lock:
+            for region_keys, value in reversed(self._regions.items()):
+                if keys <= region_keys:
+                    self._regions.move_to_end(region_keys)
+                    return value
+        return None
+
+    def put(self, keys, value):
+        """
+        Stores a region, dropping the least recently used ones beyond the budget.
+
+        Args:
+            keys (frozenset): The tiles of the region.
+            value: The region.
+
+        Returns:
+            list: The dropped values.
+        """
+        dropped = []
+        with self._lock:
+            self._regions[keys] = value
+            total = sum(region.nbytes for region in self._regions.values())
+            while total > self.max_bytes and len(self._regions) > 1:
+                region = self._regions.popitem(last=False)[1]
+                total -= region.nbytes
+                dropped.append(region)
+        return dropped
+
+    def values(self):
+        with self._lock:
+            return list(self._regions.values())
+
+    def nbytes(self):
+        """
+        Returns the approximate size of the cached regions.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return sum(region.nbytes for region in self.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect road graph tiles.")
+    parser.add_argument("command", choices=["build", "split", "timing"])
+    parser.add_argument("--region", default=TILE_REGION, help="Region name the tiles are stored under")
+    parser.add_argument("--network-type", default=NETWORK_TYPE)
+    parser.add_argument("--tile-size", type=float, default=TILE_SIZE)
+    parser.add_argument("--bbox", help="south,west,north,east to load for timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "build":
+        out_dir = build_tiles(args.region, args.network_type, args.tile_size)
+    elif args.command == "split":
+        out_dir = split_snapshot(load_graph(download=False), args.region, args.network_type, args.tile_size,
+                                 locality=GRAPH_PLACE.split(",")[0])
+    else:
+        out_dir = tile_dir(args.region, args.network_type)
+        store = TileStore(out_dir)
+        south, west, north, east = (float(part) for part in args.bbox.split(","))
+        start = time.perf_counter()
+        keys = store.keys_for([(south, west), (north, east)], margin=0)
+        G = store.graph_for(keys)
+        print(f"{len(keys)} of {len(store.tiles)} tiles, {len(G)} nodes, {G.number_of_edges()} edges "
+              f"in {time.perf_counter() - start:.3f}s; cache {store.stats()}")
+        return
+    logger.info(f"Wrote tiles to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for the backend.
+
+The app is loaded once in the master process and then forked, so the road
+graph, routing arrays and risk table are built a single time and shared
+copy-on-write by all workers.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import multiprocessing
+
+bind = "127.0.0.1:3630"
+workers = multiprocessing.cpu_count()
+# Threads let routes be served while a login waits on the password hash pool
+worker_class = "gthread"
+threads = 4
+preload_app = True
+timeout = 60
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork, so each worker follows the risk snapshots itself
+    from app import route_engine
+
+    if route_engine is not None:
+        route_engine.watch()
@@ -0,0 +1,322 @@
+"""
+In-process latency histograms and non-blocking logging.
+
+Each stage of a route request (geocoding, region loading, snapping,
+shortest path, risk lookup, building the response or map) runs inside a
+`span`, which records its duration into a histogram named after the stage.
+Histograms have fixed log-spaced buckets, so recording is a lock and an
+increment and memory does not grow with traffic; p50 and p95 are read from
+the buckets to within one bucket width (about 19%).
+
+Histograms are per process. Under gunicorn every worker keeps its own and
+`/metrics` reports the worker that answered; the pid in the report tells
+them apart.
+
+`QueueLogHandler` moves log writing off the request thread: records are put
+on a queue and written by a background listener that is restarted in each
+forked worker.
+
+Usage:
+    python metrics.py --url http://127.0.0.1:3630    # print a backend's timings
+"""
+import argparse
+import bisect
+import logging
+import logging.handlers
+import math
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in seconds, from 1 µs to about 2 minutes
+BUCKET_FACTOR = 2 ** 0.25
+BUCKETS = [1e-6 * BUCKET_FACTOR ** i for i in range(108)]
+
+# Quantiles reported per histogram
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Thread-safe latency histogram with log-spaced buckets.
+
+    Attributes:
+        name (str): The stage it times.
+        count (int): Durations recorded.
+        total (float): Their sum in seconds.
+        max (float): The longest, in seconds.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # One count per bucket and one for durations beyond the last bound
+        self._counts = [0] * (len(BUCKETS) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """
+        Records a duration.
+
+        Args:
+            seconds (float): The duration.
+        """
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self._counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by interpolating within its bucket.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The duration in seconds, 0 if nothing was recorded.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count, largest = self.count, self.max
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bucket, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                upper = BUCKETS[bucket] if bucket < len(BUCKETS) else largest
+                lower = BUCKETS[bucket - 1] if bucket > 0 else 0.0
+                fraction = (rank - seen) / bucket_count
+                # Geometric interpolation matches the log spacing of the buckets
+                if lower > 0:
+                    estimate = lower * (upper / lower) ** fraction
+                else:
+                    estimate = upper * fraction
+                return min(estimate, largest)
+            seen += bucket_count
+        return largest
+
+    def summary(self):
+        """
+        Summarizes the histogram in milliseconds.
+
+        Returns:
+            dict: Count, mean, max and the QUANTILES as 'p50', 'p95', ...
+        """
+        summary = {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "max_ms": 1000 * self.max,
+        }
+        for q in QUANTILES:
+            summary[f"p{round(100 * q)}_ms"] = 1000 * self.quantile(q)
+        return summary
+
+    def buckets(self):
+        """
+        Returns the cumulative bucket counts, as in Prometheus histograms.
+
+        Returns:
+            list: (upper bound in seconds, count at or below it) pairs, the
+            last bound being infinity.
+        """
+        with self._lock:
+            counts = list(self._counts)
+        cumulative, total = [], 0
+        for bound, bucket_count in zip(BUCKETS + [math.inf], counts):
+            total += bucket_count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Metrics:
+    """
+    Named histograms of one process.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        """
+        Returns the histogram of a stage, creating it on first use.
+
+        Args:
+            name (str): The stage name.
+
+        Returns:
+            Histogram: The histogram.
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    @contextmanager
+    def span(self, name):
+        """
+        Times the enclosed block into the histogram of a stage.
+
+        Blocks that raise are timed too.
+
+        Args:
+            name (str): The stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        Summarizes every histogram.
+
+        Returns:
+            dict: The pid and the `Histogram.summary` per stage name.
+        """
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        return {"pid": os.getpid(), "stages": {name: histogram.summary() for name, histogram in histograms}}
+
+    def prometheus(self, prefix="anwb_stage_seconds"):
+        """
+        Renders every histogram in the Prometheus text format.
+
+        Args:
+            prefix (str): The metric name.
+
+        Returns:
+            str: The exposition text.
+        """
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        lines = [f"# TYPE {prefix} histogram"]
+        for name, histogram in histograms:
+            labels = f'stage="{name}",pid="{os.getpid()}"'
+            for bound, count in histogram.buckets():
+                le = "+Inf" if math.isinf(bound) else f"{bound:.6g}"
+                lines.append(f'{prefix}_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f"{prefix}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{prefix}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+# Histograms of this process
+REGISTRY = Metrics()
+
+
+def span(name):
+    """
+    Times the enclosed block into the process histograms.
+
+    Args:
+        name (str): The stage name.
+    """
+    return REGISTRY.span(name)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Log handler that hands records to a background thread.
+
+    The thread that writes to the wrapped handlers is started on the first
+    record in each process, so a handler set up before gunicorn forks keeps
+    working in every worker.
+
+    Attributes:
+        targets (list): The handlers records are written to.
+    """
+
+    def __init__(self, *targets):
+        super().__init__(queue.SimpleQueue())
+        self.targets = list(targets)
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Records queued in the parent before the fork belong to the parent
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, *self.targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._ensure_listener()
+        super().enqueue(record)
+
+    def close(self):
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+        for target in self.targets:
+            target.close()
+        super().close()
+
+
+def queue_logging(*handlers, level=logging.INFO, fmt="%(asctime)s %(levelname)s %(message)s"):
+    """
+    Sends the root logger's records to handlers through a background thread.
+
+    Args:
+        *handlers: The handlers to write to.
+        level (int): The root log level.
+        fmt (str): The record format of the handlers.
+
+    Returns:
+        QueueLogHandler: The handler installed on the root logger.
+    """
+    formatter = logging.Formatter(fmt)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_handler = QueueLogHandler(*handlers)
+    # The message is merged with its arguments and traceback before queueing;
+    # the handlers add the rest of the format
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    return queue_handler
+
+
+def main():
+    import requests
+
+    parser = argparse.ArgumentParser(description="Print the stage timings of a running backend.")
+    parser.add_argument("--url", default="http://127.0.0.1:3630")
+    args = parser.parse_args()
+
+    snapshot = requests.get(f"{args.url}/metrics", params={"format": "json"}, timeout=10).json()
+    print(f"Worker {snapshot['pid']}")
+    print(f"{'stage':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, summary in snapshot["stages"].items():
+        print(f"{name:<28}{summary['count']:>8}{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}"
+              f"{summary['max_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
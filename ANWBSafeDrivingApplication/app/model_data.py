@@ -0,0 +1,251 @@
+"""
+Typed, columnar loading of the model data.
+
+`model_data.csv` is converted once into an Arrow (Feather) file next to it
+that holds only the columns the app uses, with compact types: road names as
+a categorical, month, day and condition as int8, the risk level as a
+nullable Int8, since the label may be missing, and the accident averages as
+float32. Later starts load that file into pandas column by column instead of
+parsing the CSV; the frame is a copy in memory, as compact as its types. The
+file is rebuilt whenever the CSV is newer. Without pyarrow the CSV is read
+directly, still restricted to the used columns and typed on load.
+
+Usage:
+    python model_data.py convert              # write model_data.feather
+    python model_data.py report --scale 100   # cold start and memory, CSV vs Feather
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DATA_PATH = os.path.join(APP_DIR, "model_data.csv")
+
+# Columns read by the app, the risk table and the model scorer; a missing
+# risk label is kept as <NA> and read as the default risk level
+COLUMN_TYPES = {
+    "road_name": "category",
+    "month": "int8",
+    "day": "int8",
+    "most_common_condition": "int8",
+    "avg_yearly_accidents": "float32",
+    "average_monthly_occurrences": "float32",
+    "Risk Level": "Int8",
+}
+
+
+def columnar_path(csv_path):
+    """
+    Returns the columnar file that caches a CSV.
+
+    Args:
+        csv_path (str): The CSV file.
+
+    Returns:
+        str: The Feather file path next to it.
+    """
+    return os.path.splitext(csv_path)[0] + ".feather"
+
+
+def read_typed_csv(path=MODEL_DATA_PATH):
+    """
+    Reads the used columns of the model data CSV with compact types.
+
+    Args:
+        path (str): The CSV file.
+
+    Returns:
+        pd.DataFrame: The typed model data.
+    """
+    # Conditions may be label-encoded ints or raw labels, so they are read
+    # as a categorical first and narrowed to int8 codes only if numeric
+    dtypes = dict(COLUMN_TYPES, most_common_condition="category")
+    df = pd.read_csv(path, usecols=list(COLUMN_TYPES), dtype=dtypes)
+    conditions = df["most_common_condition"]
+    codes = pd.to_numeric(conditions.cat.categories, errors="coerce")
+    if not codes.isna().any():
+        df["most_common_condition"] = conditions.cat.rename_categories(codes).astype("int8")
+    return df[list(COLUMN_TYPES)]
+
+
+def convert(csv_path=MODEL_DATA_PATH, out_path=None):
+    """
+    Converts the model data CSV into a typed Feather file.
+
+    Args:
+        csv_path (str): The CSV file.
+        out_path (str): The Feather file, next to the CSV by default.
+
+    Returns:
+        str: The written file path.
+    """
+    import pyarrow.feather as feather
+
+    out_path = out_path or columnar_path(csv_path)
+    df = read_typed_csv(csv_path)
+    # A temporary file of its own, as the backend and the UI may convert at once
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(out_path)), prefix=os.path.basename(out_path), suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        # Uncompressed so loading it needs no decoding
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return out_path
+
+
+def load_model_data(path=MODEL_DATA_PATH, columns=None):
+    """
+    Loads the model data, converting the CSV to Feather on first use.
+
+    Args:
+        path (str): The CSV file, relative to the app by default.
+        columns (list): Columns to load, all used columns by default.
+
+    Returns:
+        pd.DataFrame: The typed model data.
+    """
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        df = read_typed_csv(path)
+        return df[columns] if columns else df
+
+    feather_path = columnar_path(path)
+    if not os.path.exists(feather_path) or (
+        os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(feather_path)
+    ):
+        logger.info(f"Converting {path} to {feather_path}")
+        convert(path, feather_path)
+
+    return feather.read_table(feather_path, columns=columns, memory_map=True).to_pandas()
+
+
+def synthetic_csv(csv_path, out_path, scale):
+    """
+    Writes a larger copy of the CSV with every road repeated under new names.
+
+    Args:
+        csv_path (str): The original CSV.
+        out_path (str): The synthetic CSV.
+        scale (int): How many copies of the data to write.
+    """
+    df = pd.read_csv(csv_path)
+    for i in range(scale):
+        copy = df.assign(road_name=df["road_name"].astype(str) + f" {i}")
+        copy.to_csv(out_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+
+
+def resident_mib():
+    """
+    Returns the resident memory of this process.
+
+    Returns:
+        float: The resident set size in MiB, or None where /proc is missing.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _probe(kind, path):
+    # Runs in a fresh interpreter so time and memory are those of a cold start
+    import resource
+    import time
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    resident_before = resident_mib()
+    start = time.perf_counter()
+    df = pd.read_csv(path) if kind == "csv" else load_model_data(path)
+    seconds = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    resident_after = resident_mib()
+    print(json.dumps({
+        "seconds": seconds,
+        "peak_mib": (after - before) / 1024,
+        "resident_mib": resident_after - resident_before if resident_after is not None else None,
+        "frame_mib": df.memory_usage(deep=True).sum() / 2 ** 20,
+    }))
+
+
+def measure(kind, path):
+    """
+    Measures a cold load of the model data in a new process.
+
+    Args:
+        kind (str): 'csv' for a plain read_csv, 'columnar' for `load_model_data`.
+        path (str): The CSV file.
+
+    Returns:
+        dict: Load seconds, peak and resident memory growth and DataFrame
+        size in MiB; resident growth is None where it cannot be read.
+    """
+    code = f"import model_data; model_data._probe({kind!r}, {path!r})"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=APP_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(path=MODEL_DATA_PATH, scale=100):
+    """
+    Compares cold loads of the CSV and the columnar file.
+
+    Args:
+        path (str): The CSV file.
+        scale (int): Size of the synthetic data set relative to the CSV.
+
+    Returns:
+        dict: Measurements per data set and loader.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        synthetic = os.path.join(tmp_dir, f"model_data_x{scale}.csv")
+        synthetic_csv(path, synthetic, scale)
+        for name, csv_path in (("1x", path), (f"{scale}x", synthetic)):
+            # The first columnar load converts, the second is the steady state
+            measure("columnar", csv_path)
+            results[name] = {kind: measure(kind, csv_path) for kind in ("csv", "columnar")}
+            results[name]["csv_mib"] = os.path.getsize(csv_path) / 2 ** 20
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert and profile the model data.")
+    parser.add_argument("command", choices=["convert", "report"])
+    parser.add_argument("--data", default=MODEL_DATA_PATH)
+    parser.add_argument("--scale", type=int, default=100)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "convert":
+        logger.info(f"Wrote {convert(args.data)}")
+    else:
+        for name, result in report(args.data, args.scale).items():
+            print(f"{name}: {result['csv_mib']:.1f} MiB CSV")
+            for kind in ("csv", "columnar"):
+                r = result[kind]
+                resident = f"{r['resident_mib']:7.1f}" if r["resident_mib"] is not None else "    n/a"
+                print(f"{name:>5} {kind:>8}: {r['seconds'] * 1000:8.1f} ms, "
+                      f"peak +{r['peak_mib']:7.1f} MiB, resident +{resident} MiB, "
+                      f"frame {r['frame_mib']:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
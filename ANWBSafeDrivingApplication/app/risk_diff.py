@@ -0,0 +1,274 @@
+"""
+Edge-level difference between two risk snapshots, and the cached routes it affects.
+
+From one day or risk table to the next only a few roads usually change
+risk level. Instead of recomputing every cached route after a change,
+`RiskDiff` tells which ones the changed edges may have altered:
+
+- Shortest routes do not depend on risk. They are kept, and only the risk
+  levels of their roads are updated.
+- A safest route is kept if it crosses no changed edge and no edge that
+  became cheaper could be part of a cheaper route. The second test bounds
+  the cost of every route through such an edge from below, so it is exact
+  and costs one vector operation per route.
+- Alternatives to a safest route are kept if no changed edge lies within
+  the area their search covers.
+
+The rest are dropped and recomputed when next requested, so the work after a
+change grows with the number of edges that changed, not the size of the cache.
+
+The bounds come from the straight-line distance and from shortest-path trees
+grown to and from a few landmarks at the corners of the graph (the ALT
+bound). The trees are grown once per change, with the lower of the old and
+new cost of each edge, so they hold for both.
+
+Usage:
+    python risk_diff.py --routes 200 --changed 0.01 0.05 0.2
+"""
+import argparse
+import logging
+import random
+import time
+
+import networkx as nx
+import numpy as np
+
+from alternatives import MAX_STRETCH, RouteSet
+from routing import ROUTE_MODES, RouteResult
+
+logger = logging.getLogger(__name__)
+
+# Directions of the landmarks: the nodes furthest north-east, south-east,
+# north-west and south-west
+LANDMARK_CORNERS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+class RiskDiff:
+    """
+    The edges whose risk level differs between two risk snapshots.
+
+    Attributes:
+        csr_graph (CSRGraph): The routing graph.
+        old_risk (np.ndarray): Risk level per edge position before the change.
+        new_risk (np.ndarray): Risk level per edge position after it.
+        changed (np.ndarray): The positions of the edges whose level changed.
+    """
+
+    def __init__(self, csr_graph, old_risk, new_risk):
+        self.csr_graph = csr_graph
+        self.old_risk = old_risk
+        self.new_risk = new_risk
+        self.changed = np.flatnonzero(old_risk != new_risk)
+        self._changed_mask = old_risk != new_risk
+        self._trees = {}
+
+    def __len__(self):
+        return len(self.changed)
+
+    def crosses(self, route):
+        """
+        Tells whether a route uses a changed edge.
+
+        Args:
+            route (RouteResult): The route.
+
+        Returns:
+            bool: Whether any of its edges changed risk level.
+        """
+        return bool(self._changed_mask[route.edges].any())
+
+    def _landmark_trees(self, alpha):
+        # Costs to and from the landmarks with the lower of the old and new
+        # cost of each edge, grown once per risk weight
+        trees = self._trees.get(alpha)
+        if trees is None:
+            csr_graph = self.csr_graph
+            costs = csr_graph.edge_costs(np.minimum(self.old_risk, self.new_risk), alpha)
+            x, y = csr_graph.x, csr_graph.y
+            corners = {int(np.argmax(sx * x + sy * y)) for sx, sy in LANDMARK_CORNERS}
+            landmarks = csr_graph.node_ids[sorted(corners)].tolist()
+            forward = np.array([csr_graph.search_tree(landmark, costs)[0] for landmark in landmarks])
+            backward = np.array([csr_graph.search_tree(landmark, costs, reverse=True)[0] for landmark in landmarks])
+            trees = self._trees[alpha] = (forward, backward)
+        return trees
+
+    def _bound(self, sources, targets, alpha):
+        # Lower bound of the cost from source to target node positions: by
+        # the triangle inequality over each landmark, or the straight line
+        forward, backward = self._landmark_trees(alpha)
+        sources, targets = np.atleast_1d(sources), np.atleast_1d(targets)
+        with np.errstate(invalid="ignore"):
+            bounds = np.concatenate([forward[:, targets] - forward[:, sources],
+                                     backward[:, sources] - backward[:, targets]])
+        # Nodes no landmark reaches give no bound
+        bounds = np.where(np.isnan(bounds), 0.0, bounds).max(axis=0)
+        return np.maximum(bounds, self.csr_graph.cost_bound(sources, targets))
+
+    def _bounds(self, route, edges, alpha):
+        # Lower bound of the cost of a route from the start to the end
+        # through each edge, without the cost of the edge itself
+        node_pos = self.csr_graph.node_pos
+        source = node_pos[int(route.nodes[0])]
+        target = node_pos[int(route.nodes[-1])]
+        return (self._bound(source, self.csr_graph.tails[edges], alpha)
+                + self._bound(self.csr_graph.heads[edges], target, alpha))
+
+    def affects(self, routes, alpha):
+        """
+        Tells whether the change may alter cached routes between two nodes.
+
+        Args:
+            routes (list): The best route and any alternatives kept with it.
+            alpha (float): The risk weight they were computed with.
+
+        Returns:
+            bool: False if the routes are still the ones a search with the
+            new risk would find.
+        """
+        if len(self.changed) == 0 or alpha == 0:
+            return False
+        if any(self.crosses(route) for route in routes):
+            return True
+        primary = routes[0]
+        if len(primary.edges) == 0:
+            return False
+
+        length = self.csr_graph.length
+        cost = float((length[primary.edges] * (1.0 + alpha * self.new_risk[primary.edges])).sum())
+        old_costs = length[self.changed] * (1.0 + alpha * self.old_risk[self.changed])
+        new_costs = length[self.changed] * (1.0 + alpha * self.new_risk[self.changed])
+        if len(routes) == 1:
+            # Only an edge that became cheaper can lead to a cheaper route
+            cheaper = new_costs < old_costs
+            if not cheaper.any():
+                return False
+            bounds = self._bounds(primary, self.changed[cheaper], alpha) + new_costs[cheaper]
+            return bool((bounds < cost).any())
+        # Alternatives are picked from every route within MAX_STRETCH of the best
+        bounds = self._bounds(primary, self.changed, alpha) + np.minimum(old_costs, new_costs)
+        return bool((bounds <= MAX_STRETCH * cost).any())
+
+    def relabel(self, route):
+        """
+        Updates the risk levels of a route's roads.
+
+        Args:
+            route (RouteResult): The route.
+
+        Returns:
+            RouteResult: The route itself if it crosses no changed edge, else
+            a copy with the new levels.
+        """
+        if not self.crosses(route):
+            return route
+        return RouteResult.from_route(self.csr_graph, route.nodes, route.edges, self.new_risk)
+
+    def refresh(self, value, alpha):
+        """
+        Carries a cached route or route set over to the new risk.
+
+        Args:
+            value (RouteResult or RouteSet): The cached value.
+            alpha (float): The risk weight it was computed with.
+
+        Returns:
+            The value valid under the new risk, or None if it must be recomputed.
+        """
+        routes = value.routes if isinstance(value, RouteSet) else [value]
+        if self.affects(routes, alpha):
+            return None
+        routes = [self.relabel(route) for route in routes]
+        return RouteSet(routes) if isinstance(value, RouteSet) else routes[0]
+
+
+def benchmark(engine, routes=200, shares=(0.01, 0.05, 0.2), k=1, seed=0):
+    """
+    Times carrying cached routes over a risk change against recomputing them.
+
+    The route cache is filled with random routes in every mode, then a share
+    of the edges, picked at random, moves one risk level up or down.
+
+    Args:
+        engine (RouteEngine): The routing engine.
+        routes (int): Routes cached per mode.
+        shares (tuple): Shares of edges to change.
+        k (int): Routes per cache entry, the best one included.
+        seed (int): The random seed.
+
+    Returns:
+        list: Per share, the edges changed, the entries kept and dropped,
+        the seconds to carry the entries over, the seconds to carry over and
+        recompute the dropped ones, and the seconds to recompute all of them.
+    """
+    rng = random.Random(seed)
+    nodes = engine.csr_graph.node_ids.tolist()
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(routes)]
+    old = engine.today_risk()
+    old_index, old_risk = old
+    results = []
+    for share in shares:
+        new_risk = old_risk.copy()
+        picked = np.random.default_rng(seed).random(len(new_risk)) < share
+        new_risk[picked] = np.where(new_risk[picked] > 0, new_risk[picked] - 1, 1)
+        new = (type(old_index)(old_index.road_risk, version=f"{old_index.version}+{share}"), new_risk)
+
+        engine.route_cache.clear()
+        for source, target in pairs:
+            for mode in ROUTE_MODES:
+                try:
+                    engine.alternatives(source, target, mode, old, k)
+                except nx.NetworkXNoPath:
+                    pass
+        cached = len(engine.route_cache)
+
+        start = time.perf_counter()
+        diff = RiskDiff(engine.csr_graph, old_risk, new_risk)
+        kept, dropped = engine.route_cache.carry_over(
+            old_index.version, new[0].version, lambda key, value: diff.refresh(value, ROUTE_MODES[key[2]])
+        )
+        carry = time.perf_counter() - start
+        for source, target in pairs:
+            for mode in ROUTE_MODES:
+                try:
+                    engine.alternatives(source, target, mode, new, k)
+                except nx.NetworkXNoPath:
+                    pass
+        incremental = time.perf_counter() - start
+
+        engine.route_cache.clear()
+        start = time.perf_counter()
+        for source, target in pairs:
+            for mode in ROUTE_MODES:
+                try:
+                    engine.alternatives(source, target, mode, new, k)
+                except nx.NetworkXNoPath:
+                    pass
+        full = time.perf_counter() - start
+        results.append({
+            "share": share, "edges": len(diff), "cached": cached, "kept": kept, "dropped": dropped, "carry": carry,
+            "incremental": incremental, "full": full,
+        })
+    return results
+
+
+def main():
+    from route_engine import RouteEngine
+
+    parser = argparse.ArgumentParser(description="Time carrying cached routes over a risk change.")
+    parser.add_argument("--routes", type=int, default=200, help="Routes cached per mode")
+    parser.add_argument("--changed", type=float, nargs="+", default=[0.01, 0.05, 0.2],
+                        help="Shares of edges whose risk changes")
+    parser.add_argument("-k", type=int, default=1, help="Routes per request, the best one included")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    engine = RouteEngine.load(download=False)
+    for result in benchmark(engine, args.routes, args.changed, args.k):
+        print(f"{result['share']:.0%} of edges ({result['edges']}): kept {result['kept']} of {result['cached']} "
+              f"cached entries in {result['carry']:.2f}s, {result['incremental']:.2f}s to carry over and recompute "
+              f"vs {result['full']:.2f}s to recompute all")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Risk level lookup for roads on a route.
+
+The index is built once per predictions refresh from `model_data.csv`, so
+colouring a route costs one dict lookup per road instead of a scan of the
+whole table.
+"""
+import math
+
+# Risk level used for roads without data
+DEFAULT_RISK = 0
+
+# Map colour per risk level
+RISK_COLORS = {
+    3: "red",
+    2: "orange",
+    1: "yellow",
+    0: "green",
+}
+
+
+def normalize_risk(value):
+    """
+    Converts a risk level read from the data or the model to an int.
+
+    The CSV stores risk levels as ints, while older code compared them to
+    strings such as '3'. Anything that is not a level from 0 to 3 falls
+    back to the default risk level.
+
+    Args:
+        value: The raw risk level (int, float, str or None).
+
+    Returns:
+        int: The risk level.
+    """
+    try:
+        level = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RISK
+    if math.isnan(level):
+        return DEFAULT_RISK
+    level = int(level)
+    if level not in RISK_COLORS:
+        return DEFAULT_RISK
+    return level
+
+
+def risk_color(level):
+    """
+    Returns the map colour for a risk level.
+
+    Args:
+        level (int): The risk level.
+
+    Returns:
+        str: The colour name.
+    """
+    return RISK_COLORS.get(level, RISK_COLORS[DEFAULT_RISK])
+
+
+class RiskIndex:
+    """
+    Lookup from road name and graph edge to risk level.
+
+    Attributes:
+        road_risk (dict): Risk level per road name.
+        version (str): Identifies the predictions the index was built from.
+    """
+
+    def __init__(self, road_risk, version="labels"):
+        self.road_risk = road_risk
+        self.version = version
+        self._edge_risk = {}
+
+    @classmethod
+    def from_frame(cls, df, month=None, day=None, version=None):
+        """
+        Builds the index from the model data.
+
+        Each road gets the risk level of its first row. When a month and day
+        are given, the rows for that date take precedence, so the index
+        follows the predictions made for it.
+
+        Args:
+            df (pd.DataFrame): The model data with 'road_name' and 'Risk Level'.
+            month (int): The month of the predictions to use.
+            day (int): The day of the predictions to use.
+            version (str): Identifies the predictions, defaults to the date.
+
+        Returns:
+            RiskIndex: The index.
+        """
+        first_rows = df.drop_duplicates("road_name")
+        road_risk = {
+            road_name: normalize_risk(risk)
+            for road_name, risk in zip(first_rows["road_name"], first_rows["Risk Level"])
+        }
+
+        if month is not None and day is not None:
+            today = df[(df["month"] == month) & (df["day"] == day)]
+            today = today.drop_duplicates("road_name")
+            road_risk.update(
+                (road_name, normalize_risk(risk))
+                for road_name, risk in zip(today["road_name"], today["Risk Level"])
+            )
+            if version is None:
+                version = f"{month:02d}-{day:02d}"
+
+        return cls(road_risk, version or "labels")
+
+    def road(self, road_name):
+        """
+        Returns the risk level of a road.
+
+        Args:
+            road_name (str or list): The road name. OSM edges that carry
+                several names get the highest risk among them.
+
+        Returns:
+            int: The risk level.
+        """
+        if isinstance(road_name, list):
+            return max((self.road(name) for name in road_name), default=DEFAULT_RISK)
+        return self.road_risk.get(road_name, DEFAULT_RISK)
+
+    def edge(self, G, u, v, key=0):
+        """
+        Returns the risk level of a graph edge.
+
+        Args:
+            G (networkx.MultiDiGraph): The road graph.
+            u (int): The edge start node.
+            v (int): The edge end node.
+            key (int): The edge key.
+
+        Returns:
+            int: The risk level.
+        """
+        edge_id = (u, v, key)
+        if edge_id not in self._edge_risk:
+            self._edge_risk[edge_id] = self.road(G[u][v][key].get("name"))
+        return self._edge_risk[edge_id]
+
+    def edge_risks(self, G):
+        """
+        Returns the risk level of every edge in the graph.
+
+        Args:
+            G (networkx.MultiDiGraph): The road graph.
+
+        Returns:
+            dict: Risk level per (u, v, key) edge id.
+        """
+        for u, v, key, name in G.edges(keys=True, data="name"):
+            if (u, v, key) not in self._edge_risk:
+                self._edge_risk[(u, v, key)] = self.road(name)
+        return self._edge_risk
@@ -0,0 +1,245 @@
+"""
+Fast scoring of the logistic regression risk model.
+
+`log_model.joblib` is a scikit-learn LogisticRegression trained on already
+label-encoded features, so a prediction is an argmax over one linear
+function per class. `LinearScorer` extracts the coefficients and intercepts
+once at load time (folding in any StandardScaler steps of a Pipeline) and
+then scores a batch with one float32 matrix multiply, skipping sklearn's
+per-call validation and DataFrame conversion.
+
+Rows whose two best classes are too close to call in float32 are rescored
+in float64, so predictions are identical to `model.predict`.
+
+Usage:
+    python risk_model.py --data model_data.csv    # parity check and benchmark
+"""
+import argparse
+import logging
+import time
+import timeit
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from model_data import MODEL_DATA_PATH, load_model_data
+from risk_table import FEATURES, MODEL_PATH, build_features
+
+logger = logging.getLogger(__name__)
+
+# Score margin below which a float32 argmax is rechecked in float64
+MARGIN_TOLERANCE = 1e-3
+
+
+class LinearScorer:
+    """
+    Argmax-of-linear-scores classifier extracted from a fitted model.
+
+    Attributes:
+        weights (np.ndarray): float64 weights of shape (features, classes).
+        bias (np.ndarray): float64 intercept per class.
+        classes (np.ndarray): The class label per score column.
+        feature_names (list): The input columns, in model order.
+    """
+
+    def __init__(self, weights, bias, classes, feature_names=FEATURES):
+        self.weights = np.ascontiguousarray(weights, dtype=np.float64)
+        self.bias = np.ascontiguousarray(bias, dtype=np.float64)
+        self.classes = np.asarray(classes)
+        self.feature_names = list(feature_names)
+        self._weights32 = self.weights.astype(np.float32)
+        self._bias32 = self.bias.astype(np.float32)
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Extracts the linear scores of a fitted sklearn classifier.
+
+        Supports a LogisticRegression on its own or at the end of a
+        Pipeline whose other steps are StandardScalers.
+
+        Args:
+            model: The fitted model.
+
+        Returns:
+            LinearScorer: The scorer.
+
+        Raises:
+            TypeError: If the model is not a supported linear classifier.
+        """
+        steps = [step for _, step in model.steps] if hasattr(model, "steps") else [model]
+        classifier = steps[-1]
+        if not hasattr(classifier, "coef_") or not hasattr(classifier, "classes_"):
+            raise TypeError(f"Unsupported model {type(classifier).__name__}")
+
+        coef = np.asarray(classifier.coef_, dtype=np.float64)
+        intercept = np.asarray(classifier.intercept_, dtype=np.float64)
+        if coef.shape[0] == 1:
+            # Binary models keep one score; class 1 wins when it is positive
+            coef = np.vstack((np.zeros_like(coef), coef))
+            intercept = np.concatenate(([0.0], intercept))
+
+        # Fold (x - mean) / scale into the weights, last step first
+        for step in reversed(steps[:-1]):
+            if type(step).__name__ != "StandardScaler":
+                raise TypeError(f"Unsupported pipeline step {type(step).__name__}")
+            if step.scale_ is not None:
+                coef = coef / step.scale_
+            if step.mean_ is not None:
+                intercept = intercept - coef @ step.mean_
+
+        feature_names = getattr(steps[0], "feature_names_in_", FEATURES)
+        return cls(coef.T, intercept, classifier.classes_, feature_names)
+
+    def _as_columns(self, X):
+        # Feature-major float32 copy, filled column by column so a
+        # mixed-dtype DataFrame is never converted as a whole
+        if isinstance(X, pd.DataFrame):
+            columns = np.empty((len(self.feature_names), len(X)), dtype=np.float32)
+            for i, name in enumerate(self.feature_names):
+                columns[i] = X[name].to_numpy()
+            return columns
+        return np.ascontiguousarray(np.asarray(X, dtype=np.float32).T)
+
+    def predict(self, X):
+        """
+        Predicts the class of every row.
+
+        Args:
+            X (pd.DataFrame or np.ndarray): Rows with the model features,
+                in `feature_names` order if an array.
+
+        Returns:
+            np.ndarray: The predicted class per row.
+        """
+        columns = self._as_columns(X)
+        # One contiguous row of scores per class, so the argmax below is a
+        # few elementwise passes instead of a reduction over short rows
+        scores = self._weights32.T @ columns
+        scores += self._bias32[:, None]
+
+        n = columns.shape[1]
+        best = np.zeros(n, dtype=np.intp)
+        top = scores[0].copy()
+        second = np.full(n, -np.inf, dtype=np.float32)
+        for k in range(1, len(scores)):
+            better = scores[k] > top
+            second = np.where(better, top, np.maximum(second, scores[k]))
+            top = np.where(better, scores[k], top)
+            best[better] = k
+
+        # Recheck near ties, and rows too large for float32, at full precision
+        unsure = ~(top - second > MARGIN_TOLERANCE * np.maximum(1.0, np.abs(top)))
+        if unsure.any():
+            if isinstance(X, pd.DataFrame):
+                rows = X[self.feature_names][unsure].to_numpy(dtype=np.float64)
+            else:
+                rows = np.asarray(X)[unsure].astype(np.float64)
+            best[unsure] = (rows @ self.weights + self.bias).argmax(axis=1)
+        return self.classes[best]
+
+    def predict_one(self, features):
+        """
+        Predicts the class of a single row.
+
+        Args:
+            features (sequence): The feature values in `feature_names` order.
+
+        Returns:
+            The predicted class.
+        """
+        scores = np.asarray(features, dtype=np.float64) @ self.weights + self.bias
+        return self.classes[int(scores.argmax())]
+
+
+def load_scorer(path=MODEL_PATH):
+    """
+    Loads a model file and extracts its scorer.
+
+    Args:
+        path (str): The joblib model file.
+
+    Returns:
+        LinearScorer: The scorer.
+    """
+    return LinearScorer.from_model(joblib.load(path))
+
+
+def check_parity(model, scorer, X):
+    """
+    Compares the scorer with `model.predict` row by row.
+
+    Args:
+        model: The fitted model.
+        scorer (LinearScorer): The scorer extracted from it.
+        X (pd.DataFrame): Rows to score.
+
+    Returns:
+        int: The number of rows where the predictions differ.
+    """
+    expected = model.predict(X)
+    mismatches = int((scorer.predict(X) != expected).sum())
+    row = X.iloc[0].tolist()
+    mismatches += int(scorer.predict_one(row) != expected[0])
+    return mismatches
+
+
+def benchmark(model, scorer, X, repeat=5):
+    """
+    Times batch and single-row scoring against sklearn.
+
+    Args:
+        model: The fitted model.
+        scorer (LinearScorer): The scorer extracted from it.
+        X (pd.DataFrame): Rows to score.
+        repeat (int): Timing repetitions, the best is kept.
+
+    Returns:
+        dict: Seconds per batch and per single row for both paths.
+    """
+    row = X.iloc[[0]]
+    values = row.iloc[0].tolist()
+    single = 200
+
+    def best(stmt, number=1):
+        return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+    return {
+        "sklearn_batch": best(lambda: model.predict(X)),
+        "scorer_batch": best(lambda: scorer.predict(X)),
+        "sklearn_row": best(lambda: model.predict(row), single),
+        "scorer_row": best(lambda: scorer.predict_one(values), single),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the fast risk model scorer.")
+    parser.add_argument("--data", default=MODEL_DATA_PATH)
+    parser.add_argument("--model", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    model = joblib.load(args.model)
+    start = time.perf_counter()
+    scorer = LinearScorer.from_model(model)
+    logger.info(f"Extracted scorer in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    df = load_model_data(args.data)
+    _, X = build_features(df)
+    X = pd.concat([X, df[FEATURES]], ignore_index=True)
+
+    mismatches = check_parity(model, scorer, X)
+    print(f"Parity: {len(X) - mismatches}/{len(X)} rows identical to predict")
+
+    result = benchmark(model, scorer, X)
+    print(f"Batch of {len(X)}: sklearn {result['sklearn_batch'] * 1000:.2f} ms, "
+          f"scorer {result['scorer_batch'] * 1000:.2f} ms")
+    print(f"Single row: sklearn {result['sklearn_row'] * 1e6:.1f} us, scorer {result['scorer_row'] * 1e6:.1f} us")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
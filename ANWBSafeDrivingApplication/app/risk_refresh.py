@@ -0,0 +1,221 @@
+"""
+Scheduled refresh of the published risk table.
+
+A sidecar process checks once a day, ahead of midnight, whether the model
+data or the model changed since the active snapshot was computed, and if so
+recomputes the risk table and publishes it as a new immutable snapshot (see
+`RiskTable.publish`). An unchanged input is not republished, as every new
+version empties the caches keyed on it: cached routes, edge risk and
+heatmap tiles. Every app process runs a `SnapshotWatcher` that notices the new ACTIVE
+pointer, loads the snapshot in a background thread and hands it to the
+routing engine, which swaps it in with a single reference assignment.
+Requests never wait for the model and never see a half-written table.
+
+Usage:
+    python risk_refresh.py              # check every day at 23:00
+    python risk_refresh.py --once       # check once and exit
+    python risk_refresh.py --once --force   # publish even if nothing changed
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import joblib
+
+from model_data import MODEL_DATA_PATH, columnar_path, load_model_data
+from risk_table import (
+    MODEL_PATH, RISK_SNAPSHOT_DIR, RiskTable, active_snapshot, input_fingerprint, snapshot_fingerprint,
+)
+
+logger = logging.getLogger(__name__)
+
+# Local time the inputs are checked for a new table, early enough to be live at midnight
+REFRESH_AT = "23:00"
+
+# Seconds between checks of the ACTIVE pointer in app processes
+WATCH_INTERVAL = 30
+
+# Published snapshots kept on disk besides the active one
+KEEP_SNAPSHOTS = 3
+
+
+class SnapshotWatcher:
+    """
+    Background thread that loads newly published risk tables.
+
+    Attributes:
+        snapshot_dir (str): The snapshot directory.
+        on_change (callable): Called with each newly loaded RiskTable.
+        interval (float): Seconds between checks.
+        active (str): Path of the snapshot last handed to `on_change`.
+    """
+
+    def __init__(self, on_change, snapshot_dir=RISK_SNAPSHOT_DIR, interval=WATCH_INTERVAL, active=None):
+        self.on_change = on_change
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.active = active
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Loads the active snapshot if it changed since the last check.
+
+        Returns:
+            bool: Whether a new table was handed over.
+        """
+        path = active_snapshot(self.snapshot_dir)
+        if path is None or path == self.active:
+            return False
+        try:
+            table = RiskTable.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Could not load risk snapshot {path}: {e}")
+            return False
+        self.on_change(table)
+        self.active = path
+        logger.info(f"Switched to risk snapshot {table.version}")
+        return True
+
+    def start(self):
+        """
+        Starts polling in a daemon thread.
+
+        Returns:
+            SnapshotWatcher: The watcher.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="risk-snapshot-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Risk snapshot check failed")
+
+
+def refresh(data_path=MODEL_DATA_PATH, model_path=MODEL_PATH, snapshot_dir=RISK_SNAPSHOT_DIR, keep=KEEP_SNAPSHOTS,
+            force=False):
+    """
+    Computes and publishes a new risk table if its inputs changed, then
+    prunes old snapshots.
+
+    Args:
+        data_path (str): The model data CSV; its Feather copy is used if the
+            CSV is gone.
+        model_path (str): The joblib model file.
+        snapshot_dir (str): The snapshot directory.
+        keep (int): Older snapshots to keep besides the new one.
+        force (bool): Whether to publish even if the inputs are unchanged.
+
+    Returns:
+        str: The published snapshot path, or None if the active snapshot was
+        computed from the same model data and model.
+    """
+    start = time.perf_counter()
+    source = data_path if os.path.exists(data_path) else columnar_path(data_path)
+    fingerprint = input_fingerprint(source, model_path)
+    active = active_snapshot(snapshot_dir)
+    if not force and active is not None and os.path.exists(active) and snapshot_fingerprint(active) == fingerprint:
+        logger.info(f"Model data and model unchanged since {os.path.basename(active)}, nothing to publish")
+        return None
+
+    table = RiskTable.compute(load_model_data(data_path), joblib.load(model_path), fingerprint)
+    path = table.publish(snapshot_dir)
+    logger.info(f"Published risk snapshot {table.version} in {time.perf_counter() - start:.2f}s")
+    prune(snapshot_dir, keep)
+    return path
+
+
+def prune(snapshot_dir=RISK_SNAPSHOT_DIR, keep=KEEP_SNAPSHOTS):
+    """
+    Deletes all but the newest snapshots, never the active one.
+
+    Apps hold loaded tables in memory, so deleting a file they were loaded
+    from is safe.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+        keep (int): Snapshots to keep besides the active one.
+    """
+    active = active_snapshot(snapshot_dir)
+    snapshots = sorted(
+        os.path.join(snapshot_dir, name)
+        for name in os.listdir(snapshot_dir)
+        if name.startswith("risk_table_") and name.endswith(".npz")
+    )
+    stale = [path for path in snapshots if path != active]
+    for path in stale[:max(0, len(stale) - keep)]:
+        os.remove(path)
+
+
+def seconds_until(at, now=None):
+    """
+    Returns the seconds until the next occurrence of a local time.
+
+    Args:
+        at (str): The time as 'HH:MM'.
+        now (datetime): The current time, now by default.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def run_scheduler(at=REFRESH_AT, **kwargs):
+    """
+    Publishes a new risk table at a fixed local time on every day its
+    inputs changed.
+
+    A failed refresh is logged and retried the next day; the active
+    snapshot stays in place meanwhile.
+
+    Args:
+        at (str): The time as 'HH:MM'.
+        **kwargs: Passed to `refresh`.
+    """
+    while True:
+        wait = seconds_until(at)
+        logger.info(f"Next risk refresh in {wait / 3600:.1f}h")
+        time.sleep(wait)
+        try:
+            refresh(**kwargs)
+        except Exception:
+            logger.exception("Risk refresh failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the risk table on a daily schedule when its inputs change.")
+    parser.add_argument("--data", default=MODEL_DATA_PATH)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--at", default=REFRESH_AT, help="Local time to publish at, HH:MM")
+    parser.add_argument("--once", action="store_true", help="Check once and exit")
+    parser.add_argument("--force", action="store_true", help="Publish even if the model data and model are unchanged")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.once:
+        refresh(args.data, args.model, force=args.force)
+    else:
+        run_scheduler(args.at, data_path=args.data, model_path=args.model, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
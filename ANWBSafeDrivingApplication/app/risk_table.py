@@ -0,0 +1,402 @@
+"""
+Full-year risk table computed offline in one model pass.
+
+Every road in `model_data.csv` is scored for all 366 (month, day)
+combinations with a single `predict` call. The result is stored as an int8
+array indexed by [day of year, road], so the app only has to slice one row
+per day and never runs the model inside a request.
+
+Usage:
+    python risk_table.py --data model_data.csv --model log_model.joblib
+    python risk_table.py --publish    # write a new active snapshot for running apps
+"""
+import argparse
+import hashlib
+import logging
+import os
+import time
+from datetime import date, datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from model_data import MODEL_DATA_PATH, load_model_data
+from risk_index import DEFAULT_RISK, RISK_COLORS, RiskIndex
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(APP_DIR, "log_model.joblib")
+RISK_TABLE_PATH = os.path.join(APP_DIR, "risk_table.npz")
+
+# Published tables are immutable files in this directory; ACTIVE names the live one
+RISK_SNAPSHOT_DIR = os.path.join(APP_DIR, "risk_snapshots")
+ACTIVE_POINTER = "ACTIVE"
+
+# Columns used to train log_model.joblib, in training order
+FEATURES = ['month', 'day', 'most_common_condition', 'avg_yearly_accidents', 'average_monthly_occurrences']
+
+# LabelEncoder codes of the weather conditions in the training notebook
+WEATHER_CONDITIONS = {0: "Rainy", 1: "Sunny", 2: "Undefined", 3: "Windy"}
+
+# Leap year used to map (month, day) to a day of year, so 29 February has a row
+LEAP_YEAR = 2024
+DAYS_IN_YEAR = 366
+
+
+def day_of_year(month, day):
+    """
+    Returns the row of a (month, day) pair in the risk table.
+
+    Args:
+        month (int): The month.
+        day (int): The day of the month.
+
+    Returns:
+        int: The zero-based day of year in a leap year.
+    """
+    return date(LEAP_YEAR, month, day).timetuple().tm_yday - 1
+
+
+def calendar_days():
+    """
+    Returns all (month, day) pairs of a leap year in table order.
+
+    Returns:
+        tuple: The month and day arrays.
+    """
+    days = pd.date_range(f"{LEAP_YEAR}-01-01", f"{LEAP_YEAR}-12-31", freq="D")
+    return days.month.to_numpy(), days.day.to_numpy()
+
+
+def build_features(df):
+    """
+    Builds the model input for every road on every day of the year.
+
+    The yearly and monthly accident averages are per road, and the most
+    common weather condition is per date, so a (road, date) pair without a
+    row in the data can still be scored. Dates without any row use the
+    most common condition of the whole year.
+
+    Args:
+        df (pd.DataFrame): The model data.
+
+    Returns:
+        tuple: The road names and a DataFrame with one row per (day, road),
+        ordered day by day.
+    """
+    roads = df.groupby("road_name", sort=True, observed=True)[['avg_yearly_accidents', 'average_monthly_occurrences']].first()
+    conditions = df.groupby(['month', 'day'])['most_common_condition'].agg(lambda x: x.mode().iloc[0])
+    default_condition = df['most_common_condition'].mode().iloc[0]
+
+    months, days = calendar_days()
+    day_conditions = conditions.reindex(pd.MultiIndex.from_arrays([months, days])).fillna(default_condition)
+
+    n_roads = len(roads)
+    features = pd.DataFrame({
+        'month': np.repeat(months, n_roads),
+        'day': np.repeat(days, n_roads),
+        'most_common_condition': np.repeat(day_conditions.to_numpy(), n_roads).astype(df['most_common_condition'].dtype),
+        'avg_yearly_accidents': np.tile(roads['avg_yearly_accidents'].to_numpy(), DAYS_IN_YEAR),
+        'average_monthly_occurrences': np.tile(roads['average_monthly_occurrences'].to_numpy(), DAYS_IN_YEAR),
+    })
+    return roads.index.to_numpy(), features[FEATURES]
+
+
+def build_condition_features(df, conditions):
+    """
+    Builds the model input for every road, day and weather condition.
+
+    Args:
+        df (pd.DataFrame): The model data.
+        conditions (np.ndarray): The condition codes to score.
+
+    Returns:
+        pd.DataFrame: One row per (day, condition, road), ordered by day,
+        then condition, then road.
+    """
+    roads = df.groupby("road_name", sort=True, observed=True)[['avg_yearly_accidents', 'average_monthly_occurrences']].first()
+    months, days = calendar_days()
+
+    n_roads, n_conditions = len(roads), len(conditions)
+    per_day = n_conditions * n_roads
+    features = pd.DataFrame({
+        'month': np.repeat(months, per_day),
+        'day': np.repeat(days, per_day),
+        'most_common_condition': np.tile(np.repeat(conditions, n_roads), DAYS_IN_YEAR).astype(df['most_common_condition'].dtype),
+        'avg_yearly_accidents': np.tile(roads['avg_yearly_accidents'].to_numpy(), DAYS_IN_YEAR * n_conditions),
+        'average_monthly_occurrences': np.tile(roads['average_monthly_occurrences'].to_numpy(), DAYS_IN_YEAR * n_conditions),
+    })
+    return features[FEATURES]
+
+
+def to_risk_levels(predictions):
+    """
+    Converts model output to int8 risk levels.
+
+    Args:
+        predictions (np.ndarray): The predicted classes.
+
+    Returns:
+        np.ndarray: The risk levels, unknown classes mapped to the default.
+    """
+    levels = pd.to_numeric(pd.Series(predictions), errors="coerce").to_numpy()
+    known = np.isin(levels, list(RISK_COLORS))
+    return np.where(known, levels, DEFAULT_RISK).astype(np.int8)
+
+
+def input_fingerprint(*paths):
+    """
+    Hashes the files a risk table is computed from.
+
+    Args:
+        *paths (str): The model data and model files.
+
+    Returns:
+        str: The hex SHA-256 digest of their contents, in order.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class RiskTable:
+    """
+    Predicted risk level per road for every day of the year.
+
+    Besides the risk under each date's historically most common weather,
+    the table can hold the risk under every weather condition seen in the
+    data, so routes can be planned for the actual weather.
+
+    Attributes:
+        road_names (np.ndarray): The road names, one per column.
+        risk (np.ndarray): int8 risk levels of shape (366, number of roads).
+        version (str): Identifies the run that produced the table.
+        conditions (np.ndarray): Weather condition codes, or None.
+        condition_risk (np.ndarray): int8 risk levels of shape
+            (366, number of conditions, number of roads), or None.
+        fingerprint (str): The `input_fingerprint` of the model data and
+            model the table was computed from, or None if unknown.
+    """
+
+    def __init__(self, road_names, risk, version, conditions=None, condition_risk=None, fingerprint=None):
+        self.road_names = road_names
+        self.risk = risk
+        self.version = version
+        self.conditions = conditions
+        self.condition_risk = condition_risk
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def compute(cls, df, model, fingerprint=None):
+        """
+        Scores all roads for all days with a single predict call.
+
+        Each date is scored under its most common weather and under every
+        weather condition in the data. Linear models are scored through `LinearScorer`, which gives the
+        same classes as `model.predict` without sklearn's overhead.
+
+        Args:
+            df (pd.DataFrame): The model data.
+            model: The fitted risk model.
+            fingerprint (str): The `input_fingerprint` of both, if known.
+
+        Returns:
+            RiskTable: The table.
+        """
+        from risk_model import LinearScorer
+
+        road_names, X = build_features(df)
+        conditions = np.sort(df['most_common_condition'].unique()).astype(np.int8)
+        X_conditions = build_condition_features(df, conditions)
+        try:
+            predict = LinearScorer.from_model(model).predict
+        except TypeError:
+            predict = model.predict
+        levels = to_risk_levels(predict(pd.concat([X, X_conditions], ignore_index=True)))
+
+        n_roads = len(road_names)
+        risk = levels[:len(X)].reshape(DAYS_IN_YEAR, n_roads)
+        condition_risk = levels[len(X):].reshape(DAYS_IN_YEAR, len(conditions), n_roads)
+        version = datetime.now().strftime("%Y%m%dT%H%M%S")
+        return cls(road_names, risk, version, conditions, condition_risk, fingerprint)
+
+    @classmethod
+    def load(cls, path=RISK_TABLE_PATH):
+        """
+        Reads a table written by `save`.
+
+        Args:
+            path (str): The table file path.
+
+        Returns:
+            RiskTable: The table.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            # Tables written before weather conditions were added have none
+            conditions = data["conditions"] if "conditions" in data else None
+            condition_risk = data["condition_risk"] if "condition_risk" in data else None
+            fingerprint = str(data["fingerprint"]) if "fingerprint" in data else None
+            return cls(data["road_names"], data["risk"], str(data["version"]), conditions, condition_risk, fingerprint)
+
+    def save(self, path=RISK_TABLE_PATH):
+        """
+        Writes the table to disk, replacing any previous file atomically.
+
+        Args:
+            path (str): The table file path.
+        """
+        tmp_path = f"{path}.tmp.npz"
+        arrays = {"road_names": self.road_names.astype(str), "risk": self.risk, "version": np.array(self.version)}
+        if self.condition_risk is not None:
+            arrays.update(conditions=self.conditions, condition_risk=self.condition_risk)
+        if self.fingerprint is not None:
+            arrays.update(fingerprint=np.array(self.fingerprint))
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def for_day(self, month, day):
+        """
+        Returns the risk levels of all roads on a date.
+
+        Args:
+            month (int): The month.
+            day (int): The day of the month.
+
+        Returns:
+            np.ndarray: The int8 risk level per road, in `road_names` order.
+        """
+        return self.risk[day_of_year(month, day)]
+
+    def index_for(self, month, day):
+        """
+        Builds the road risk lookup for a date.
+
+        Args:
+            month (int): The month.
+            day (int): The day of the month.
+
+        Returns:
+            RiskIndex: The risk index for that date.
+        """
+        road_risk = dict(zip(self.road_names.tolist(), self.for_day(month, day).tolist()))
+        return RiskIndex(road_risk, version=f"{self.version}:{month:02d}-{day:02d}")
+
+    def publish(self, snapshot_dir=RISK_SNAPSHOT_DIR):
+        """
+        Writes the table as a new immutable snapshot and makes it the active one.
+
+        The snapshot file is complete before the ACTIVE pointer is replaced,
+        and both writes are atomic renames, so readers see either the old
+        or the new table and never a partial one.
+
+        Args:
+            snapshot_dir (str): The snapshot directory.
+
+        Returns:
+            str: The snapshot file path.
+
+        Raises:
+            FileExistsError: If a snapshot of this version was already published.
+        """
+        os.makedirs(snapshot_dir, exist_ok=True)
+        filename = f"risk_table_{self.version}.npz"
+        path = os.path.join(snapshot_dir, filename)
+        if os.path.exists(path):
+            raise FileExistsError(f"Risk snapshot {path} already exists")
+        self.save(path)
+
+        pointer = os.path.join(snapshot_dir, ACTIVE_POINTER)
+        with open(f"{pointer}.tmp", "w") as f:
+            f.write(filename)
+        os.replace(f"{pointer}.tmp", pointer)
+        return path
+
+
+def active_snapshot(snapshot_dir=RISK_SNAPSHOT_DIR):
+    """
+    Returns the path of the active published snapshot.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+
+    Returns:
+        str: The snapshot file path, or None if nothing is published.
+    """
+    try:
+        with open(os.path.join(snapshot_dir, ACTIVE_POINTER)) as f:
+            filename = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(snapshot_dir, filename) if filename else None
+
+
+def snapshot_fingerprint(path):
+    """
+    Reads the input fingerprint of a saved table without loading its risk.
+
+    Args:
+        path (str): The table file path.
+
+    Returns:
+        str: The fingerprint, or None if the table has none.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return str(data["fingerprint"]) if "fingerprint" in data else None
+
+
+def load_active(snapshot_dir=RISK_SNAPSHOT_DIR, fallback_path=RISK_TABLE_PATH):
+    """
+    Loads the active published table, or the standalone table file.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+        fallback_path (str): The table file used when nothing is published.
+
+    Returns:
+        RiskTable: The table, or None if there is neither.
+    """
+    path = active_snapshot(snapshot_dir)
+    if path is None:
+        path = fallback_path
+    if not os.path.exists(path):
+        return None
+    return RiskTable.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the full-year risk table.")
+    parser.add_argument("--data", default=MODEL_DATA_PATH)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--out", default=RISK_TABLE_PATH)
+    parser.add_argument("--publish", action="store_true", help="Publish as a new active snapshot instead of --out")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    df = load_model_data(args.data)
+    model = joblib.load(args.model)
+    fingerprint = input_fingerprint(args.data, args.model) if os.path.exists(args.data) else None
+
+    start = time.perf_counter()
+    table = RiskTable.compute(df, model, fingerprint)
+    elapsed = time.perf_counter() - start
+    if args.publish:
+        out = table.publish()
+    else:
+        out = args.out
+        table.save(out)
+
+    logger.info(
+        f"Scored {table.risk.size} (day, road) pairs for {len(table.road_names)} roads "
+        f"in {elapsed:.2f}s, wrote {out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
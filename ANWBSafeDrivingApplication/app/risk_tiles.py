@@ -0,0 +1,483 @@
+"""
+Heatmap tiles of today's risk on every road.
+
+Drawing every edge of the network as a folium line is far too heavy for a
+browser, so the risk of all roads is rasterised into standard 256-pixel
+Web Mercator tiles instead, one PNG per zoom level, column and row, and
+shown as a Leaflet tile layer. However large the network, the map only ever
+loads the dozen or so tiles in view.
+
+Tiles are stored on disk under the version of the risk they show, the risk
+table version plus the date, e.g.
+`risk_tiles/20240301T230000-03-02/14/8413/5484.png`. A tile is rendered the
+first time it is asked for and read from disk after that; `build` renders
+every tile of today's risk ahead of time. When a new risk table is published
+or the date changes, tiles are requested under the new version and the old
+directories are pruned, so a stale tile is never served. A map that still
+asks for an older version gets the tiles it has on disk, or is redirected
+to today's tiles once they are gone.
+
+A tiled region is drawn from the regional graph around each tile, so its
+tiles start at TILED_MIN_ZOOM instead of MIN_ZOOM.
+
+Usage:
+    python risk_tiles.py build                    # render today's tiles
+    python risk_tiles.py build --zooms 12 13 14
+"""
+import argparse
+import io
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import weakref
+from functools import lru_cache
+
+import numpy as np
+
+from graph_tiles import tile_bounds
+from metrics import span
+from risk_index import risk_color
+from route_engine import TiledRouteEngine, load_engine
+from route_render import edge_coords
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+RISK_TILE_DIR = os.path.join(APP_DIR, "risk_tiles")
+
+# Width and height of a map tile in pixels
+TILE_PIXELS = 256
+
+# Zoom levels tiles are rendered for; the map scales the last one up beyond it
+MIN_ZOOM = 11
+MAX_ZOOM = 16
+
+# First zoom level of a tiled region, whose tiles each load a regional graph
+TILED_MIN_ZOOM = 13
+
+# Road line width in pixels per zoom level
+LINE_WIDTHS = {11: 1, 12: 1, 13: 2, 14: 2, 15: 3, 16: 4}
+
+# Opacity of the road lines, out of 255
+LINE_ALPHA = 200
+
+# Risk versions kept on disk
+KEEP_VERSIONS = 3
+
+# Characters allowed in a tile version, which names a directory
+VERSION_PATTERN = re.compile(r"[\w-]+")
+
+
+def tile_version(risk_version):
+    """
+    Returns the directory name of the tiles of a risk version.
+
+    Args:
+        risk_version (str): The version of a RiskIndex, e.g. '20240301T230000:03-02'.
+
+    Returns:
+        str: The version with anything but letters, digits and '-' replaced by '-'.
+    """
+    return re.sub(r"[^\w-]", "-", risk_version)
+
+
+def mercator(lat, lon):
+    """
+    Projects coordinates onto the Web Mercator square.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        lon (np.ndarray): Longitudes in degrees.
+
+    Returns:
+        tuple: x and y between 0 and 1, y growing southwards; multiplied by
+        TILE_PIXELS * 2 ** zoom they are pixels of that zoom level.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0
+    return x, y
+
+
+def tile_bbox(zoom, x, y):
+    """
+    Returns the coordinates covered by a map tile.
+
+    Args:
+        zoom (int): The zoom level.
+        x (int): The tile column.
+        y (int): The tile row.
+
+    Returns:
+        tuple: (south, west, north, east) in degrees.
+    """
+    n = 2 ** zoom
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tile_range(bounds, zoom):
+    """
+    Returns the map tiles covering a bounding box.
+
+    Args:
+        bounds (tuple): (south, west, north, east) in degrees.
+        zoom (int): The zoom level.
+
+    Returns:
+        tuple: The first and last column and the first and last row.
+    """
+    south, west, north, east = bounds
+    (x0, x1), (y0, y1) = mercator([north, south], [west, east])
+    scale = 2 ** zoom
+    return int(x0 * scale), int(x1 * scale), int(y0 * scale), int(y1 * scale)
+
+
+@lru_cache(maxsize=1)
+def empty_tile():
+    """
+    Returns a transparent tile, for areas without roads.
+
+    Returns:
+        bytes: The PNG.
+    """
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGBA", (TILE_PIXELS, TILE_PIXELS), (0, 0, 0, 0)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class EdgeLines:
+    """
+    The points of every edge of a graph in Web Mercator, grouped by map tile.
+
+    Attributes:
+        offsets (np.ndarray): Start of each edge position's points, plus the end.
+        x (np.ndarray): Mercator x of the points.
+        y (np.ndarray): Mercator y of the points.
+    """
+
+    def __init__(self, G, csr_graph):
+        lats, lons, counts = [], [], []
+        for position in range(csr_graph.num_edges):
+            coords = edge_coords(G, *csr_graph.edge_id(position))
+            lats.extend(lat for lat, _ in coords)
+            lons.extend(lon for _, lon in coords)
+            counts.append(len(coords))
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.x, self.y = mercator(lats, lons)
+        starts = self.offsets[:-1]
+        self._x_range = (np.minimum.reduceat(self.x, starts), np.maximum.reduceat(self.x, starts))
+        self._y_range = (np.minimum.reduceat(self.y, starts), np.maximum.reduceat(self.y, starts))
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def edges_in(self, zoom, x, y):
+        """
+        Returns the edges drawn on a map tile.
+
+        Args:
+            zoom (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            np.ndarray: The edge positions, empty if no road crosses the tile.
+        """
+        index = self._index.get(zoom)
+        if index is None:
+            with self._lock:
+                index = self._index.get(zoom)
+                if index is None:
+                    index = self._index[zoom] = self._build_index(zoom)
+        return index.get((x, y), np.empty(0, dtype=np.int64))
+
+    def _build_index(self, zoom):
+        # Pad each edge's box by half a line, so lines ending near a tile
+        # border are drawn on both sides of it
+        scale = 2 ** zoom
+        pad = LINE_WIDTHS[zoom] / 2 / TILE_PIXELS
+        x0 = np.floor(self._x_range[0] * scale - pad).astype(np.int64)
+        x1 = np.floor(self._x_range[1] * scale + pad).astype(np.int64)
+        y0 = np.floor(self._y_range[0] * scale - pad).astype(np.int64)
+        y1 = np.floor(self._y_range[1] * scale + pad).astype(np.int64)
+
+        # One (tile, edge) pair per tile an edge's box overlaps
+        columns = x1 - x0 + 1
+        counts = columns * (y1 - y0 + 1)
+        edges = np.repeat(np.arange(len(counts)), counts)
+        step = np.arange(len(edges)) - np.repeat(np.cumsum(counts) - counts, counts)
+        tx = x0[edges] + step % columns[edges]
+        ty = y0[edges] + step // columns[edges]
+
+        order = np.lexsort((edges, ty, tx))
+        tx, ty, edges = tx[order], ty[order], edges[order]
+        starts = np.flatnonzero(np.r_[True, (tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])])
+        ends = np.r_[starts[1:], len(edges)]
+        return {
+            (int(tx[start]), int(ty[start])): edges[start:end]
+            for start, end in zip(starts.tolist(), ends.tolist())
+        }
+
+
+def render_tile(lines, edge_risk, zoom, x, y):
+    """
+    Draws the risk of the roads crossing a map tile.
+
+    Args:
+        lines (EdgeLines): The edge points of the graph.
+        edge_risk (np.ndarray): Risk level per edge position.
+        zoom (int): The zoom level.
+        x (int): The tile column.
+        y (int): The tile row.
+
+    Returns:
+        bytes: The PNG, transparent where there are no roads.
+    """
+    edges = lines.edges_in(zoom, x, y)
+    if len(edges) == 0:
+        return empty_tile()
+
+    from PIL import Image, ImageColor, ImageDraw
+
+    image = Image.new("RGBA", (TILE_PIXELS, TILE_PIXELS), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    width = LINE_WIDTHS[zoom]
+    scale = TILE_PIXELS * 2 ** zoom
+    levels = edge_risk[edges]
+    colors = {int(level): ImageColor.getrgb(risk_color(int(level))) + (LINE_ALPHA,) for level in np.unique(levels)}
+    # Riskier roads are drawn last, so they stay visible where roads overlap
+    order = np.argsort(levels, kind="stable")
+    for edge, level in zip(edges[order].tolist(), levels[order].tolist()):
+        start, end = lines.offsets[edge], lines.offsets[edge + 1]
+        px = lines.x[start:end] * scale - x * TILE_PIXELS
+        py = lines.y[start:end] * scale - y * TILE_PIXELS
+        draw.line(np.column_stack((px, py)).ravel().tolist(), fill=colors[level], width=width, joint="curve")
+
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def prune(directory=RISK_TILE_DIR, keep=KEEP_VERSIONS):
+    """
+    Deletes the tiles of all but the most recently written risk versions.
+
+    Args:
+        directory (str): The tile directory.
+        keep (int): Versions to keep.
+    """
+    if not os.path.isdir(directory):
+        return
+    versions = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_dir()),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in versions[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        logger.info(f"Removed risk tiles {entry.name}")
+
+
+class RiskTileCache:
+    """
+    Renders the risk tiles of an engine on demand and keeps them on disk.
+
+    Attributes:
+        engine (RouteEngine or TiledRouteEngine): The engine whose graph and
+            risk are drawn.
+        directory (str): The tile directory, one subdirectory per version.
+        min_zoom (int): The first zoom level with tiles.
+        max_zoom (int): The last zoom level with tiles.
+    """
+
+    def __init__(self, engine, directory=RISK_TILE_DIR):
+        self.engine = engine
+        self.directory = directory
+        self.tiled = isinstance(engine, TiledRouteEngine)
+        self.min_zoom = TILED_MIN_ZOOM if self.tiled else MIN_ZOOM
+        self.max_zoom = MAX_ZOOM
+        # Edge points per graph, dropped with the regional engine they belong to
+        self._lines = weakref.WeakKeyDictionary()
+        self._bounds = None
+        self._lock = threading.Lock()
+
+    def bounds(self):
+        """
+        Returns the area covered by the graph.
+
+        Returns:
+            tuple: (south, west, north, east) in degrees.
+        """
+        if self._bounds is None:
+            if self.tiled:
+                boxes = [self._tile_box(key) for key in self.engine.tile_store.tiles]
+                self._bounds = (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                                max(box[2] for box in boxes), max(box[3] for box in boxes))
+            else:
+                csr_graph = self.engine.csr_graph
+                self._bounds = (float(csr_graph.lat.min()), float(csr_graph.lon.min()),
+                                float(csr_graph.lat.max()), float(csr_graph.lon.max()))
+        return self._bounds
+
+    def _tile_box(self, key):
+        return tile_bounds(key, self.engine.tile_store.tile_size)
+
+    def version(self):
+        """
+        Returns the tile version of today's risk.
+
+        Returns:
+            str: The version, which changes with the risk table and the date.
+        """
+        # Every region derives its risk from the shared table, so no regional
+        # graph is loaded to name it
+        return tile_version(self.engine.today_risk_version())
+
+    def metadata(self):
+        """
+        Describes the tile layer of today's risk.
+
+        Returns:
+            dict: The version, the URL template of its tiles relative to the
+            backend, the zoom range and the bounds as [[south, west], [north, east]].
+        """
+        version = self.version()
+        south, west, north, east = self.bounds()
+        return {
+            "version": version,
+            "url": f"/risk-tiles/{version}/{{z}}/{{x}}/{{y}}.png",
+            "min_zoom": self.min_zoom,
+            "max_zoom": self.max_zoom,
+            "bounds": [[south, west], [north, east]],
+        }
+
+    def path(self, version, zoom, x, y):
+        return os.path.join(self.directory, version, str(zoom), str(x), f"{y}.png")
+
+    def _in_range(self, zoom, x, y):
+        if not self.min_zoom <= zoom <= self.max_zoom:
+            return False
+        x0, x1, y0, y1 = tile_range(self.bounds(), zoom)
+        return x0 <= x <= x1 and y0 <= y <= y1
+
+    def _lines_for(self, engine):
+        lines = self._lines.get(engine)
+        if lines is None:
+            with self._lock:
+                lines = self._lines.get(engine)
+                if lines is None:
+                    lines = self._lines[engine] = EdgeLines(engine.G, engine.csr_graph)
+        return lines
+
+    def tile(self, version, zoom, x, y):
+        """
+        Returns a tile from disk, rendering and storing it on a miss.
+
+        Only tiles of today's risk are rendered; older versions are served
+        for as long as they are on disk. A map that still asks for an older
+        version, e.g. after midnight or a new risk table, is meant to be sent
+        to the same tile of `version()`.
+
+        Args:
+            version (str): The tile version from the URL.
+            zoom (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            bytes: The PNG, or None if the version is neither on disk nor today's.
+        """
+        if not VERSION_PATTERN.fullmatch(version):
+            return None
+        if not self._in_range(zoom, x, y):
+            return empty_tile()
+        path = self.path(version, zoom, x, y)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+        if version != self.version():
+            return None
+        if self.tiled:
+            south, west, north, east = tile_bbox(zoom, x, y)
+            try:
+                engine = self.engine.engine_for((south, west), (north, east))
+            except ValueError:
+                return empty_tile()
+        else:
+            engine = self.engine
+        # The version is read from the risk itself, so a table swapped in
+        # meanwhile is never stored under the old version
+        risk_index, edge_risk = engine.today_risk()
+        if tile_version(risk_index.version) != version:
+            return None
+        lines = self._lines_for(engine)
+        with span("risk_tile"):
+            png = render_tile(lines, edge_risk, zoom, x, y)
+        self._store(version, path, png)
+        return png
+
+    def _store(self, version, path, png):
+        new_version = not os.path.isdir(os.path.join(self.directory, version))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+        if new_version:
+            prune(self.directory)
+
+    def build(self, zooms=None):
+        """
+        Renders every tile of today's risk that is not on disk yet.
+
+        Args:
+            zooms (list): The zoom levels, all from min_zoom to max_zoom by default.
+
+        Returns:
+            str: The version the tiles were written under.
+        """
+        version = self.version()
+        bounds = self.bounds()
+        for zoom in zooms or range(self.min_zoom, self.max_zoom + 1):
+            start = time.perf_counter()
+            x0, x1, y0, y1 = tile_range(bounds, zoom)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    if self.tile(version, zoom, x, y) is None:
+                        raise RuntimeError(f"Risk changed while rendering tiles of {version}")
+            logger.info(f"Zoom {zoom}: {(x1 - x0 + 1) * (y1 - y0 + 1)} tiles in {time.perf_counter() - start:.1f}s")
+        return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the risk heatmap tiles of today's risk.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--zooms", type=int, nargs="+", help="Zoom levels to render, all by default")
+    parser.add_argument("--out", default=RISK_TILE_DIR, help="Tile directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    engine = load_engine(download=False)
+    cache = RiskTileCache(engine, args.out)
+    zooms = [zoom for zoom in args.zooms or range(cache.min_zoom, cache.max_zoom + 1)
+             if cache.min_zoom <= zoom <= cache.max_zoom]
+    version = cache.build(zooms)
+    logger.info(f"Risk tiles of {version} are in {os.path.join(args.out, version)}")
+
+
+if __name__ == "__main__":
+    main()
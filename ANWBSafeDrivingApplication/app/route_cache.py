@@ -0,0 +1,181 @@
+"""
+Bounded cache of computed routes.
+
+Routes are keyed on (start node, end node, route mode, risk version), so
+differently written addresses that snap to the same nodes share an entry,
+and a new risk snapshot never serves a stale route. Only the compact
+RouteResult is stored, not the rendered map, and the least recently used
+entries are evicted once the cache holds more than `max_bytes`.
+
+When the risk changes, `carry_over` moves the routes the change cannot have
+altered to the new risk version, so only the others are computed again.
+"""
+import threading
+from collections import OrderedDict
+
+# Default memory budget of the route cache
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class RouteCache:
+    """
+    Thread-safe LRU cache bounded by the size of its entries.
+
+    Values must expose an `nbytes` attribute with their approximate size.
+
+    Attributes:
+        max_bytes (int): The memory budget.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that had to compute the route.
+        evictions (int): Entries dropped to stay within budget.
+        carried (int): Entries moved to a new risk version.
+        invalidated (int): Entries dropped because the risk changed.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.carried = 0
+        self.invalidated = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns a cached value and marks it as recently used.
+
+        Args:
+            key (tuple): The cache key.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting least recently used entries if needed.
+
+        Values larger than the whole budget are not stored.
+
+        Args:
+            key (tuple): The cache key.
+            value: The value to store.
+        """
+        size = value.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value or computes and stores it.
+
+        Args:
+            key (tuple): The cache key.
+            compute (callable): Called without arguments on a miss.
+
+        Returns:
+            The cached or computed value.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def carry_over(self, version, new_version, refresh):
+        """
+        Moves the entries computed with one risk version to another.
+
+        Keys hold the risk version fourth, after the start node, end node and
+        route mode. Entries already computed with the new version are kept.
+
+        Args:
+            version (str): The risk version the entries were computed with.
+            new_version (str): The risk version to store them under.
+            refresh (callable): Called with each (key, value); returns the
+                value valid under the new version, or None to drop the entry.
+
+        Returns:
+            tuple: The numbers of entries kept and dropped.
+        """
+        with self._lock:
+            entries = [(key, value) for key, value in self._entries.items() if key[3] == version]
+
+        kept = []
+        for key, value in entries:
+            new_value = refresh(key, value)
+            if new_value is not None:
+                kept.append((key[:3] + (new_version,) + key[4:], new_value))
+
+        with self._lock:
+            for key, value in entries:
+                if self._entries.get(key) is value:
+                    del self._entries[key]
+                    self._bytes -= value.nbytes
+            # Carried entries keep their order, as the most recently used
+            for key, value in kept:
+                if key not in self._entries:
+                    self._entries[key] = value
+                    self._bytes += value.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+            self.carried += len(kept)
+            self.invalidated += len(entries) - len(kept)
+        return len(kept), len(entries) - len(kept)
+
+    def clear(self):
+        """
+        Drops all entries and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.carried = self.invalidated = 0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Entries, bytes, budget, hits, misses, evictions, hit rate and
+            entries carried over or invalidated by risk changes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "carried": self.carried,
+                "invalidated": self.invalidated,
+            }
@@ -0,0 +1,790 @@
+"""
+Routing engine shared by the Streamlit app and the Flask backend.
+
+The engine bundles everything a route request needs: the road graph, its
+CSR copy, the nearest-node index, the local gazetteer, the risk table and
+the route cache. It is built once per process; the backend builds it before
+forking its workers so they share the same memory pages.
+
+A new risk table replaces the old one by swapping a single reference after
+today's risk has been derived from it, so concurrent requests use either
+the old or the new table and never wait for the switch. Cached routes are
+then carried over to the new risk unless an edge whose risk changed may
+alter them (see risk_diff.py), and the same happens when the date changes,
+so only the routes a change affects are computed again.
+
+Edges whose road name has no risk (unnamed roads, names missing from the
+data) take the risk level of the incidents spatially joined to them by
+accident_join.py, when that table exists.
+
+Regions too large for one graph are served by `TiledRouteEngine`, which
+stitches the tiles around each route into a regional RouteEngine and keeps
+the most recently used regions within a memory budget.
+
+Each stage of a request (geocoding, region loading, snapping, risk lookup,
+shortest path, alternatives and the response payload) is timed into the
+process histograms of metrics.py.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from accident_join import load_edge_history
+from alternatives import ALTERNATIVES, AlternativeSearch, RouteSet
+from edge_risk import EdgeRiskTensor
+from geocoder import PLACES_PATH, Gazetteer, load_places
+from graph_store import GRAPH_PLACE, load_graph
+from graph_tiles import TILE_MARGIN, RegionCache, TileStore, tile_dir
+from metrics import span
+from risk_diff import RiskDiff
+from risk_index import RISK_COLORS, RiskIndex
+from risk_refresh import WATCH_INTERVAL, SnapshotWatcher
+from risk_table import RISK_SNAPSHOT_DIR, RiskTable, active_snapshot, day_of_year, load_active
+from route_cache import RouteCache
+from route_render import ROUTE_ZOOM, route_geojson
+from routing import ROUTE_MODES, CSRGraph, RouteResult
+from spatial_index import NodeIndex
+
+logger = logging.getLogger(__name__)
+
+# Memory budget of the stitched regions a tiled engine keeps ready, on top
+# of the tiles themselves
+REGION_CACHE_BYTES = 512 * 1024 * 1024
+
+# In-memory size of a stitched graph with its CSR copy and node index per
+# edge, about 800 bytes measured with tracemalloc, rounded up for the
+# attributes of OSM roads
+ENGINE_BYTES_PER_EDGE = 1024
+
+
+def load_risk_table(risk_table_path=None):
+    """
+    Loads a risk table file or the active published snapshot.
+
+    Args:
+        risk_table_path (str): The risk table file, the active published
+            snapshot by default.
+
+    Returns:
+        RiskTable: The table, or None if there is none.
+    """
+    if risk_table_path is None:
+        risk_table = load_active()
+    elif os.path.exists(risk_table_path):
+        risk_table = RiskTable.load(risk_table_path)
+    else:
+        risk_table = None
+    if risk_table is None:
+        logger.warning("No risk table found, using historical risk levels")
+    return risk_table
+
+
+def load_engine(download=True, risk_table_path=None, risk_frame=None, fallback_geocoder=None):
+    """
+    Loads the tiled engine if the tiled region is built, the single graph otherwise.
+
+    Args:
+        download (bool): Whether to download the single graph if there is no snapshot.
+        risk_table_path (str): The risk table file, the active published
+            snapshot by default.
+        risk_frame (pd.DataFrame): Model data used when there is no table.
+        fallback_geocoder: Optional geopy geocoder asked on gazetteer misses.
+
+    Returns:
+        RouteEngine or TiledRouteEngine: The engine.
+    """
+    directory = tile_dir()
+    if TileStore.exists(directory):
+        return TiledRouteEngine(
+            TileStore(directory), load_risk_table(risk_table_path), risk_frame, fallback_geocoder
+        )
+    return RouteEngine.load(download, risk_table_path, risk_frame, fallback_geocoder)
+
+
+def day_risk_version(risk_table, risk_frame, month, day):
+    """
+    Returns the version of the RiskIndex a date's risk is derived with,
+    without deriving it.
+
+    Args:
+        risk_table (RiskTable): The precomputed risk table, or None.
+        risk_frame (pd.DataFrame): Model data used when there is no table.
+        month (int): The month.
+        day (int): The day of the month.
+
+    Returns:
+        str: The version, as set by `RiskTable.index_for` or `RiskIndex.from_frame`.
+    """
+    if risk_table is not None:
+        return f"{risk_table.version}:{month:02d}-{day:02d}"
+    if risk_frame is not None:
+        return f"{month:02d}-{day:02d}"
+    return RiskIndex({}).version
+
+
+def geocode(gazetteer, fallback_geocoder, address):
+    """
+    Geocodes an address from a gazetteer, asking the fallback geocoder when
+    it has no match or only the street of a house number.
+
+    Args:
+        gazetteer (Gazetteer): The local geocoding index.
+        fallback_geocoder: Optional geopy geocoder, or None.
+        address (str): The address.
+
+    Returns:
+        The Place or geopy Location, or None if nothing matches.
+
+    Raises:
+        geopy.exc.GeopyError: If the fallback geocoder fails on a gazetteer miss.
+    """
+    with span("geocode"):
+        location = gazetteer.lookup(address)
+        if fallback_geocoder is None or (location is not None and not location.approximate):
+            return location
+        if location is None:
+            return fallback_geocoder.geocode(address)
+
+        from geopy.exc import GeopyError
+
+        # The middle of the street is still an answer when the service is down
+        try:
+            return fallback_geocoder.geocode(address) or location
+        except GeopyError as e:
+            logger.warning(f"Fallback geocoding of a house number failed, using its street: {e}")
+            return location
+
+
+class RouteEngine:
+    """
+    Geocoding, snapping, risk lookup and routing over one road graph.
+
+    Attributes:
+        G (networkx.MultiDiGraph): The road graph.
+        csr_graph (CSRGraph): The array-backed routing graph.
+        node_index (NodeIndex): The nearest-node index.
+        gazetteer (Gazetteer): The local geocoding index.
+        risk_table (RiskTable): The precomputed risk table, or None.
+        edge_tensor (EdgeRiskTensor): Weather-conditioned edge risk from the
+            table, or None if the table has no conditions.
+        edge_history (np.ndarray): Spatially joined risk level per edge, or None.
+        risk_frame (pd.DataFrame): Model data used when there is no table.
+        route_cache (RouteCache): The cache of computed routes.
+        fallback_geocoder: Optional geopy geocoder asked on gazetteer misses.
+    """
+
+    def __init__(self, G, risk_table=None, risk_frame=None, route_cache=None, fallback_geocoder=None,
+                 gazetteer=None):
+        self.G = G
+        self.csr_graph = CSRGraph(G)
+        self.node_index = NodeIndex.from_csr(self.csr_graph)
+        self.gazetteer = gazetteer if gazetteer is not None else Gazetteer.from_graph(G, city=GRAPH_PLACE.split(",")[0])
+        self.risk_frame = risk_frame
+        self.edge_history = load_edge_history(self.csr_graph)
+        self.risk_table = risk_table
+        self.edge_tensor = self._edge_tensor(risk_table)
+        self._unmatched = self._unmatched_edges(risk_table)
+        self.route_cache = route_cache if route_cache is not None else RouteCache()
+        self.fallback_geocoder = fallback_geocoder
+        self.watcher = None
+        self._alternative_search = None
+        self._risk = {}
+        # Date today's risk was last asked for, per weather condition
+        self._today = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, download=True, risk_table_path=None, risk_frame=None, fallback_geocoder=None):
+        """
+        Loads the graph snapshot and risk table from disk.
+
+        Args:
+            download (bool): Whether to download the graph if there is no snapshot.
+            risk_table_path (str): The risk table file, the active published
+                snapshot by default.
+            risk_frame (pd.DataFrame): Model data used when there is no table.
+            fallback_geocoder: Optional geopy geocoder asked on gazetteer misses.
+
+        Returns:
+            RouteEngine: The engine.
+        """
+        return cls(
+            load_graph(download=download), load_risk_table(risk_table_path), risk_frame,
+            fallback_geocoder=fallback_geocoder,
+        )
+
+    def engine_for(self, start, end):
+        """
+        Returns the engine to route between two coordinates with.
+
+        Args:
+            start (tuple): The (lat, lon) of the start.
+            end (tuple): The (lat, lon) of the end.
+
+        Returns:
+            RouteEngine: This engine, whose graph covers every route.
+        """
+        return self
+
+    def risk_version(self):
+        """
+        Returns the version of the risk table routes are computed with.
+
+        Returns:
+            str: The version, or None if there is no risk table.
+        """
+        risk_table = self.risk_table
+        return risk_table.version if risk_table is not None else None
+
+    def today_risk_version(self):
+        """
+        Returns the version of today's risk, which changes with the risk table
+        and with the date, for caches of routes computed with it.
+
+        Returns:
+            str: The version of the RiskIndex `today_risk` returns.
+        """
+        today = datetime.now()
+        return day_risk_version(self.risk_table, self.risk_frame, today.month, today.day)
+
+    def stats(self):
+        """
+        Returns the route cache counters.
+
+        Returns:
+            dict: The counters of `RouteCache.stats`.
+        """
+        return self.route_cache.stats()
+
+    @property
+    def nbytes(self):
+        # Approximate memory of the graph, its indexes, the derived risk and the cached routes
+        num_edges = self.csr_graph.num_edges
+        edge_tensor = self.edge_tensor
+        return (
+            num_edges * ENGINE_BYTES_PER_EDGE
+            + (edge_tensor.nbytes if edge_tensor is not None else 0)
+            + len(self._risk) * num_edges
+            + self.route_cache.stats()["bytes"]
+        )
+
+    def set_risk_table(self, risk_table):
+        """
+        Replaces the risk table and drops the risk derived from the old one.
+
+        Today's risk is derived from the new table before the swap, so the
+        first request after it does not pay for the lookup. Cached routes of
+        today's old risk that the changed edges cannot alter are kept.
+
+        Args:
+            risk_table (RiskTable): The new risk table.
+        """
+        today = datetime.now()
+        edge_tensor = self._edge_tensor(risk_table)
+        unmatched = self._unmatched_edges(risk_table)
+        warm = self._derive_risk(risk_table, edge_tensor, unmatched, today.month, today.day)
+        with self._lock:
+            old_risk = self._risk
+            self.risk_table = risk_table
+            self.edge_tensor = edge_tensor
+            self._unmatched = unmatched
+            self._risk = {(today.month, today.day, None): warm}
+
+        for (month, day, condition), old in old_risk.items():
+            if (month, day) != (today.month, today.day):
+                continue
+            try:
+                new = warm if condition is None else self.risk_for(month, day, condition)
+            except KeyError:
+                # The new table lacks the condition; its routes age out of the cache
+                continue
+            self._carry_over(old, new)
+
+    def _carry_over(self, old, new):
+        # Moves the cached routes of one risk to another, dropping those the
+        # edges whose level changed may alter
+        old_index, old_risk = old
+        new_index, new_risk = new
+        if old_index.version == new_index.version:
+            return
+        with span("carry_over"):
+            diff = RiskDiff(self.csr_graph, old_risk, new_risk)
+            kept, dropped = self.route_cache.carry_over(
+                old_index.version, new_index.version, lambda key, value: diff.refresh(value, ROUTE_MODES[key[2]])
+            )
+        logger.info(f"Risk {old_index.version} -> {new_index.version}: {len(diff)} edges changed, "
+                    f"kept {kept} cached routes, dropped {dropped}")
+
+    def watch(self, snapshot_dir=RISK_SNAPSHOT_DIR, interval=WATCH_INTERVAL):
+        """
+        Starts following the published risk snapshots in the background.
+
+        Args:
+            snapshot_dir (str): The snapshot directory.
+            interval (float): Seconds between checks.
+
+        Returns:
+            SnapshotWatcher: The running watcher.
+        """
+        if self.watcher is None:
+            self.watcher = SnapshotWatcher(
+                self.set_risk_table, snapshot_dir, interval, active=active_snapshot(snapshot_dir)
+            ).start()
+        return self.watcher
+
+    def _edge_tensor(self, risk_table):
+        if risk_table is None or risk_table.condition_risk is None:
+            return None
+        return EdgeRiskTensor.from_table(self.csr_graph, risk_table)
+
+    def _unmatched_edges(self, risk_table):
+        # Edges none of whose names has a risk, filled from the spatial join
+        if self.edge_history is None:
+            return None
+        if risk_table is not None:
+            known = set(risk_table.road_names.tolist())
+        elif self.risk_frame is not None:
+            known = set(self.risk_frame["road_name"].astype(str))
+        else:
+            known = set()
+        names = self.csr_graph.road_names
+        return np.fromiter(
+            (not any(name in known for name in (road_name if isinstance(road_name, list) else [road_name]))
+             for road_name in names),
+            dtype=bool,
+            count=len(names),
+        )
+
+    def _derive_risk(self, risk_table, edge_tensor, unmatched, month, day, condition=None):
+        risk_index, edge_risk = self._name_risk(risk_table, edge_tensor, month, day, condition)
+        if unmatched is not None:
+            edge_risk = np.where(unmatched, self.edge_history, edge_risk).astype(np.int8)
+        return risk_index, edge_risk
+
+    def _name_risk(self, risk_table, edge_tensor, month, day, condition):
+        if condition is not None:
+            if edge_tensor is None:
+                raise KeyError(condition)
+            slot = edge_tensor.slot(condition)
+            road_risk = dict(zip(
+                risk_table.road_names.tolist(),
+                risk_table.condition_risk[day_of_year(month, day), slot].tolist(),
+            ))
+            risk_index = RiskIndex(road_risk, version=f"{risk_table.version}:{month:02d}-{day:02d}:c{int(condition)}")
+            return risk_index, edge_tensor.for_day(month, day, condition)
+
+        if risk_table is not None:
+            risk_index = risk_table.index_for(month, day)
+        elif self.risk_frame is not None:
+            risk_index = RiskIndex.from_frame(self.risk_frame, month=month, day=day)
+        else:
+            risk_index = RiskIndex({})
+        return risk_index, self.csr_graph.edge_risk(risk_index)
+
+    def conditions(self):
+        """
+        Returns the weather conditions routes can be planned for.
+
+        Returns:
+            list: The condition codes, empty if the risk table has none.
+        """
+        edge_tensor = self.edge_tensor
+        return edge_tensor.conditions.tolist() if edge_tensor is not None else []
+
+    def risk_for(self, month, day, condition=None):
+        """
+        Returns the road and edge risk for a date, computed once per date.
+
+        Args:
+            month (int): The month.
+            day (int): The day of the month.
+            condition (int): A weather condition code, or None for the
+                date's historically most common weather.
+
+        Returns:
+            tuple: The RiskIndex and the int8 risk level per edge position.
+
+        Raises:
+            KeyError: If the condition is not in the risk table.
+        """
+        key = (month, day, condition)
+        with self._lock:
+            cached = self._risk.get(key)
+            risk_table = self.risk_table
+            edge_tensor = self.edge_tensor
+            unmatched = self._unmatched
+        if cached is not None:
+            return cached
+
+        with span("risk"):
+            cached = self._derive_risk(risk_table, edge_tensor, unmatched, month, day, condition)
+        with self._lock:
+            if self.risk_table is risk_table:
+                self._risk[key] = cached
+        return cached
+
+    def today_risk(self, condition=None):
+        """
+        Returns the road and edge risk for today.
+
+        Args:
+            condition (int): A weather condition code, or None for the
+                date's historically most common weather.
+
+        Returns:
+            tuple: The RiskIndex and the int8 risk level per edge position.
+        """
+        today = datetime.now()
+        date = (today.month, today.day)
+        risk = self.risk_for(today.month, today.day, condition)
+        if self._today.get(condition) != date:
+            # On the first request of a day, carry yesterday's routes over
+            with self._lock:
+                previous = self._today.get(condition)
+                self._today[condition] = date
+                old = self._risk.get(previous + (condition,)) if previous is not None else None
+            if old is not None and previous != date:
+                self._carry_over(old, risk)
+            # Keep only today's risk in this weather, so a long-running process
+            # holds about one edge array per condition
+            with self._lock:
+                self._risk = {
+                    key: value for key, value in self._risk.items() if key[2] != condition or key[:2] == date
+                }
+        return risk
+
+    def geocode(self, address):
+        """
+        Geocodes an address, trying the local gazetteer first.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            The Place or geopy Location, or None if nothing matches.
+
+        Raises:
+            geopy.exc.GeopyError: If the fallback geocoder fails on a
+                gazetteer miss.
+        """
+        return geocode(self.gazetteer, self.fallback_geocoder, address)
+
+    def route(self, start_node, end_node, mode="shortest", risk=None):
+        """
+        Finds a route between two nodes, served from the route cache.
+
+        Args:
+            start_node (int): The OSM id of the start node.
+            end_node (int): The OSM id of the end node.
+            mode (str): A key of ROUTE_MODES.
+            risk (tuple): The (RiskIndex, edge risk) to route with,
+                today's risk by default.
+
+        Returns:
+            RouteResult: The route.
+
+        Raises:
+            networkx.NetworkXNoPath: If the end node cannot be reached.
+        """
+        risk_index, edge_risk = risk if risk is not None else self.today_risk()
+
+        def compute():
+            with span("shortest_path"):
+                costs = self.csr_graph.edge_costs(edge_risk, ROUTE_MODES[mode])
+                nodes, edges = self.csr_graph.route(start_node, end_node, costs)
+                return RouteResult.from_route(self.csr_graph, nodes, edges, edge_risk)
+
+        key = (start_node, end_node, mode, risk_index.version)
+        return self.route_cache.get_or_compute(key, compute)
+
+    def alternatives(self, start_node, end_node, mode="shortest", risk=None, k=ALTERNATIVES):
+        """
+        Finds up to k distinct routes between two nodes, the best one first.
+
+        The routes are cached together.
+
+        Args:
+            start_node (int): The OSM id of the start node.
+            end_node (int): The OSM id of the end node.
+            mode (str): A key of ROUTE_MODES.
+            risk (tuple): The (RiskIndex, edge risk), today's by default.
+            k (int): The number of routes wanted.
+
+        Returns:
+            list: The RouteResults; fewer than k if no more differ enough.
+
+        Raises:
+            networkx.NetworkXNoPath: If the end node cannot be reached.
+        """
+        risk = risk if risk is not None else self.today_risk()
+        risk_index, edge_risk = risk
+        primary = self.route(start_node, end_node, mode, risk)
+        if k <= 1 or len(primary.edges) == 0:
+            return [primary]
+
+        def compute():
+            with self._lock:
+                if self._alternative_search is None:
+                    self._alternative_search = AlternativeSearch(self.csr_graph)
+                search = self._alternative_search
+            with span("alternatives"):
+                routes = search.routes(start_node, end_node, primary.edges.tolist(), edge_risk, ROUTE_MODES[mode], k)
+                heads = self.csr_graph.heads
+                return RouteSet([primary] + [
+                    RouteResult.from_route(self.csr_graph,
+                                           [start_node] + self.csr_graph.node_ids[heads[edges]].tolist(),
+                                           edges, edge_risk)
+                    for edges in routes[1:]
+                ])
+
+        key = (start_node, end_node, mode, risk_index.version, k)
+        return self.route_cache.get_or_compute(key, compute).routes
+
+    def route_between(self, start, end, mode="shortest", risk=None):
+        """
+        Snaps two coordinates to the graph and routes between them.
+
+        Args:
+            start (tuple): The (lat, lon) of the start.
+            end (tuple): The (lat, lon) of the end.
+            mode (str): A key of ROUTE_MODES.
+            risk (tuple): The (RiskIndex, edge risk), today's by default.
+
+        Returns:
+            RouteResult: The route.
+        """
+        with span("snap"):
+            start_node, end_node = self.node_index.nearest_many([start[0], end[0]], [start[1], end[1]]).tolist()
+        return self.route(start_node, end_node, mode, risk)
+
+    def alternatives_between(self, start, end, mode="shortest", risk=None, k=ALTERNATIVES):
+        """
+        Snaps two coordinates to the graph and finds up to k routes between them.
+
+        Args:
+            start (tuple): The (lat, lon) of the start.
+            end (tuple): The (lat, lon) of the end.
+            mode (str): A key of ROUTE_MODES.
+            risk (tuple): The (RiskIndex, edge risk), today's by default.
+            k (int): The number of routes wanted.
+
+        Returns:
+            list: The RouteResults, the best one first.
+        """
+        with span("snap"):
+            start_node, end_node = self.node_index.nearest_many([start[0], end[0]], [start[1], end[1]]).tolist()
+        return self.alternatives(start_node, end_node, mode, risk, k)
+
+    def payload(self, route, mode, risk=None, zoom=ROUTE_ZOOM, include_geojson=True):
+        """
+        Converts a route into a JSON-serializable dict for display.
+
+        Args:
+            route (RouteResult): The route.
+            mode (str): The route mode it was computed with.
+            risk (tuple): The (RiskIndex, edge risk) it was computed with.
+            zoom (int): The zoom level the map geometry is simplified for.
+            include_geojson (bool): Whether to add the map layer.
+
+        Returns:
+            dict: Coordinates, per-road summary, length, length per risk
+            level and GeoJSON layer.
+        """
+        with span("payload"):
+            return self._payload(route, mode, risk, zoom, include_geojson)
+
+    def _payload(self, route, mode, risk, zoom, include_geojson):
+        risk_index, edge_risk = risk if risk is not None else self.today_risk()
+        risk_lengths = np.bincount(
+            edge_risk[route.edges].astype(np.int64), weights=self.csr_graph.length[route.edges],
+            minlength=len(RISK_COLORS),
+        )
+        nodes = route.nodes.tolist()
+        payload = {
+            "mode": mode,
+            "risk_version": risk_index.version,
+            "nodes": nodes,
+            "coords": [[self.G.nodes[node]["y"], self.G.nodes[node]["x"]] for node in nodes],
+            "roads": [
+                {"name": road_name, "risk_level": risk_level, "length": length}
+                for road_name, risk_level, length in route.roads
+            ],
+            "length": route.length,
+            "risk_lengths": {str(risk_level): float(risk_lengths[risk_level]) for risk_level in sorted(RISK_COLORS)},
+        }
+        if include_geojson:
+            payload["geojson"] = route_geojson(self.G, self.csr_graph, route.edges.tolist(), edge_risk, zoom)
+        return payload
+
+
+class TiledRouteEngine:
+    """
+    Routing over a tiled region, loading only the tiles around each route.
+
+    Every route is served by a RouteEngine over the tiles covering its start
+    and end plus a margin. Such regional engines, with their stitched graph,
+    edge risk and cached routes, are kept for later routes that fall inside
+    them, up to `REGION_CACHE_BYTES`. Tiles are shared between regions
+    through the byte-bounded tile cache; a region keeps its tiles alive
+    until it is itself dropped.
+
+    Attributes:
+        tile_store (TileStore): The tile loader and cache.
+        gazetteer (Gazetteer): Street and place index of the whole region.
+        risk_table (RiskTable): The precomputed risk table, or None.
+        risk_frame (pd.DataFrame): Model data used when there is no table.
+        fallback_geocoder: Optional geopy geocoder asked on gazetteer misses.
+        regions (RegionCache): The regional engines.
+    """
+
+    def __init__(self, tile_store, risk_table=None, risk_frame=None, fallback_geocoder=None,
+                 max_bytes=REGION_CACHE_BYTES):
+        self.tile_store = tile_store
+        places = load_places(PLACES_PATH) if os.path.exists(PLACES_PATH) else []
+        self.gazetteer = Gazetteer(places + tile_store.gazetteer_places())
+        self.risk_table = risk_table
+        self.risk_frame = risk_frame
+        self.fallback_geocoder = fallback_geocoder
+        self.regions = RegionCache(max_bytes)
+        self.watcher = None
+        self._lock = threading.Lock()
+        self._risk_lock = threading.Lock()
+
+    def engine_for(self, start, end, margin=TILE_MARGIN):
+        """
+        Returns a regional engine whose tiles cover two coordinates.
+
+        Args:
+            start (tuple): The (lat, lon) of the start.
+            end (tuple): The (lat, lon) of the end.
+            margin (float): Margin around their bounding box, in degrees.
+
+        Returns:
+            RouteEngine: The regional engine.
+
+        Raises:
+            ValueError: If no tile covers the route.
+        """
+        keys = self.tile_store.keys_for([start, end], margin)
+        if not keys:
+            raise ValueError(f"Locations are outside {self.tile_store.region}")
+
+        engine = self.regions.find(keys)
+        if engine is not None:
+            return engine
+        # One region is built at a time, so concurrent requests share it
+        with self._lock:
+            engine = self.regions.find(keys)
+            if engine is None:
+                start_time = time.perf_counter()
+                with span("region_load"):
+                    engine = RouteEngine(
+                        self.tile_store.graph_for(keys), self.risk_table, self.risk_frame,
+                        fallback_geocoder=self.fallback_geocoder, gazetteer=self.gazetteer,
+                    )
+                self.regions.put(keys, engine)
+                logger.info(f"Loaded region of {len(keys)} tiles, {len(engine.G)} nodes, "
+                            f"in {time.perf_counter() - start_time:.2f}s")
+        return engine
+
+    def geocode(self, address):
+        """
+        Geocodes an address, trying the regional gazetteer first.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            The Place or geopy Location, or None if nothing matches.
+
+        Raises:
+            geopy.exc.GeopyError: If the fallback geocoder fails on a
+                gazetteer miss.
+        """
+        return geocode(self.gazetteer, self.fallback_geocoder, address)
+
+    def conditions(self):
+        """
+        Returns the weather conditions routes can be planned for.
+
+        Returns:
+            list: The condition codes, empty if the risk table has none.
+        """
+        risk_table = self.risk_table
+        if risk_table is None or risk_table.condition_risk is None:
+            return []
+        return risk_table.conditions.tolist()
+
+    def set_risk_table(self, risk_table):
+        """
+        Replaces the risk table of this engine and of every loaded region.
+
+        Regions loaded from now on use the new table at once. The loaded
+        ones derive their risk from it one by one, without holding up
+        `engine_for`, and serve the old risk until their own swap.
+
+        Args:
+            risk_table (RiskTable): The new risk table.
+        """
+        with self._risk_lock:
+            with self._lock:
+                self.risk_table = risk_table
+                engines = self.regions.values()
+            for engine in engines:
+                engine.set_risk_table(risk_table)
+
+    def watch(self, snapshot_dir=RISK_SNAPSHOT_DIR, interval=WATCH_INTERVAL):
+        """
+        Starts following the published risk snapshots in the background.
+
+        Args:
+            snapshot_dir (str): The snapshot directory.
+            interval (float): Seconds between checks.
+
+        Returns:
+            SnapshotWatcher: The running watcher.
+        """
+        if self.watcher is None:
+            self.watcher = SnapshotWatcher(
+                self.set_risk_table, snapshot_dir, interval, active=active_snapshot(snapshot_dir)
+            ).start()
+        return self.watcher
+
+    def risk_version(self):
+        """
+        Returns the version of the risk table routes are computed with.
+
+        Returns:
+            str: The version, or None if there is no risk table.
+        """
+        risk_table = self.risk_table
+        return risk_table.version if risk_table is not None else None
+
+    def today_risk_version(self):
+        """
+        Returns the version of today's risk, which changes with the risk table
+        and with the date, for caches of routes computed with it.
+
+        Returns:
+            str: The version of the RiskIndex `today_risk` returns.
+        """
+        today = datetime.now()
+        return day_risk_version(self.risk_table, self.risk_frame, today.month, today.day)
+
+    def stats(self):
+        """
+        Returns the tile cache counters and those of each region's route cache.
+
+        Returns:
+            dict: Tile counters, the approximate size of the regions and a
+            list of route cache counters.
+        """
+        return {
+            "tiles": self.tile_store.stats(),
+            "region_bytes": self.regions.nbytes(),
+            "regions": [engine.stats() for engine in self.regions.values()],
+        }
@@ -0,0 +1,272 @@
+"""
+Compact rendering of a route on the folium map.
+
+Instead of one PolyLine per edge, consecutive edges with the same risk
+level are merged into continuous lines, simplified with Douglas-Peucker at a
+tolerance suited to the map zoom, and sent as a single GeoJSON
+FeatureCollection with one feature per risk level.
+
+Usage:
+    python route_render.py     # compare payload size and render time
+"""
+import math
+import time
+
+import folium
+import numpy as np
+
+from risk_index import risk_color
+from routing import CSRGraph, project_coords
+
+# Zoom level the route map opens at
+ROUTE_ZOOM = 13
+
+# Metres per pixel at zoom 0 on the equator in Web Mercator
+METRES_PER_PIXEL_Z0 = 156543.03
+
+
+def zoom_tolerance(zoom, lat):
+    """
+    Returns a simplification tolerance invisible at a zoom level.
+
+    Args:
+        zoom (int): The map zoom level.
+        lat (float): The latitude of the map centre.
+
+    Returns:
+        float: Half a screen pixel in metres.
+    """
+    return 0.5 * METRES_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def simplify_line(coords, tolerance):
+    """
+    Simplifies a line with the Douglas-Peucker algorithm.
+
+    Args:
+        coords (list): (lat, lon) points of the line.
+        tolerance (float): The largest allowed deviation in metres.
+
+    Returns:
+        list: The kept (lat, lon) points, always including both ends.
+    """
+    n = len(coords)
+    if n < 3:
+        return list(coords)
+
+    lat, lon = np.asarray(coords, dtype=np.float64).T
+    x, y = project_coords(lat, lon, float(lat[0]))
+    points = np.column_stack((x, y))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        inner = points[start + 1:end] - a
+        ab = b - a
+        norm = math.hypot(ab[0], ab[1])
+        if norm == 0:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            dist = np.abs(ab[0] * inner[:, 1] - ab[1] * inner[:, 0]) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return [coords[i] for i in np.flatnonzero(keep)]
+
+
+def edge_coords(G, u, v, key):
+    """
+    Returns the points of a graph edge, following its geometry if it has one.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        u (int): The edge start node.
+        v (int): The edge end node.
+        key (int): The edge key.
+
+    Returns:
+        list: (lat, lon) points from u to v.
+    """
+    geometry = G[u][v][key].get("geometry")
+    if geometry is not None:
+        return [(lat, lon) for lon, lat in geometry.coords]
+    return [(G.nodes[u]["y"], G.nodes[u]["x"]), (G.nodes[v]["y"], G.nodes[v]["x"])]
+
+
+def risk_runs(G, csr_graph, route_edges, edge_risk):
+    """
+    Merges consecutive route edges with the same risk level into lines.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        csr_graph (CSRGraph): The routing graph.
+        route_edges (list): Edge positions along the route.
+        edge_risk (np.ndarray): Risk level per edge position.
+
+    Returns:
+        list: (risk level, [(lat, lon), ...]) per run of edges.
+    """
+    runs = []
+    for edge in route_edges:
+        risk_level = int(edge_risk[edge])
+        coords = edge_coords(G, *csr_graph.edge_id(edge))
+        if runs and runs[-1][0] == risk_level:
+            runs[-1][1].extend(coords[1:])
+        else:
+            runs.append((risk_level, coords))
+    return runs
+
+
+def route_geojson(G, csr_graph, route_edges, edge_risk, zoom=ROUTE_ZOOM):
+    """
+    Builds the route as a GeoJSON FeatureCollection.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        csr_graph (CSRGraph): The routing graph.
+        route_edges (list): Edge positions along the route.
+        edge_risk (np.ndarray): Risk level per edge position.
+        zoom (int): The zoom level the simplification is tuned for.
+
+    Returns:
+        dict: One MultiLineString feature per risk level on the route.
+    """
+    runs = risk_runs(G, csr_graph, route_edges, edge_risk)
+    if not runs:
+        return {"type": "FeatureCollection", "features": []}
+
+    tolerance = zoom_tolerance(zoom, runs[0][1][0][0])
+    lines = {}
+    for risk_level, coords in runs:
+        line = [[round(lon, 6), round(lat, 6)] for lat, lon in simplify_line(coords, tolerance)]
+        lines.setdefault(risk_level, []).append(line)
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "MultiLineString", "coordinates": lines[risk_level]},
+            "properties": {"risk_level": risk_level, "color": risk_color(risk_level)},
+        }
+        for risk_level in sorted(lines)
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def route_style(feature):
+    """
+    Returns the Leaflet style of a route feature.
+
+    Defined at module level so maps holding the layer can be pickled.
+
+    Args:
+        feature (dict): A feature from `route_geojson`.
+
+    Returns:
+        dict: The line style.
+    """
+    return {"color": feature["properties"]["color"], "weight": 3}
+
+
+def alternative_style(feature):
+    """
+    Returns the Leaflet style of an alternative route feature.
+
+    Args:
+        feature (dict): A feature from `route_geojson`.
+
+    Returns:
+        dict: A dashed, lighter line style.
+    """
+    return {"color": feature["properties"]["color"], "weight": 3, "opacity": 0.6, "dashArray": "6 6"}
+
+
+def add_route_layer(route_map, feature_collection, name="Route", style_function=route_style, show=True):
+    """
+    Adds a route FeatureCollection to a map, coloured by risk level.
+
+    Args:
+        route_map (folium.Map): The map, or a FeatureGroup to add it to.
+        feature_collection (dict): The output of `route_geojson`.
+        name (str): The layer name, listed in a LayerControl.
+        style_function (callable): The Leaflet style per feature.
+        show (bool): Whether the layer is visible when the map opens.
+
+    Returns:
+        folium.GeoJson: The added layer.
+    """
+    return folium.GeoJson(
+        feature_collection,
+        name=name,
+        style_function=style_function,
+        show=show,
+    ).add_to(route_map)
+
+
+def _legacy_map(G, csr_graph, route_edges, edge_risk, location):
+    # One PolyLine per edge, as create_route_map used to draw routes
+    route_map = folium.Map(location=location, zoom_start=ROUTE_ZOOM)
+    for edge in route_edges:
+        u, v, _ = csr_graph.edge_id(edge)
+        segment = [(G.nodes[u]["y"], G.nodes[u]["x"]), (G.nodes[v]["y"], G.nodes[v]["x"])]
+        folium.PolyLine(segment, color=risk_color(int(edge_risk[edge])), weight=3).add_to(route_map)
+    return route_map
+
+
+def _geojson_map(G, csr_graph, route_edges, edge_risk, location):
+    route_map = folium.Map(location=location, zoom_start=ROUTE_ZOOM)
+    add_route_layer(route_map, route_geojson(G, csr_graph, route_edges, edge_risk))
+    return route_map
+
+
+def compare_rendering(G, edge_risk=None):
+    """
+    Measures payload size and render time of both renderers on a long route.
+
+    The route runs between the two nodes furthest apart along the
+    south-west to north-east diagonal of the graph.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        edge_risk (np.ndarray): Risk level per edge position.
+
+    Returns:
+        dict: Edge count, and HTML bytes and seconds per renderer.
+    """
+    csr_graph = CSRGraph(G)
+    if edge_risk is None:
+        edge_risk = np.random.default_rng(0).integers(0, 4, csr_graph.num_edges).astype(np.int8)
+
+    diagonal = csr_graph.x + csr_graph.y
+    source = int(csr_graph.node_ids[np.argmin(diagonal)])
+    target = int(csr_graph.node_ids[np.argmax(diagonal)])
+    _, route_edges = csr_graph.route(source, target, csr_graph.edge_costs())
+    location = [float(csr_graph.lat.mean()), float(csr_graph.lon.mean())]
+
+    result = {"edges": len(route_edges)}
+    for name, build in (("polylines", _legacy_map), ("geojson", _geojson_map)):
+        start = time.perf_counter()
+        html = build(G, csr_graph, route_edges, edge_risk, location).get_root().render()
+        result[name] = {"bytes": len(html.encode()), "seconds": time.perf_counter() - start}
+    return result
+
+
+def main():
+    from graph_store import load_graph
+
+    result = compare_rendering(load_graph(download=False))
+    print(f"Route with {result['edges']} edges")
+    for name in ("polylines", "geojson"):
+        print(f"{name:>9}: {result[name]['bytes'] / 1024:.1f} KiB, {result[name]['seconds'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
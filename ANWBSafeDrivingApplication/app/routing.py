@@ -0,0 +1,504 @@
+"""
+Risk-aware routing on an array-backed copy of the road graph.
+
+The NetworkX graph is converted once into a CSR adjacency (flat NumPy
+arrays of edge heads, lengths and road names, indexed by edge position).
+Routes are found with A* over those arrays using the cost
+
+    length * (1 + alpha * risk)
+
+so alpha = 0 gives the shortest route and larger values trade extra
+distance for lower risk.
+
+Usage:
+    python routing.py --pairs 50 --alpha 1.0    # benchmark against NetworkX
+"""
+import argparse
+import heapq
+import logging
+import math
+import random
+import statistics
+import sys
+import time
+
+import networkx as nx
+import numpy as np
+
+from risk_index import DEFAULT_RISK
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371009
+
+# Risk weight per route preference shown in the app
+ROUTE_MODES = {
+    "shortest": 0.0,
+    "safest": 1.0,
+}
+
+
+def project_coords(lat, lon, lat0):
+    """
+    Projects coordinates to metres with an equirectangular projection.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        lon (np.ndarray): Longitudes in degrees.
+        lat0 (float): The reference latitude in degrees.
+
+    Returns:
+        tuple: The x and y coordinates in metres.
+    """
+    x = EARTH_RADIUS * np.radians(lon) * math.cos(math.radians(lat0))
+    y = EARTH_RADIUS * np.radians(lat)
+    return x, y
+
+
+class RouteResult:
+    """
+    Compact result of a route search.
+
+    Attributes:
+        nodes (np.ndarray): OSM node ids along the route.
+        edges (np.ndarray): Edge positions along the route.
+        roads (tuple): (road name, risk level, length) per named road, in
+            the order the route first enters it.
+        length (float): Total route length in metres.
+    """
+
+    __slots__ = ("nodes", "edges", "roads", "length")
+
+    def __init__(self, nodes, edges, roads, length):
+        self.nodes = nodes
+        self.edges = edges
+        self.roads = roads
+        self.length = length
+
+    @classmethod
+    def from_route(cls, csr_graph, nodes, edges, edge_risk):
+        """
+        Summarizes a route found by `CSRGraph.route`.
+
+        Args:
+            csr_graph (CSRGraph): The routing graph.
+            nodes (list): OSM node ids along the route.
+            edges (list): Edge positions along the route.
+            edge_risk (np.ndarray): Risk level per edge position.
+
+        Returns:
+            RouteResult: The route.
+        """
+        roads = {}
+        for edge in edges:
+            road_name = csr_graph.road_names[edge]
+            if isinstance(road_name, str):
+                _, length = roads.get(road_name, (0, 0.0))
+                roads[road_name] = (int(edge_risk[edge]), length + float(csr_graph.length[edge]))
+
+        return cls(
+            np.asarray(nodes, dtype=np.int64),
+            np.asarray(edges, dtype=np.int32),
+            tuple((road_name, risk, length) for road_name, (risk, length) in roads.items()),
+            float(csr_graph.length[edges].sum()) if len(edges) else 0.0,
+        )
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the route, in bytes."""
+        roads = sum(sys.getsizeof(road_name) + 64 for road_name, _, _ in self.roads)
+        return self.nodes.nbytes + self.edges.nbytes + roads + 64
+
+
+class CSRGraph:
+    """
+    Compressed sparse row copy of a road graph.
+
+    Every edge of the NetworkX graph, parallel edges included, gets one
+    position. The outgoing edges of node position i are the positions
+    indptr[i] to indptr[i + 1].
+
+    Attributes:
+        node_ids (np.ndarray): OSM node id per node position.
+        node_pos (dict): Node position per OSM node id.
+        indptr (np.ndarray): Start of each node's edges.
+        tails (np.ndarray): Start node position per edge.
+        heads (np.ndarray): End node position per edge.
+        keys (np.ndarray): NetworkX edge key per edge.
+        length (np.ndarray): Edge length in metres.
+        road_names (list): OSM 'name' attribute per edge.
+        lat (np.ndarray): Node latitudes.
+        lon (np.ndarray): Node longitudes.
+        x (np.ndarray): Projected node x coordinates in metres.
+        y (np.ndarray): Projected node y coordinates in metres.
+    """
+
+    def __init__(self, G):
+        self.node_ids = np.fromiter(G.nodes, dtype=np.int64, count=len(G))
+        self.node_pos = {node: i for i, node in enumerate(self.node_ids.tolist())}
+
+        tails, heads, keys, length, road_names = [], [], [], [], []
+        for u, v, key, data in G.edges(keys=True, data=True):
+            tails.append(self.node_pos[u])
+            heads.append(self.node_pos[v])
+            keys.append(key)
+            length.append(data.get("length", 0.0))
+            road_names.append(data.get("name"))
+
+        # Sort edges by start node so each node's edges are contiguous
+        order = np.argsort(np.asarray(tails, dtype=np.int64), kind="stable")
+        self.tails = np.asarray(tails, dtype=np.int32)[order]
+        self.heads = np.asarray(heads, dtype=np.int32)[order]
+        self.keys = np.asarray(keys, dtype=np.int64)[order]
+        self.length = np.asarray(length, dtype=np.float64)[order]
+        self.road_names = [road_names[i] for i in order.tolist()]
+        self.indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.tails, minlength=len(self.node_ids)), out=self.indptr[1:])
+
+        self.lat = np.array([G.nodes[node]["y"] for node in self.node_ids.tolist()], dtype=np.float64)
+        self.lon = np.array([G.nodes[node]["x"] for node in self.node_ids.tolist()], dtype=np.float64)
+        self.x, self.y = project_coords(self.lat, self.lon, float(self.lat.mean()) if len(self.lat) else 0.0)
+        self._straight = np.hypot(self.x[self.heads] - self.x[self.tails], self.y[self.heads] - self.y[self.tails])
+
+        # Plain lists are faster than NumPy scalars in the search loop
+        self._adjacency = (self.indptr.tolist(), self.heads.tolist(), self.tails.tolist())
+        self._reverse = None
+        self._length_scale = None
+
+    @property
+    def num_edges(self):
+        return len(self.heads)
+
+    def edge_id(self, position):
+        """
+        Returns the NetworkX edge id of an edge position.
+
+        Args:
+            position (int): The edge position.
+
+        Returns:
+            tuple: The (u, v, key) edge id.
+        """
+        return (
+            int(self.node_ids[self.tails[position]]),
+            int(self.node_ids[self.heads[position]]),
+            int(self.keys[position]),
+        )
+
+    def edge_risk(self, risk_index):
+        """
+        Looks up the risk level of every edge.
+
+        Args:
+            risk_index (RiskIndex): The road risk lookup.
+
+        Returns:
+            np.ndarray: int8 risk level per edge position.
+        """
+        return np.fromiter(
+            (risk_index.road(name) if name is not None else DEFAULT_RISK for name in self.road_names),
+            dtype=np.int8,
+            count=self.num_edges,
+        )
+
+    def edge_costs(self, edge_risk=None, alpha=0.0):
+        """
+        Computes the routing cost of every edge.
+
+        Args:
+            edge_risk (np.ndarray): Risk level per edge position.
+            alpha (float): Weight of risk relative to length.
+
+        Returns:
+            np.ndarray: Cost per edge position.
+        """
+        if edge_risk is None or alpha == 0:
+            return self.length
+        return self.length * (1.0 + alpha * edge_risk)
+
+    def _heuristic_scale(self, costs):
+        # Largest factor that keeps the straight-line distance a lower bound
+        # of the remaining cost, so A* stays exact for any cost vector
+        straight = self._straight
+        moving = straight > 0
+        if not moving.any():
+            return 0.0
+        return float(min(1.0, (costs[moving] / straight[moving]).min()))
+
+    def cost_bound(self, sources, targets):
+        """
+        Returns a lower bound of the cost of any route between node positions.
+
+        Edge costs are never below edge lengths, so the bound holds for every
+        route mode and risk level.
+
+        Args:
+            sources (np.ndarray): Start node positions.
+            targets (np.ndarray): End node positions.
+
+        Returns:
+            np.ndarray: The bound per pair of positions.
+        """
+        if self._length_scale is None:
+            self._length_scale = self._heuristic_scale(self.length)
+        return self._length_scale * np.hypot(self.x[targets] - self.x[sources], self.y[targets] - self.y[sources])
+
+    def route(self, source, target, costs):
+        """
+        Finds the cheapest route between two nodes with A*.
+
+        Args:
+            source (int): The OSM id of the start node.
+            target (int): The OSM id of the end node.
+            costs (np.ndarray): Cost per edge position, see `edge_costs`.
+
+        Returns:
+            tuple: The OSM node ids and the edge positions along the route.
+
+        Raises:
+            networkx.NetworkXNoPath: If the end node cannot be reached.
+        """
+        indptr, heads, tails = self._adjacency
+        source_pos = self.node_pos[source]
+        target_pos = self.node_pos[target]
+        cost = costs.tolist()
+
+        scale = self._heuristic_scale(costs)
+        x, y = self.x, self.y
+        tx, ty = x[target_pos], y[target_pos]
+        heuristic = (scale * np.hypot(x - tx, y - ty)).tolist()
+
+        best = {source_pos: 0.0}
+        via_edge = {}
+        heap = [(heuristic[source_pos], 0.0, source_pos)]
+        while heap:
+            _, dist, u = heapq.heappop(heap)
+            if u == target_pos:
+                break
+            if dist > best[u]:
+                continue
+            for e in range(indptr[u], indptr[u + 1]):
+                v = heads[e]
+                new_dist = dist + cost[e]
+                if new_dist < best.get(v, math.inf):
+                    best[v] = new_dist
+                    via_edge[v] = e
+                    heapq.heappush(heap, (new_dist + heuristic[v], new_dist, v))
+        else:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+
+        edges = []
+        node = target_pos
+        while node != source_pos:
+            e = via_edge[node]
+            edges.append(e)
+            node = tails[e]
+        edges.reverse()
+
+        nodes = [source] + [int(self.node_ids[heads[e]]) for e in edges]
+        return nodes, edges
+
+    def reverse_adjacency(self):
+        """
+        Returns the incoming edges of every node, built on first use.
+
+        Returns:
+            tuple: The start of each node's incoming edges, and the edge
+            positions grouped by end node, as lists.
+        """
+        if self._reverse is None:
+            order = np.argsort(self.heads, kind="stable")
+            indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.heads, minlength=len(self.node_ids)), out=indptr[1:])
+            self._reverse = (indptr.tolist(), order.tolist())
+        return self._reverse
+
+    def search_tree(self, root, costs, limit=math.inf, reverse=False, goal=None):
+        """
+        Grows a shortest-path tree from a node with Dijkstra.
+
+        With a goal, nodes whose cost plus the straight-line bound to the
+        goal exceeds the limit are left out too, so the tree covers only
+        the ellipse of nodes a route to the goal within the limit can pass.
+        The costs of the nodes kept stay exact.
+
+        Args:
+            root (int): The OSM id of the root node.
+            costs (np.ndarray): Cost per edge position, see `edge_costs`.
+            limit (float): Nodes further than this cost are left out.
+            reverse (bool): Whether to follow edges backwards, giving the
+                cheapest routes from every node to the root.
+            goal (int): The OSM id of the node at the other end, or None.
+
+        Returns:
+            tuple: The cost per node position (inf if not reached) and the
+            edge position leading towards the root per node position (-1 if none).
+        """
+        indptr, heads, tails = self._adjacency
+        if reverse:
+            indptr, edge_order = self.reverse_adjacency()
+            neighbours = tails
+        else:
+            edge_order = None
+            neighbours = heads
+        root_pos = self.node_pos[root]
+        cost = costs.tolist()
+
+        if goal is None:
+            heuristic = [0.0] * len(self.node_ids)
+        else:
+            goal_pos = self.node_pos[goal]
+            scale = self._heuristic_scale(costs)
+            heuristic = (scale * np.hypot(self.x - self.x[goal_pos], self.y - self.y[goal_pos])).tolist()
+
+        best = {root_pos: 0.0}
+        via_edge = {}
+        heap = [(0.0, root_pos)]
+        while heap:
+            dist, u = heapq.heappop(heap)
+            if dist > best[u]:
+                continue
+            for i in range(indptr[u], indptr[u + 1]):
+                e = edge_order[i] if reverse else i
+                v = neighbours[e]
+                new_dist = dist + cost[e]
+                if new_dist + heuristic[v] <= limit and new_dist < best.get(v, math.inf):
+                    best[v] = new_dist
+                    via_edge[v] = e
+                    heapq.heappush(heap, (new_dist, v))
+
+        dist = np.full(len(self.node_ids), math.inf)
+        dist[list(best)] = list(best.values())
+        via = np.full(len(self.node_ids), -1, dtype=np.int32)
+        via[list(via_edge)] = list(via_edge.values())
+        return dist, via
+
+    def routes_from(self, source, targets, costs):
+        """
+        Finds the cheapest routes from one node to many with one Dijkstra search.
+
+        The search grows a single shortest-path tree from the source and
+        stops as soon as every target is settled, so routing many trips that
+        share an origin costs about as much as routing the longest of them.
+
+        Args:
+            source (int): The OSM id of the start node.
+            targets (iterable): OSM ids of the end nodes.
+            costs (np.ndarray): Cost per edge position, see `edge_costs`.
+
+        Returns:
+            dict: The edge positions along the route per reachable target.
+        """
+        indptr, heads, tails = self._adjacency
+        source_pos = self.node_pos[source]
+        remaining = {self.node_pos[target] for target in targets}
+        cost = costs.tolist()
+
+        best = {source_pos: 0.0}
+        via_edge = {}
+        settled = set()
+        heap = [(0.0, source_pos)]
+        while heap and remaining:
+            dist, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            remaining.discard(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = heads[e]
+                new_dist = dist + cost[e]
+                if new_dist < best.get(v, math.inf):
+                    best[v] = new_dist
+                    via_edge[v] = e
+                    heapq.heappush(heap, (new_dist, v))
+
+        routes = {}
+        for target in targets:
+            node = self.node_pos[target]
+            if node not in settled or target in routes:
+                continue
+            edges = []
+            while node != source_pos:
+                e = via_edge[node]
+                edges.append(e)
+                node = tails[e]
+            edges.reverse()
+            routes[target] = edges
+        return routes
+
+
+def benchmark(G, pairs=50, alpha=ROUTE_MODES["safest"], edge_risk=None, seed=0):
+    """
+    Times CSR A* against NetworkX shortest_path on random node pairs.
+
+    Args:
+        G (networkx.MultiDiGraph): The road graph.
+        pairs (int): The number of origin-destination pairs.
+        alpha (float): The risk weight for the safest-route timing.
+        edge_risk (np.ndarray): Risk level per edge position.
+        seed (int): The random seed for picking pairs.
+
+    Returns:
+        dict: Median timings in milliseconds and the CSR build time.
+    """
+    start = time.perf_counter()
+    csr = CSRGraph(G)
+    build = time.perf_counter() - start
+
+    if edge_risk is None:
+        edge_risk = np.zeros(csr.num_edges, dtype=np.int8)
+    shortest_costs = csr.edge_costs()
+    safest_costs = csr.edge_costs(edge_risk, alpha)
+
+    rng = random.Random(seed)
+    nodes = csr.node_ids.tolist()
+    timings = {"networkx": [], "csr_shortest": [], "csr_safest": []}
+    for _ in range(pairs):
+        source, target = rng.choice(nodes), rng.choice(nodes)
+
+        start = time.perf_counter()
+        try:
+            nx_route = nx.shortest_path(G, source, target, weight="length")
+        except nx.NetworkXNoPath:
+            continue
+        timings["networkx"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _, edges = csr.route(source, target, shortest_costs)
+        timings["csr_shortest"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        csr.route(source, target, safest_costs)
+        timings["csr_safest"].append(time.perf_counter() - start)
+
+        nx_length = nx.path_weight(G, nx_route, "length")
+        csr_length = float(csr.length[edges].sum())
+        if not math.isclose(nx_length, csr_length, rel_tol=1e-6):
+            logger.warning(f"Route length mismatch {source}->{target}: {nx_length:.1f} vs {csr_length:.1f}")
+
+    result = {name: 1000 * statistics.median(values) for name, values in timings.items() if values}
+    result["csr_build"] = 1000 * build
+    return result
+
+
+def main():
+    from graph_store import load_graph
+
+    parser = argparse.ArgumentParser(description="Benchmark CSR routing against NetworkX.")
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--alpha", type=float, default=ROUTE_MODES["safest"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    G = load_graph(download=False)
+    edge_risk = np.random.default_rng(args.seed).integers(0, 4, G.number_of_edges()).astype(np.int8)
+    result = benchmark(G, args.pairs, args.alpha, edge_risk, args.seed)
+    print(f"Graph: {len(G.nodes)} nodes, {len(G.edges)} edges, CSR build {result['csr_build']:.1f} ms")
+    for name in ("networkx", "csr_shortest", "csr_safest"):
+        print(f"{name:>13}: {result[name]:.2f} ms median per route")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Spatial index for snapping coordinates to road graph nodes.
+
+A KD-tree over the projected node coordinates is built once with the
+cached graph and reused for every query. Snapping many points is a single
+vectorized tree query, so bulk jobs (accident records, many
+origin-destination pairs) stay fast.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from routing import project_coords
+
+
+class NodeIndex:
+    """
+    Nearest-node lookup over a road graph.
+
+    Attributes:
+        node_ids (np.ndarray): OSM node id per tree point.
+        lat0 (float): Reference latitude of the projection.
+    """
+
+    def __init__(self, node_ids, lat, lon):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.lat0 = float(np.mean(lat)) if len(lat) else 0.0
+        x, y = project_coords(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), self.lat0)
+        self._tree = cKDTree(np.column_stack((x, y)))
+
+    @classmethod
+    def from_csr(cls, csr_graph):
+        """
+        Builds the index over the nodes of a CSR graph.
+
+        Args:
+            csr_graph (CSRGraph): The routing graph.
+
+        Returns:
+            NodeIndex: The index.
+        """
+        return cls(csr_graph.node_ids, csr_graph.lat, csr_graph.lon)
+
+    def nearest_many(self, lat, lon, return_dist=False):
+        """
+        Snaps many coordinates to their nearest nodes in one query.
+
+        Args:
+            lat (array-like): Latitudes in degrees.
+            lon (array-like): Longitudes in degrees.
+            return_dist (bool): Whether to also return the distances.
+
+        Returns:
+            np.ndarray: The nearest OSM node id per point, and the distance
+            in metres per point if return_dist is True.
+        """
+        x, y = project_coords(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), self.lat0)
+        dist, idx = self._tree.query(np.column_stack((np.ravel(x), np.ravel(y))))
+        nodes = self.node_ids[idx]
+        if return_dist:
+            return nodes, dist
+        return nodes
+
+    def nearest(self, lat, lon):
+        """
+        Snaps one coordinate to its nearest node.
+
+        Args:
+            lat (float): The latitude in degrees.
+            lon (float): The longitude in degrees.
+
+        Returns:
+            int: The nearest OSM node id.
+        """
+        return int(self.nearest_many([lat], [lon])[0])
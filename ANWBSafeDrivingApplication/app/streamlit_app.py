@@ -3,25 +3,47 @@ import requests
 import os
 import sys
 import logging
+import time
+from backend_client import BackendClient
+from metrics import REGISTRY, queue_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    handlers=[
-        logging.FileHandler("streamlit_app.log", mode="w"),
-        logging.StreamHandler(),
-    ],
-)
+# Streamlit executes this script again on every interaction, so everything
+# that only has to happen once per process is behind st.cache_resource or
+# st.cache_data.
+rerun_start = time.perf_counter()
+
+
+# Configure logging once per process; records are written by a background thread
+@st.cache_resource
+def configure_logging():
+    return queue_logging(logging.FileHandler("streamlit_app.log", mode="w"), logging.StreamHandler())
+
+
+configure_logging()
 
 logger = logging.getLogger(__name__)
 
 # Add the pages directory to the system path to allow imports
-sys.path.append(os.path.join(os.path.dirname(__file__), "pages"))
+pages_dir = os.path.join(os.path.dirname(__file__), "pages")
+if pages_dir not in sys.path:
+    sys.path.append(pages_dir)
 
 base_url = "http://127.0.0.1:3630"
 
 
+# One keep-alive connection pool to the backend per process
+@st.cache_resource
+def get_backend_client():
+    return BackendClient(base_url)
+
+
+# Read the terms once per process
+@st.cache_data
+def load_terms_html():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "terms.html"), encoding="utf-8") as f:
+        return f.read()
+
+
 # Mock switch_page function to avoid MyPy errors
 def switch_page(page: str):
     st.session_state["current_page"] = page
@@ -34,89 +56,14 @@ def show_terms_and_conditions():
     """
     Display the terms and conditions.
     """
-    st.markdown(
-        """
-    <style>
-        .terms {
-            font-size: 8px;
-        }
-    </style>
-    <div class="terms">
-        <h4>Welcome to Straat-O-Sfeer</h4>
-        <p><strong>Terms and Conditions</strong></p>
-        <p><strong>Effective Date: 18 June 2024</strong></p>
-        <p>Welcome to Straat-O-Sfeer Limited App (straat-o-sfeer). By using
-        this App, you agree to the following summarised terms and conditions:
-        </p>
-        <ol>
-            <li><strong>Acceptance of Terms:</strong> By using the App, you agree to
-            be bound by these Terms. If you do not agree, do not use the App.</li>
-            <li><strong>Changes to Terms:</strong> We may modify these Terms at any
-            time. Continued use of the App means you accept the new Terms.</li>
-            <li><strong>Use of the App:</strong></li>
-            <ul>
-                <li><strong>Eligibility:</strong> You must be 18+ years old.</li>
-                <li><strong>License:</strong> You have a limited, non-exclusive,
-                non-transferable, revocable license for personal, non-commercial
-                use.</li>
-                <li><strong>Prohibited Conduct:</strong> Do not use the App for
-                illegal activities, distribute content without permission, use
-                automated systems to access the App, or compromise security.</li>
-            </ul>
-            <li><strong>Intellectual Property:</strong> All content and features of
-            the App are owned by Straat-O-Sfeer Law Limited and are protected by
-            intellectual property laws.</li>
-            <li><strong>Privacy Policy:</strong> Your use of the App is subject to
-            our Privacy Policy. By using the App, you consent to our data
-            practices.</li>
-            <li><strong>Use of AI:</strong> The App uses artificial intelligence to
-            provide certain features and functionalities. By using the App, you
-            agree to the use of AI as described in our Privacy Policy. Specifically,
-            we use AI to analyse various data inputs and create model outputs for
-            street risk categories. This helps to identify and categorise different
-            levels of street safety risks based on collected data.</li>
-            <li><strong>Disclaimer of Warranties:</strong> The App is provided "as
-            is" without warranties of any kind. Use the App at your own risk.</li>
-            <li><strong>Limitation of Liability:</strong> Straat-O-Sfeer Limited is
-            not liable for any damages arising from your use of the App.</li>
-            <li><strong>Indemnification:</strong> You agree to indemnify
-            Straat-O-Sfeer Limited from any claims or damages resulting from your
-            use of the App or violation of these Terms.</li>
-            <li><strong>Right to Be Anonymised:</strong> You have the right to request the
-            anonymisation of your personal data. This means that we will remove or
-            alter any personal identifiers so that the data can no longer be
-            associated with you.</li>
-            <li><strong>User Data Requests:</strong> You have the right to request access
-            to the personal data we hold about you. You can request the correction,
-            deletion, or anonymisation of your data, and we will comply in accordance
-            with our Privacy Policy and applicable laws.</li>
-            <li><strong>Right to Data Deletion:</strong> You have the right to request the
-            deletion of your personal data. Upon receiving such a request, we will
-            delete your data from our records, except where we are required to retain
-            it for legal reasons.</li>
-            <li><strong>Governing Law:</strong> These Terms are governed by the laws
-            of the European Union's AI Act. Any disputes will be resolved under the
-            jurisdiction of the courts of the European Union.</li>
-            <li><strong>Contact Information:</strong> For questions, contact us at:</li>
-            <ul>
-                <li>Address: Monseigneur Hopmansstraat 2, 4817 JS Breda</li>
-                <li>Phone: 076 533 2203</li>
-                <li>Email: agmapplication@buas.nl</li>
-            </ul>
-        </ol>
-        <p>By using the App, you acknowledge that you have read, understood,
-        and agree to these Terms and Conditions.</p>
-    </div>
-    """,
-        unsafe_allow_html=True,
-    )
+    st.markdown(load_terms_html(), unsafe_allow_html=True)
 
     col1, col2 = st.columns(2)
 
     with col1:
         if st.button("I Accept"):
             st.session_state["accepted_terms"] = True
-            st.experimental_rerun()
+            st.rerun()
 
     with col2:
         if st.button("Disagree"):
@@ -141,7 +88,7 @@ def log_in(username, password):
     """
     payload = {"username": username, "password": password}
     try:
-        response = requests.post(f"{base_url}/log-in", json=payload)
+        response = get_backend_client().post("/log-in", payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -169,7 +116,7 @@ def sign_up(first_name, last_name, email, password):
         "password": password,
     }
     try:
-        response = requests.post(f"{base_url}/sign-up", json=payload)
+        response = get_backend_client().post("/sign-up", payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -184,6 +131,52 @@ def log_out():
     st.session_state["logged_in"] = False
 
 
+@st.fragment
+def signup_form():
+    """
+    Display the sign-up form; typing in it reruns only the form.
+    """
+    st.header("Create new account")
+    first_name = st.text_input("First Name", key="signup_first_name")
+    last_name = st.text_input("Last Name", key="signup_last_name")
+    email = st.text_input("Email", key="signup_email")
+    password = st.text_input("Password", key="signup_password",
+                             type="password")
+
+    if st.button("Create account"):
+        result = sign_up(first_name, last_name, email, password)
+        if result["status"] == "success":
+            st.success(result["message"])
+            st.session_state["logged_in"] = True
+            st.session_state["user_name"] = result["user_name"]
+            st.session_state["current_page"] = "Route"
+            st.rerun()
+        else:
+            st.error(result["message"])
+
+
+@st.fragment
+def login_form():
+    """
+    Display the login form; typing in it reruns only the form.
+    """
+    st.header("Login to existing account")
+    username = st.text_input("Username", key="login_username")
+    password = st.text_input("Password", key="login_password",
+                             type="password")
+
+    if st.button("Log In"):
+        result = log_in(username, password)
+        if result["status"] == "success":
+            st.session_state["logged_in"] = True
+            st.session_state["user_name"] = result["user_name"]
+            st.success("Logged in!")
+            st.session_state["current_page"] = "Route"
+            st.rerun()
+        else:
+            st.error(result["message"])
+
+
 # Initialize session state variables
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
@@ -205,40 +198,10 @@ if st.session_state["accepted_terms"] and not st.session_state["logged_in"]:
     tab1, tab2, tab3 = st.tabs(["Signup", "Log-in", "Guest"])
 
     with tab1:
-        st.header("Create new account")
-        first_name = st.text_input("First Name", key="signup_first_name")
-        last_name = st.text_input("Last Name", key="signup_last_name")
-        email = st.text_input("Email", key="signup_email")
-        password = st.text_input("Password", key="signup_password",
-                                 type="password")
-
-        if st.button("Create account"):
-            result = sign_up(first_name, last_name, email, password)
-            if result["status"] == "success":
-                st.success(result["message"])
-                st.session_state["logged_in"] = True
-                st.session_state["user_name"] = result["user_name"]
-                st.session_state["current_page"] = "Route"
-                st.experimental_rerun()
-            else:
-                st.error(result["message"])
+        signup_form()
 
     with tab2:
-        st.header("Login to existing account")
-        username = st.text_input("Username", key="login_username")
-        password = st.text_input("Password", key="login_password",
-                                 type="password")
-
-        if st.button("Log In"):
-            result = log_in(username, password)
-            if result["status"] == "success":
-                st.session_state["logged_in"] = True
-                st.session_state["user_name"] = result["user_name"]
-                st.success("Logged in!")
-                st.session_state["current_page"] = "Route"
-                st.experimental_rerun()
-            else:
-                st.error(result["message"])
+        login_form()
 
     with tab3:
         st.header("Guest login")
@@ -247,16 +210,20 @@ if st.session_state["accepted_terms"] and not st.session_state["logged_in"]:
             st.session_state["user_name"] = "Guest"
             st.success("Logged in as Guest!")
             st.session_state["current_page"] = "Route"
-            st.experimental_rerun()
+            st.rerun()
 
 elif st.session_state["logged_in"]:
     st.write(f"Logged in as {st.session_state['user_name']}!")
     if st.button("Log Out"):
         log_out()
         st.success("Logged out successfully.")
-        st.experimental_rerun()
+        st.rerun()
 
     if st.button("Delete User"):
         st.success("User deleted successfully.")
         log_out()
-        st.experimental_rerun()
+        st.rerun()
+
+# Time every full rerun of the page; reruns cut short by st.rerun, st.stop or
+# a page switch are not counted
+REGISTRY.observe("ui.login_rerun", time.perf_counter() - rerun_start)
@@ -0,0 +1,28 @@
+"""
+Makes the app modules importable in the tests, as when running from the app
+directory, and lets tests move the engines' clock.
+"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeDatetime:
+    today = datetime(2024, 3, 1, 23, 59)
+
+    @classmethod
+    def now(cls):
+        return cls.today
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import route_engine
+
+    monkeypatch.setattr(route_engine, "datetime", FakeDatetime)
+    FakeDatetime.today = datetime(2024, 3, 1, 23, 59)
+    return FakeDatetime
@@ -0,0 +1,18 @@
+import multiprocessing
+
+from accident_join import bounded_imap
+
+
+def test_bounded_imap_reads_ahead_only_the_window():
+    read = []
+
+    def items():
+        for i in range(100):
+            read.append(i)
+            yield i
+
+    with multiprocessing.Pool(2) as pool:
+        results = bounded_imap(pool, abs, items(), 4)
+        assert next(results) == 0
+        assert len(read) == 5
+        assert list(results) == list(range(1, 100))
@@ -0,0 +1,98 @@
+from geocoder import Gazetteer, Place, split_address
+from route_engine import geocode
+
+KERKSTRAAT = Place("Kerkstraat", 51.58, 4.77, "Breda")
+
+
+class FakeGeocoder:
+    def __init__(self, location=None):
+        self.location = location
+        self.queries = []
+
+    def geocode(self, address):
+        self.queries.append(address)
+        return self.location
+
+
+def breda_gazetteer():
+    return Gazetteer([KERKSTRAAT, Place("Breda", 51.59, 4.78, "Breda")])
+
+
+def test_split_address():
+    assert split_address("Kerkstraat 12, 4811 AB Breda, Netherlands") == ("kerkstraat", "12", "breda")
+    assert split_address("kerkstraat 12 utrecht") == ("kerkstraat", "12", "utrecht")
+    assert split_address("Kerkstraat, Amsterdam") == ("kerkstraat", None, "amsterdam")
+    assert split_address("Kerkstraat") == ("kerkstraat", None, None)
+
+
+def test_lookup_matches_street_in_own_city():
+    gazetteer = breda_gazetteer()
+    assert gazetteer.lookup("kerkstraat") == KERKSTRAAT
+    assert gazetteer.lookup("Kerkstraat, Breda") == KERKSTRAAT
+    assert gazetteer.lookup("kerkstrat") == KERKSTRAAT
+
+
+def test_lookup_skips_other_locality():
+    gazetteer = breda_gazetteer()
+    assert gazetteer.lookup("Kerkstraat, Amsterdam") is None
+    assert gazetteer.lookup("Kerkstraat 12 Utrecht") is None
+
+
+def test_lookup_marks_house_number_approximate():
+    place = breda_gazetteer().lookup("Kerkstraat 12, Breda")
+    assert place.approximate
+    assert (place.latitude, place.longitude) == (KERKSTRAAT.latitude, KERKSTRAAT.longitude)
+    assert not breda_gazetteer().lookup("Kerkstraat").approximate
+
+
+def test_lookup_picks_street_by_locality():
+    tilburg = Place("Kerkstraat", 51.55, 5.07, "Tilburg")
+    gazetteer = Gazetteer([KERKSTRAAT, tilburg])
+    assert gazetteer.lookup("Kerkstraat, Tilburg") == tilburg
+    assert gazetteer.lookup("Kerkstraat, Breda") == KERKSTRAAT
+    # Ambiguous without a locality
+    assert gazetteer.lookup("Kerkstraat") is None
+
+
+def test_geocode_asks_fallback_for_other_locality():
+    amsterdam = Place("Kerkstraat, Amsterdam", 52.37, 4.89)
+    fallback = FakeGeocoder(amsterdam)
+    assert geocode(breda_gazetteer(), fallback, "kerkstraat, amsterdam") == amsterdam
+    assert fallback.queries == ["kerkstraat, amsterdam"]
+
+
+def test_geocode_prefers_fallback_for_house_number():
+    house = Place("Kerkstraat 12, Breda", 51.581, 4.772)
+    assert geocode(breda_gazetteer(), FakeGeocoder(house), "kerkstraat 12, breda") == house
+
+    # Without an online answer the street is used, marked approximate
+    place = geocode(breda_gazetteer(), FakeGeocoder(None), "kerkstraat 12, breda")
+    assert place.approximate and place.address == "Kerkstraat"
+    assert geocode(breda_gazetteer(), None, "kerkstraat 12, breda").approximate
+
+
+def test_geocode_skips_fallback_for_street():
+    fallback = FakeGeocoder()
+    assert geocode(breda_gazetteer(), fallback, "kerkstraat") == KERKSTRAAT
+    assert fallback.queries == []
+
+
+def test_lookup_keeps_number_in_street_name():
+    plein = Place("Plein 1944", 51.59, 4.78, "Breda")
+    gazetteer = Gazetteer([plein, Place("Plein 1940", 51.58, 4.77, "Breda")])
+    assert gazetteer.lookup("Plein 1944, Breda") == plein
+
+
+def test_lookup_house_number_does_not_match_longer_street_name():
+    plein = Place("Plein", 51.58, 4.77, "Breda")
+    gazetteer = Gazetteer([plein, Place("Plein 1944", 51.59, 4.78, "Breda")])
+    place = gazetteer.lookup("Plein 19, Breda")
+    assert place.address == "Plein"
+    assert place.approximate
+
+
+def test_lookup_skips_prefix_of_short_query():
+    gazetteer = breda_gazetteer()
+    assert gazetteer.lookup("k") is None
+    assert gazetteer.lookup("ke") is None
+    assert gazetteer.lookup("ker") == KERKSTRAAT
@@ -0,0 +1,55 @@
+import networkx as nx
+
+from geocoder import Gazetteer, Place
+from graph_tiles import RegionCache, nearest_locality, street_stretches
+
+BREDA = Place("Breda", 51.59, 4.78, "Breda")
+TILBURG = Place("Tilburg", 51.56, 5.09, "Tilburg")
+
+
+class Region:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def two_kerkstraten():
+    G = nx.MultiDiGraph()
+    for node, (lat, lon) in enumerate([(51.590, 4.780), (51.591, 4.781), (51.560, 5.090), (51.561, 5.091)]):
+        G.add_node(node, y=lat, x=lon)
+    G.add_edge(0, 1, name="Kerkstraat")
+    G.add_edge(2, 3, name="Kerkstraat")
+    G.add_edge(1, 2, name="A58")
+    return G
+
+
+def test_street_stretches_keep_same_name_apart():
+    stretches = sorted((street, sorted(nodes)) for street, nodes in street_stretches(two_kerkstraten()))
+    assert stretches == [("A58", [1, 2]), ("Kerkstraat", [0, 1]), ("Kerkstraat", [2, 3])]
+
+
+def test_streets_are_named_by_nearest_locality():
+    G = two_kerkstraten()
+    locality_of = nearest_locality([BREDA, TILBURG])
+    places = []
+    for street, nodes in street_stretches(G):
+        lat = sum(G.nodes[node]["y"] for node in nodes) / len(nodes)
+        lon = sum(G.nodes[node]["x"] for node in nodes) / len(nodes)
+        places.append(Place(street, lat, lon, locality_of(lat, lon)))
+
+    gazetteer = Gazetteer(places + [BREDA, TILBURG])
+    assert gazetteer.lookup("Kerkstraat, Tilburg").latitude < 51.57
+    assert gazetteer.lookup("Kerkstraat 4 Breda").latitude > 51.58
+    assert gazetteer.lookup("Kerkstraat") is None
+
+
+def test_region_cache_is_bounded_by_bytes():
+    cache = RegionCache(100)
+    small, large = Region(40), Region(50)
+    assert cache.put(frozenset({(0, 0)}), small) == []
+    assert cache.put(frozenset({(0, 1)}), large) == []
+    dropped = cache.put(frozenset({(1, 1)}), Region(30))
+    assert dropped == [small]
+    assert cache.nbytes() == 80
+    # A region over the budget on its own is still kept
+    assert len(cache.put(frozenset({(2, 2)}), Region(500))) == 2
+    assert len(cache) == 1
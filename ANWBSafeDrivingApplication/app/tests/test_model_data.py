@@ -0,0 +1,40 @@
+import os
+
+import pandas as pd
+import pytest
+
+from model_data import COLUMN_TYPES, convert, load_model_data
+from risk_index import DEFAULT_RISK, RiskIndex
+
+pytest.importorskip("pyarrow")
+
+
+def write_csv(path, risk_levels):
+    pd.DataFrame({
+        "road_name": ["Kerkstraat", "Markt"],
+        "month": [3, 3],
+        "day": [1, 1],
+        "most_common_condition": [1, 2],
+        "avg_yearly_accidents": [1.5, 0.5],
+        "average_monthly_occurrences": [0.2, 0.1],
+        "Risk Level": risk_levels,
+    }).to_csv(path, index=False)
+
+
+def test_missing_risk_label_reads_as_default(tmp_path):
+    csv_path = str(tmp_path / "model_data.csv")
+    write_csv(csv_path, [2, None])
+    df = load_model_data(csv_path)
+    assert list(df.columns) == list(COLUMN_TYPES)
+    assert df["Risk Level"].isna().tolist() == [False, True]
+    index = RiskIndex.from_frame(df, month=3, day=1)
+    assert index.road("Kerkstraat") == 2
+    assert index.road("Markt") == DEFAULT_RISK
+
+
+def test_convert_leaves_no_temporary_file(tmp_path):
+    csv_path = str(tmp_path / "model_data.csv")
+    write_csv(csv_path, [2, 1])
+    convert(csv_path)
+    convert(csv_path)
+    assert sorted(os.listdir(tmp_path)) == ["model_data.csv", "model_data.feather"]
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from risk_model import LinearScorer, check_parity
+from risk_table import FEATURES
+
+
+def sample_rows(n=5000, seed=0):
+    # Label-encoded rows shaped like the model data
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "month": rng.integers(1, 13, n),
+        "day": rng.integers(1, 32, n),
+        "most_common_condition": rng.integers(0, 4, n),
+        "avg_yearly_accidents": rng.gamma(2.0, 3.0, n),
+        "average_monthly_occurrences": rng.gamma(1.5, 0.5, n),
+    })[FEATURES]
+
+
+def risk_levels(X, classes):
+    # Noisy levels that grow with the accident averages
+    noise = np.random.default_rng(1).normal(0.0, 2.0, len(X))
+    score = X["avg_yearly_accidents"] + 4 * X["average_monthly_occurrences"] + noise
+    return np.digitize(score, np.quantile(score, np.linspace(0, 1, classes + 1)[1:-1]))
+
+
+@pytest.mark.parametrize("classes", [2, 4])
+@pytest.mark.parametrize("scaled", [False, True])
+def test_scorer_matches_predict(classes, scaled):
+    X = sample_rows()
+    y = risk_levels(X, classes)
+    classifier = LogisticRegression(max_iter=2000)
+    model = make_pipeline(StandardScaler(), classifier) if scaled else classifier
+    model.fit(X, y)
+
+    scorer = LinearScorer.from_model(model)
+    expected = model.predict(X)
+    assert (scorer.predict(X) == expected).all()
+    assert (scorer.predict(X.to_numpy()) == expected).all()
+    assert [scorer.predict_one(row) for row in X.head(50).itertuples(index=False)] == expected[:50].tolist()
+    assert check_parity(model, scorer, X) == 0
+
+
+def test_scorer_rejects_unsupported_model():
+    from sklearn.tree import DecisionTreeClassifier
+
+    X = sample_rows(200)
+    model = DecisionTreeClassifier().fit(X, risk_levels(X, 4))
+    with pytest.raises(TypeError):
+        LinearScorer.from_model(model)
@@ -0,0 +1,32 @@
+import os
+from datetime import datetime
+
+from risk_tiles import RiskTileCache, tile_range
+from test_route_engine import line_engine
+
+
+def test_old_versions_are_served_from_disk_only(clock, tmp_path):
+    engine = line_engine()
+    cache = RiskTileCache(engine, str(tmp_path))
+    yesterday = cache.version()
+    assert yesterday == "20240301T230000-03-01"
+    zoom = cache.max_zoom
+    x, _, y, _ = tile_range(cache.bounds(), zoom)
+    png = cache.tile(yesterday, zoom, x, y)
+    assert png is not None
+
+    clock.today = datetime(2024, 3, 2, 0, 1)
+    today = cache.version()
+    assert today != yesterday
+    assert cache.tile(yesterday, zoom, x, y) == png
+    # Once pruned, tiles of a version that is not today's are never rendered again
+    os.remove(cache.path(yesterday, zoom, x, y))
+    assert cache.tile(yesterday, zoom, x, y) is None
+    assert cache.tile(today, zoom, x, y) is not None
+    assert cache.tile("../etc", zoom, x, y) is None
+
+
+def test_version_without_risk_table_matches_today_risk(clock):
+    engine = line_engine()
+    engine.risk_table = None
+    assert engine.today_risk_version() == engine.today_risk()[0].version
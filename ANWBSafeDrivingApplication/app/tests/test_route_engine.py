@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import networkx as nx
+import numpy as np
+
+from risk_table import RiskTable, day_of_year
+from route_engine import RouteEngine
+
+
+def line_engine():
+    G = nx.MultiDiGraph()
+    for node in range(3):
+        G.add_node(node, y=51.58, x=4.77 + 0.001 * node)
+    G.add_edge(0, 1, length=70.0, name="Kerkstraat")
+    G.add_edge(1, 2, length=70.0, name="Markt")
+    risk = np.zeros((366, 2), dtype=np.int8)
+    # Kerkstraat gets riskier from 2 March
+    risk[day_of_year(3, 2):, 0] = 2
+    return RouteEngine(G, RiskTable(np.array(["Kerkstraat", "Markt"]), risk, "20240301T230000"))
+
+
+def test_today_risk_version_changes_with_date(clock):
+    engine = line_engine()
+    version = engine.today_risk_version()
+    assert version == engine.today_risk()[0].version
+    assert engine.route(0, 2).roads[0][1] == 0
+
+    clock.today = datetime(2024, 3, 2, 0, 1)
+    assert engine.today_risk_version() != version
+    assert engine.today_risk_version() == engine.today_risk()[0].version
+    assert engine.route(0, 2).roads[0][1] == 2
+
+
+def test_today_risk_drops_other_dates(clock):
+    engine = line_engine()
+    for day in range(1, 8):
+        clock.today = datetime(2024, 3, day, 12, 0)
+        engine.today_risk()
+    engine.risk_for(5, 1)
+    assert len(engine._risk) == 2
+
+    clock.today = datetime(2024, 3, 8, 12, 0)
+    engine.today_risk()
+    assert list(engine._risk) == [(3, 8, None)]
@@ -0,0 +1,97 @@
+import hashlib
+import importlib
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def backend(tmp_path_factory):
+    # The backend writes app.log to the working directory and opens its
+    # accounts at import, at USER_DB_PATH as read when user_store is first
+    # imported; keep both out of the app directory
+    tmp_dir = tmp_path_factory.mktemp("backend")
+    cwd, environ = os.getcwd(), dict(os.environ)
+    os.chdir(tmp_dir)
+    os.environ.update(USER_DB_PATH=str(tmp_dir / "seed.db"), NOMINATIM_FALLBACK="0")
+    try:
+        if "user_store" in sys.modules:
+            importlib.reload(sys.modules["user_store"])
+        return importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+@pytest.fixture
+def user_store(backend):
+    return sys.modules["user_store"]
+
+
+@pytest.fixture
+def client(backend, user_store, tmp_path, monkeypatch):
+    store = user_store.UserStore(str(tmp_path / "users.db"))
+    monkeypatch.setattr(backend, "user_store", store)
+    return backend.app.test_client(), store
+
+
+def sign_up(client, email, password="secret"):
+    return client.post("/sign-up", json={"first_name": "Ada", "last_name": "Lovelace", "email": email,
+                                         "password": password})
+
+
+def log_in(client, username, password="secret"):
+    return client.post("/log-in", json={"username": username, "password": password})
+
+
+def test_normalize_email(user_store):
+    assert user_store.normalize_email("  Ada@Example.COM ") == "ada@example.com"
+
+
+def test_login_outcomes(client):
+    client, store = client
+    assert sign_up(client, " Ada@Example.com ").status_code == 200
+    assert store.password_hash("ada@example.com").startswith("scrypt$")
+
+    assert log_in(client, "ADA@example.com").status_code == 200
+    assert log_in(client, "ada@example.com", "wrong").status_code == 401
+    assert log_in(client, "nobody@example.com").status_code == 401
+    assert log_in(client, "", "secret").status_code == 400
+
+
+def test_duplicate_sign_up_conflicts(client):
+    client, store = client
+    assert sign_up(client, "ada@example.com").status_code == 200
+    response = sign_up(client, "Ada@Example.com ", "other")
+    assert response.status_code == 409
+    assert log_in(client, "ada@example.com").status_code == 200
+
+
+def test_unknown_account_is_verified_against_dummy_hash(client, user_store, monkeypatch):
+    client, _ = client
+    checked = []
+    verify = user_store.verify_password
+
+    def spy(password, encoded):
+        checked.append(encoded)
+        return verify(password, encoded)
+
+    monkeypatch.setattr(user_store, "verify_password", spy)
+    assert log_in(client, "nobody@example.com").status_code == 401
+    assert checked == [user_store.dummy_hash()]
+    assert user_store.dummy_hash().startswith("scrypt$")
+
+
+def test_legacy_hash_is_upgraded_on_login(client, user_store):
+    client, store = client
+    store.add_user("old@example.com", hashlib.sha256(b"secret").hexdigest())
+    assert log_in(client, "old@example.com", "wrong").status_code == 401
+    assert user_store.needs_rehash(store.password_hash("old@example.com"))
+
+    assert log_in(client, "old@example.com").status_code == 200
+    upgraded = store.password_hash("old@example.com")
+    assert not user_store.needs_rehash(upgraded)
+    assert log_in(client, "old@example.com").status_code == 200
+    assert store.password_hash("old@example.com") == upgraded
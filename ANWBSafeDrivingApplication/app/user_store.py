@@ -0,0 +1,421 @@
+"""
+Persistent user accounts for the Flask backend.
+
+Accounts are stored in a SQLite file shared by all backend workers, with a
+unique index on the email address. Each process keeps a small pool of
+connections, and the database runs in WAL mode so logins in one worker do
+not block reads in another.
+
+Passwords are hashed with salted scrypt, which is slow and memory-hard by
+design. Hashing runs in a bounded thread pool (scrypt releases the GIL), so
+a burst of logins uses at most HASH_WORKERS cores and is turned away once
+HASH_QUEUE requests are waiting, instead of holding every request thread.
+Accounts carried over from the old SHA-256 hashes are rehashed with scrypt
+on their next successful login.
+
+Usage:
+    python user_store.py loadtest --workers 1 2 4 --clients 8
+    python user_store.py loadtest --url http://127.0.0.1:3630 --clients 8
+"""
+import argparse
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_DB_PATH = os.environ.get("USER_DB_PATH", os.path.join(APP_DIR, "users.db"))
+
+# Connections kept open per process
+POOL_SIZE = 4
+
+# scrypt cost: 2**14 rounds with r=8 use 16 MiB and about 50-100 ms per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+# Hashes computed at once per process
+HASH_WORKERS = 2
+
+# Hash requests allowed to wait for a worker before new ones are refused
+HASH_QUEUE = 16
+
+# Seconds a request waits for a place in the hash queue
+HASH_WAIT = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    password_hash TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email);
+"""
+
+
+def normalize_email(email):
+    """
+    Normalizes an email address or username for storage and lookup.
+
+    Args:
+        email (str): The address.
+
+    Returns:
+        str: The address without surrounding spaces, in lowercase.
+    """
+    return email.strip().lower()
+
+
+def hash_password(password, salt=None):
+    """
+    Hashes a password with salted scrypt.
+
+    Args:
+        password (str): The password.
+        salt (bytes): The salt, random by default.
+
+    Returns:
+        str: 'scrypt$n$r$p$salt$hash' with salt and hash in hex.
+    """
+    salt = salt if salt is not None else os.urandom(SALT_BYTES)
+    digest = hashlib.scrypt(
+        password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, maxmem=64 * 1024 * 1024
+    )
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, encoded):
+    """
+    Checks a password against a stored hash.
+
+    Args:
+        password (str): The password.
+        encoded (str): A hash from `hash_password`, or a bare SHA-256 hex
+            digest from the old in-memory accounts.
+
+    Returns:
+        bool: Whether the password matches.
+    """
+    if not encoded.startswith("scrypt$"):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+    _, n, r, p, salt, expected = encoded.split("$")
+    digest = hashlib.scrypt(
+        password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p), maxmem=64 * 1024 * 1024
+    )
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+@lru_cache(maxsize=1)
+def dummy_hash():
+    """
+    Returns the hash of a random password, checked on logins to unknown
+    accounts so they take as long as logins to existing ones.
+
+    Returns:
+        str: A hash from `hash_password` that no password matches.
+    """
+    return hash_password(os.urandom(SALT_BYTES).hex())
+
+
+def needs_rehash(encoded):
+    """
+    Tells whether a stored hash is weaker than the current settings.
+
+    Args:
+        encoded (str): The stored hash.
+
+    Returns:
+        bool: Whether it should be replaced after the next login.
+    """
+    return not encoded.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+class PasswordHasher:
+    """
+    Bounded thread pool for password hashing.
+
+    The pool is started on first use in each process, so a backend
+    preloaded before gunicorn forks gets one per worker.
+
+    Attributes:
+        workers (int): Hashes computed at once.
+        queue_size (int): Requests allowed to wait for a worker.
+        wait (float): Seconds to wait for a place in the queue.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, queue_size=HASH_QUEUE, wait=HASH_WAIT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, function, *args):
+        """
+        Runs a hashing function in the pool and waits for its result.
+
+        Args:
+            function (callable): `hash_password` or `verify_password`.
+            *args: Its arguments.
+
+        Returns:
+            The function's result.
+
+        Raises:
+            TimeoutError: If the queue stays full for `wait` seconds.
+        """
+        if not self._slots.acquire(timeout=self.wait):
+            raise TimeoutError("Password hashing is busy")
+        try:
+            return self._pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self.run(hash_password, password)
+
+    def verify(self, password, encoded):
+        return self.run(verify_password, password, encoded)
+
+
+class UserStore:
+    """
+    SQLite-backed accounts with a per-process connection pool.
+
+    Attributes:
+        path (str): The database file.
+        pool_size (int): Connections kept open.
+    """
+
+    def __init__(self, path=USER_DB_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._pid = None
+        self._lock = threading.Lock()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a pooled connection, opening one if none is free.
+
+        Connections opened before a fork are not reused in the child.
+
+        Yields:
+            sqlite3.Connection: The connection, in autocommit mode.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = queue.LifoQueue()
+                self._pid = os.getpid()
+            pool = self._pool
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if pool.qsize() < self.pool_size:
+                pool.put(conn)
+            else:
+                conn.close()
+
+    def password_hash(self, email):
+        """
+        Returns the stored password hash of an account.
+
+        Args:
+            email (str): The email address or username.
+
+        Returns:
+            str: The hash, or None if there is no such account.
+        """
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT password_hash FROM users WHERE email = ?", (normalize_email(email),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, email, password_hash, first_name=None, last_name=None):
+        """
+        Creates an account.
+
+        Args:
+            email (str): The email address or username.
+            password_hash (str): The hashed password.
+            first_name (str): The first name.
+            last_name (str): The last name.
+
+        Returns:
+            bool: False if the account already exists.
+        """
+        try:
+            with self.connection() as conn:
+                conn.execute(
+                    "INSERT INTO users (email, first_name, last_name, password_hash, created) VALUES (?, ?, ?, ?, ?)",
+                    (normalize_email(email), first_name, last_name, password_hash,
+                     datetime.now().isoformat(timespec="seconds")),
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def set_password_hash(self, email, password_hash):
+        """
+        Replaces the password hash of an account.
+
+        Args:
+            email (str): The email address or username.
+            password_hash (str): The new hash.
+        """
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE users SET password_hash = ? WHERE email = ?", (password_hash, normalize_email(email))
+            )
+
+    def seed(self, users):
+        """
+        Adds accounts that do not exist yet.
+
+        Args:
+            users (dict): Password hash per email address or username.
+        """
+        for email, password_hash in users.items():
+            self.add_user(email, password_hash)
+
+
+def load_test(login, accounts, clients=8, seconds=5.0):
+    """
+    Logs in from several client threads for a while and counts successes.
+
+    Args:
+        login (callable): Called with (email, password), returns whether
+            the login succeeded.
+        accounts (list): (email, password) pairs to log in with.
+        clients (int): Concurrent client threads.
+        seconds (float): Duration of the test.
+
+    Returns:
+        dict: Logins per second, failures and median and 95th percentile
+        latency in milliseconds.
+    """
+    deadline = time.perf_counter() + seconds
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+
+    def client(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            email, password = accounts[i % len(accounts)]
+            start = time.perf_counter()
+            try:
+                ok = login(email, password)
+            except TimeoutError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    failures[0] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "logins_per_second": len(latencies) / elapsed,
+        "failures": failures[0],
+        "median_ms": 1000 * statistics.median(latencies) if latencies else 0.0,
+        "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test password logins.")
+    parser.add_argument("command", choices=["loadtest"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Hash pool sizes to compare")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--url", help="Log in through a running backend instead of in-process")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    accounts = [(f"loadtest{i}@example.com", f"password{i}") for i in range(args.accounts)]
+    if args.url:
+        import requests
+
+        for email, password in accounts:
+            requests.post(f"{args.url}/sign-up", json={
+                "first_name": "Load", "last_name": "Test", "email": email, "password": password,
+            }, timeout=30)
+
+        def login(email, password):
+            response = requests.post(f"{args.url}/log-in", json={"username": email, "password": password}, timeout=30)
+            return response.status_code == 200
+
+        result = load_test(login, accounts, args.clients, args.seconds)
+        print(f"{args.url}: {result['logins_per_second']:.1f} logins/s, {result['failures']} failed, "
+              f"median {result['median_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = UserStore(os.path.join(tmp_dir, "users.db"))
+        for email, password in accounts:
+            store.add_user(email, hash_password(password))
+        for workers in args.workers:
+            hasher = PasswordHasher(workers, queue_size=args.clients, wait=30)
+
+            def login(email, password):
+                encoded = store.password_hash(email)
+                return encoded is not None and hasher.verify(password, encoded)
+
+            result = load_test(login, accounts, args.clients, args.seconds)
+            print(f"{workers} hash workers: {result['logins_per_second']:.1f} logins/s, "
+                  f"median {result['median_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()